@@ -1,38 +1,159 @@
-from flask import Flask, render_template
+import time
+IMPORT_STARTED = time.perf_counter() # When this package started importing, for the startup profile (see startup.py)
+
+from flask import Flask, render_template, session
 from flask_login import LoginManager
 from flask_sqlalchemy import SQLAlchemy
 from flask_socketio import SocketIO
+from .state import State
+from .deckcache import DeckCache
+from .identity import IdentityCache
+from .persistence import ResultWriter
+from .metrics import Metrics
+from .friends import FriendGraph
+from .leaderboard import Leaderboards
+from .history import MatchHistory
+from .pagecache import PageCache
+from .passwords import PasswordHasher
+from .assets import Assets
+from .storage import Storage, RoutingSession
+from . import migrations
+IMPORTED = time.perf_counter()
 
 # This initialises SQLAlchemy for use with databases and querying.
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession}) # The session sends queries from @read_only views to the read connections. See storage.py.
+storage = Storage() # This applies the SQLite tuning settings below to every database connection.
 socketio = SocketIO()
+state = State() # This holds the matchmaking queues and rooms. See state.py for the available backends.
+deck_cache = DeckCache() # This keeps the questions of recently played decks in memory, ready for new rooms.
+identities = IdentityCache() # This keeps logged in users in memory, so current_user doesn't need a database query. See identity.py.
+results_writer = ResultWriter() # This records finished matches in the database in batches, off the request path. See persistence.py.
+metrics = Metrics() # This times socket events and web requests, and serves the timings on /metrics when enabled. See metrics.py.
+friend_graph = FriendGraph() # This keeps each user's friends list in memory, so /profile needs at most one query. See friends.py.
+leaderboards = Leaderboards() # This keeps the global and per-deck leaderboards ranked in memory. See leaderboard.py.
+match_history = MatchHistory() # This keeps each user's statistics and head-to-head records as their matches are recorded. See history.py.
+page_cache = PageCache() # This keeps rendered pages which rarely change, and answers conditional GETs for them. See pagecache.py.
+password_hasher = PasswordHasher() # This hashes passwords on a pool of native threads, so logins don't stall the worker. See passwords.py.
+assets = Assets() # This serves the fingerprinted, precompressed static files built by python -m QuizLive.assets. See assets.py.
 
 def page_not_found(e): # If a page doesn't exist on the server, then this handles the error. 
   return render_template('404.html'), 404
 
-def create_app():
+def green_patched(mode): # Whether eventlet or gevent has monkey patched the standard library, which they need to work
+    if mode == 'eventlet':
+        from eventlet import patcher
+        return patcher.is_monkey_patched('socket')
+    from gevent import monkey
+    return monkey.is_module_patched('socket')
+
+def create_app(test_config=None):
+    from .startup import StartupProfile, init_templates, precompile
+    profile = StartupProfile() # Times each stage below, so slow starts can be tracked down. See startup.py.
+    profile.add('imports', IMPORTED - IMPORT_STARTED) # Only the first create_app in a process actually pays for these
     app = Flask(__name__) # This instantiates the flask app and server
     app.register_error_handler(404, page_not_found) # This registers the above error handling code 
 
     app.config['SECRET_KEY'] = 'de0baae8808bb178caaeb3b06082374c7f1c4d62489c8506' # a very long secret key. This is generated and used to hash passwords and session cookies. I made it long for maximum security
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.sqlite' # connects the server to the sqlite database in the root folder.
+    app.config['SQLITE_JOURNAL_MODE'] = 'wal' # Lets pages keep reading while a write is committed. See storage.py for what each of these SQLite settings does.
+    app.config['SQLITE_SYNCHRONOUS'] = 'normal' # Safe with WAL, and much faster than the default 'full'
+    app.config['SQLITE_CACHE_SIZE'] = -16000 # 16MB of pages cached by each connection
+    app.config['SQLITE_MMAP_SIZE'] = 256 * 1024 * 1024 # Read up to 256MB of the database through memory mapping
+    app.config['SQLITE_BUSY_TIMEOUT'] = 10000 # Milliseconds to wait for another connection's write before failing with "database is locked"
+    app.config['SQLITE_READ_POOL_SIZE'] = 5 # Read-only connections for @read_only pages. 0 sends everything through the normal connections.
+    app.config['MIGRATE_ON_STARTUP'] = True # Create missing tables and apply pending schema migrations (see migrations.py) when the app starts
+    app.config['PASSWORD_HASH_METHOD'] = 'scrypt' # How new passwords are hashed. Any method Werkzeug supports, e.g. 'pbkdf2:sha256:600000'. Older hashes are upgraded at login.
+    app.config['PASSWORD_HASH_WORKERS'] = 2 # Most passwords hashed at once, each on its own thread. 0 hashes them inline in the request.
+    app.config['STATE_BACKEND'] = 'memory' # 'memory' keeps games in this process. Use 'sqlite' when running more than one worker process.
+    app.config['STATE_SQLITE_PATH'] = None # Where the 'sqlite' backend keeps its state. Defaults to state.sqlite in the instance folder.
+    app.config['SOCKETIO_ASYNC_MODE'] = None # 'threading', 'eventlet' or 'gevent'. None picks the first one installed, in that order from eventlet. See serve.py.
+    app.config['SOCKETIO_SERIALIZER'] = 'default' # 'default' sends socket packets as JSON. 'msgpack' sends MessagePack, which needs the msgpack package. See protocol.py.
+    app.config['SOCKETIO_MESSAGE_QUEUE'] = None # e.g. 'redis://localhost:6379/0'. Needed with more than one worker, so that emits reach sockets connected to other workers.
+    app.config['PREFETCH_QUESTIONS'] = True # Send pages all of a match's questions (without the answers) when it starts, so they can show each one without a round trip. See protocol.py.
+    app.config['ROOM_FINISHED_TTL'] = 600 # Seconds a finished room is kept for, so both players can see their results
+    app.config['ROOM_IDLE_TTL'] = 3600 # Seconds before an untouched room is treated as abandoned
+    app.config['MAX_ROOMS'] = None # Optional cap on the number of live rooms
+    app.config['MATCHMAKING_BASE_BAND'] = 100 # Largest ELO difference accepted for a random opponent as soon as a player queues
+    app.config['MATCHMAKING_BAND_GROWTH'] = 25 # How much that difference widens for every second a player waits
+    app.config['MATCHMAKING_MAX_BAND'] = 1000 # The widest the difference can get
+    app.config['MATCHMAKING_TIMEOUT'] = 120 # Seconds before a player waiting for a random opponent is taken out of the queue
+    app.config['MATCHMAKING_INTERVAL'] = 1 # Seconds between sweeps of the queue, which match waiting players as their bands widen
+    app.config['DECK_CACHE_SIZE'] = 256 # Number of decks whose questions are cached
+    app.config['DECK_CACHE_TTL'] = 60 # Seconds before a cached deck is reloaded. This bounds how stale a deck edited on another worker can be.
+    app.config['DECK_CACHE_WARM'] = [] # IDs of the most played decks, which are loaded into the cache at startup
+    app.config['DECKS_PER_PAGE'] = 30 # Decks shown on each page of /browse and /select, and returned by /api/decks by default
+    app.config['DECKS_API_MAX_LIMIT'] = 100 # Most decks /api/decks returns at once
+    app.config['SEARCH_RESULTS'] = 30 # Most decks returned by a search
+    app.config['BULK_BATCH_SIZE'] = 500 # Questions inserted in each executemany by a bulk import, and read at a time by an export
+    app.config['IDENTITY_CACHE_SIZE'] = 10000 # Number of users kept in the identity cache
+    app.config['IDENTITY_CACHE_TTL'] = 30 # Seconds before a cached user is reloaded, in case another worker changed them
+    app.config['FRIEND_CACHE_SIZE'] = 10000 # Number of users whose friends lists are cached
+    app.config['FRIEND_CACHE_TTL'] = 60 # Seconds before a cached friends list is reloaded, in case a friend was added on another worker
+    app.config['LEADERBOARD_SIZE'] = 50 # Players shown on each leaderboard
+    app.config['LEADERBOARD_TTL'] = 300 # Seconds before a leaderboard is reloaded, to pick up matches recorded by other workers
+    app.config['LEADERBOARD_DECKS'] = 256 # Number of per-deck leaderboards kept in memory
+    app.config['HISTORY_PER_PAGE'] = 20 # Matches shown on each page of a user's match history
+    app.config['PAGE_CACHE_SIZE'] = 1000 # Rendered pages kept in the page cache. 0 keeps none, but ETags and 304s still work.
+    app.config['PAGE_CACHE_TTL'] = 60 # Seconds before a cached page is rendered again, in case it was changed on another worker
+    app.config['RESULT_WRITER_BATCH'] = 100 # Most finished matches recorded in one database transaction
+    app.config['RESULT_WRITER_INTERVAL'] = 0.5 # Seconds the results writer waits for more matches to finish before committing a batch
+    app.config['METRICS_ENABLED'] = False # Serve latency histograms and gauges in the Prometheus text format. Only enable this where /metrics can't be reached publicly.
+    app.config['METRICS_PATH'] = '/metrics' # Where the metrics are served when enabled
+    app.config['ASSETS_MAX_AGE'] = 365 * 24 * 3600 # Seconds browsers may keep fingerprinted static files without checking back. Their URLs change when they do.
+    app.config['TEMPLATE_CACHE_DIR'] = None # Where compiled templates are kept between starts. Defaults to jinja-cache in the instance folder. False turns the cache off.
+    app.config['TEMPLATE_PRECOMPILE'] = True # Load every template at startup, so no request has to compile one
+    app.config.from_envvar('QUIZLIVE_SETTINGS', silent=True) # A deployment can override any of the above from the config file named by this environment variable
+    if test_config is not None: # Benchmarks and scripts can pass their own settings, e.g. a different database
+        app.config.update(test_config)
+    profile.mark('config')
+    init_templates(app) # keeps compiled templates in the bytecode cache. This must come before anything makes app.jinja_env.
     
     db.init_app(app) # initialises the database for the server
-    socketio.init_app(app) # initialises websockets for the actual game
+    storage.init_app(app) # applies the SQLite settings to every connection, so this must come before anything uses the database
+    profile.mark('database')
+    if app.config['MIGRATE_ON_STARTUP']:
+        with app.app_context():
+            migrations.upgrade(db, log=app.logger.info) # brings an existing database's indexes and constraints up to date
+    profile.mark('migrations')
+    socketio.init_app(app, async_mode=app.config['SOCKETIO_ASYNC_MODE'], message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'], serializer=app.config['SOCKETIO_SERIALIZER']) # initialises websockets for the actual game
+    if socketio.async_mode in ('eventlet', 'gevent') and not green_patched(socketio.async_mode): # Without patching, every blocking call stalls the whole worker
+        app.logger.warning("SocketIO is using %s, but the standard library hasn't been monkey patched. Start the server with python -m QuizLive.serve.", socketio.async_mode)
+    profile.mark('socketio')
+    state.init_app(app) # initialises the matchmaking and room state
+    deck_cache.init_app(app) # initialises the deck question cache
+    identities.init_app(app) # initialises the identity cache used by load_user
+    results_writer.init_app(app) # initialises the background writer for match results
+    friend_graph.init_app(app) # initialises the friends list cache
+    leaderboards.init_app(app) # initialises the leaderboards, which the results writer keeps up to date
+    match_history.init_app(app) # initialises the per-user statistics, which the results writer also keeps up to date
+    page_cache.init_app(app) # initialises the page cache
+    password_hasher.init_app(app) # initialises password hashing
+    assets.init_app(app) # serves the built static files, if there are any
+    metrics.init_app(app) # initialises latency histograms, and the /metrics endpoint if enabled
+    profile.mark('extensions')
     
     login_manager = LoginManager()
     login_manager.login_view = 'auth.login' # designates the login manager as the auth.login route.
     login_manager.init_app(app)
 
-    from .models import User # imports the User object from models so it can be handled and queried below
-
     @login_manager.user_loader # loads a user via this decorator
     def load_user(user_id):
-        # When a user is instantiated or loaded in via login, this queries the database via their ID and allows
-        return User.query.get(int(user_id))
+        # Sockets are given their user's identity when they connect (see the connect listener in main.py), and keep using it until that user changes.
+        identity = session.get('identity')
+        if identity is not None and identity.id == int(user_id) and identities.fresh(identity):
+            return identity
+        # Otherwise the user comes from the identity cache, which only queries the database on a miss
+        return identities.get(int(user_id))
     
     from .auth import auth as auth_blueprint # imports blueprints from auth 
     app.register_blueprint(auth_blueprint)
     from .main import main as main_blueprint # imports blueprints from main 
     app.register_blueprint(main_blueprint)
+    profile.mark('blueprints')
+
+    if app.config['TEMPLATE_PRECOMPILE']:
+        precompile(app)
+    profile.mark('templates')
+    app.extensions['quizlive_startup'] = profile
+    app.logger.info("Started in %.0fms:\n%s", profile.total * 1000, profile.report())
     return app
\ No newline at end of file
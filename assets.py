@@ -0,0 +1,251 @@
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import request, send_from_directory, url_for
+
+"""
+This module is the static asset pipeline. It builds fingerprinted, precompressed copies of everything in static/, and serves them.
+
+Building, from the folder above QuizLive:
+
+    python -m QuizLive.assets                   (fingerprints and compresses static/ into static/dist)
+    python -m QuizLive.assets --vendor --scss   (first downloads the client libraries and fonts, and compiles sass/styles.scss)
+
+    --vendor  downloads everything in VENDOR (the Socket.IO client, and the Nunito font from Google Fonts with its font files) into static/vendor,
+              so pages load them from this server rather than from a CDN. It only needs running when VENDOR changes, and its files should
+              then be committed. They aren't in the repository yet: until they are, pages still load the client from cdnjs and the font
+              from Google Fonts (see vendor_url below), and init_app logs a warning naming each file that is still fetched from a third party.
+    --scss    compiles sass/styles.scss into static/styles/styles.css with libsass (pip install libsass), in place of compiling it by hand.
+              It needs the Bulma sources the stylesheet imports, in ../bulmaEdit.
+    Every file in static/ is then copied to static/dist with a hash of its contents in its name, e.g. styles/styles.1a2b3c4d5e.css,
+    along with .gz (and, with brotli installed, .br) copies of text files. References between assets (the url()s and @imports in stylesheets)
+    are rewritten to the fingerprinted names, and remote @imports of vendored files to their local copies. static/dist/manifest.json lists them all.
+    static/dist isn't committed; build it when deploying, after anything in static/ changes.
+
+Serving: Assets reads the manifest when the app starts.
+    - url_for('static', filename='styles/styles.css') gives the fingerprinted URL, so templates don't change. Files without a built copy,
+      or whose source changed after the build, keep their normal URL (and a warning is logged), so nothing breaks before the next build.
+    - Fingerprinted files are sent with "Cache-Control: public, max-age=ASSETS_MAX_AGE, immutable". Their URL changes whenever their
+      contents do, so browsers can keep them for a year without checking back, and repeat visits load nothing.
+    - The brotli or gzip copy is sent when the browser accepts it, so nothing is compressed per request.
+    - vendor_url(name) in templates gives the local copy of a vendored file, or its CDN URL if --vendor hasn't been run yet.
+The app only needs the serving half, so the modules only building uses (urllib.request, gzip, shutil, hashlib and brotli) are imported by
+the functions that use them, and a worker doesn't import them when it starts. See startup.py.
+      The stylesheet's Google Fonts @import is likewise only pointed at the local copy by the build once static/vendor/nunito.css exists.
+"""
+
+SOCKETIO_CLIENT = "4.7.5" # Socket.IO 4 clients speak version 4 of the Engine.IO protocol, which is what python-engineio 4 (under Flask-SocketIO 5) serves
+VENDOR = {
+    "vendor/socket.io.min.js": "https://cdnjs.cloudflare.com/ajax/libs/socket.io/%s/socket.io.min.js" % SOCKETIO_CLIENT,
+    "vendor/socket.io.msgpack.min.js": "https://cdnjs.cloudflare.com/ajax/libs/socket.io/%s/socket.io.msgpack.min.js" % SOCKETIO_CLIENT, # The same client with the MessagePack parser built in, for SOCKETIO_SERIALIZER = 'msgpack'
+    "vendor/nunito.css": "https://fonts.googleapis.com/css2?family=Nunito:wght@800&display=swap", # The font styles.scss imports
+}
+DIST = "dist" # The folder in static/ that fingerprinted files are built into
+COMPRESSIBLE = (".css", ".js", ".json", ".svg", ".txt", ".map", ".html") # Other types (images, audio, fonts) are compressed already
+ENCODINGS = (("br", ".br"), ("gzip", ".gz")) # In order of preference
+BROWSER = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36" # Google Fonts only sends woff2 files to browsers it knows support them
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+def load_brotli():
+    # brotli is optional. Without it only gzip variants are written.
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+def download(url):
+    import urllib.request
+    with urllib.request.urlopen(urllib.request.Request(url, headers={"User-Agent": BROWSER}), timeout=30) as response:
+        return response.read()
+
+def vendor(static_folder, log=print):
+    """ Downloads every file in VENDOR into static/vendor. Stylesheets' url()s are downloaded too, into static/vendor/fonts, and pointed at the local copies. """
+    import hashlib
+    for name, url in VENDOR.items():
+        data = download(url)
+        if name.endswith(".css"):
+            text = data.decode("utf-8")
+            for remote in sorted(set(match.group(2) for match in CSS_URL.finditer(text))):
+                local = "fonts/" + posixpath.basename(remote.split("?")[0])
+                path = os.path.join(static_folder, "vendor", local)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(download(remote))
+                text = text.replace(remote, local)
+            data = text.encode("utf-8")
+        path = os.path.join(static_folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        log("%s  %s (%d bytes, sha256 %s)" % (name, url, len(data), hashlib.sha256(data).hexdigest()))
+
+def compile_scss(package_folder, log=print):
+    # Compiles sass/styles.scss into static/styles/styles.css. Returns whether it could.
+    try:
+        import sass
+        compile = sass.compile # The repo's own sass/ folder is importable as a namespace package too, and has no compile
+    except (ImportError, AttributeError):
+        log("libsass isn't installed (pip install libsass), so static/styles/styles.css was left as it is")
+        return False
+    source = os.path.join(package_folder, "sass", "styles.scss")
+    try:
+        css = compile(filename=source, output_style="compressed")
+    except sass.CompileError as e:
+        log("Couldn't compile %s, so static/styles/styles.css was left as it is:\n%s" % (source, e))
+        return False
+    with open(os.path.join(package_folder, "static", "styles", "styles.css"), "w", encoding="utf-8") as f:
+        f.write(css)
+    return True
+
+def fingerprint(name, data):
+    # styles/styles.css -> styles/styles.1a2b3c4d5e.css
+    import hashlib
+    stem, ext = posixpath.splitext(name)
+    return "%s.%s%s" % (stem, hashlib.sha256(data).hexdigest()[:10], ext)
+
+def rewrite_css(name, text, manifest):
+    # Points a stylesheet's url()s and @imports at fingerprinted files, and remote imports of vendored files at their local copies
+    local = {url: vendored for vendored, url in VENDOR.items()}
+    folder = posixpath.dirname(name)
+    def replace(match):
+        url = match.group(2)
+        if url in local:
+            target = local[url]
+        elif "://" in url or url.startswith(("data:", "/", "#")):
+            return match.group(0)
+        else:
+            target = posixpath.normpath(posixpath.join(folder, url.split("?")[0].split("#")[0]))
+        if target not in manifest:
+            return match.group(0)
+        return 'url("%s")' % posixpath.relpath(manifest[target]["path"], posixpath.join(DIST, folder))
+    return CSS_URL.sub(replace, text)
+
+def build(static_folder, log=print):
+    """ Writes fingerprinted and compressed copies of every file in static_folder into static_folder/dist, and returns the manifest. """
+    import gzip
+    import shutil
+    brotli = load_brotli()
+    dist = os.path.join(static_folder, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+    names = []
+    for folder, subfolders, files in os.walk(static_folder):
+        subfolders[:] = [subfolder for subfolder in subfolders if not subfolder.startswith(".") and os.path.join(folder, subfolder) != dist]
+        names += [os.path.relpath(os.path.join(folder, file), static_folder).replace(os.sep, "/") for file in files if not file.startswith(".")]
+    manifest = {}
+    # Stylesheets refer to other files by their fingerprinted names, so they are done last, once those names are known
+    for name in sorted(names, key=lambda name: (name.endswith(".css"), not name.startswith("vendor/"), name)):
+        source = os.path.join(static_folder, name)
+        with open(source, "rb") as f:
+            data = f.read()
+        if name.endswith(".css"):
+            data = rewrite_css(name, data.decode("utf-8"), manifest).encode("utf-8")
+        path = posixpath.join(DIST, fingerprint(name, data))
+        target = os.path.join(static_folder, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(data)
+        encodings = []
+        if name.endswith(COMPRESSIBLE):
+            variants = {"gzip": gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                variants["br"] = brotli.compress(data, quality=11)
+            for encoding, suffix in ENCODINGS:
+                if encoding in variants and len(variants[encoding]) < len(data): # A tiny file can get bigger
+                    with open(target + suffix, "wb") as f:
+                        f.write(variants[encoding])
+                    encodings.append(encoding)
+        manifest[name] = {"path": path, "mtime": os.path.getmtime(source), "encodings": encodings}
+        log("%-40s -> %s %s" % (name, path, " ".join(encodings)))
+    with open(os.path.join(dist, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+class Assets():
+    def __init__(self, max_age=365 * 24 * 3600):
+        self.max_age = max_age
+        self.manifest = {} # file name in static/ -> its entry in manifest.json, for the files whose built copy is up to date
+        self.built = {} # fingerprinted path -> (encodings, mimetype)
+
+    def init_app(self, app):
+        self.max_age = app.config["ASSETS_MAX_AGE"]
+        self.static_folder = app.static_folder
+        self.manifest, self.built = {}, {}
+        try:
+            with open(os.path.join(app.static_folder, DIST, "manifest.json")) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+            app.logger.info("Static assets haven't been built, so they are served without fingerprints. Run python -m QuizLive.assets to build them.")
+        for name, entry in manifest.items():
+            try:
+                changed = os.path.getmtime(os.path.join(app.static_folder, name)) > entry["mtime"]
+            except OSError: # The source was deleted
+                changed = True
+            if changed:
+                app.logger.warning("static/%s has changed since the assets were built, so it's served without a fingerprint until they are built again.", name)
+                continue
+            self.manifest[name] = entry
+            self.built[entry["path"]] = (entry["encodings"], mimetypes.guess_type(name)[0] or "application/octet-stream")
+        remote = [url for name, url in VENDOR.items() if not os.path.exists(os.path.join(app.static_folder, name))]
+        if remote:
+            app.logger.warning("These files haven't been vendored, so pages load them from a third party: %s. Run python -m QuizLive.assets --vendor and commit static/vendor.", ", ".join(remote))
+        app.url_defaults(self._url_defaults)
+        self._send_static_file = app.view_functions["static"]
+        app.view_functions["static"] = self.send # Keeps the 'static' endpoint, so url_for and everything else that uses it is unchanged
+        app.context_processor(lambda: {"vendor_url": self.vendor_url}) # A context processor rather than add_template_global, which would make the Jinja environment before init_templates (see startup.py) can set its options
+        app.extensions["quizlive_assets"] = self
+
+    def _url_defaults(self, endpoint, values):
+        # Swaps a static file's name for its fingerprinted copy's, whenever url_for makes a URL for it
+        if endpoint == "static" and values.get("filename") in self.manifest:
+            values["filename"] = self.manifest[values["filename"]]["path"]
+
+    def send(self, filename):
+        if filename not in self.built:
+            return self._send_static_file(filename=filename) # Anything else is served as normal, with Flask's usual caching
+        encodings, mimetype = self.built[filename]
+        for encoding, suffix in ENCODINGS:
+            if encoding in encodings and request.accept_encodings.quality(encoding) > 0:
+                break
+        else:
+            encoding, suffix = None, ""
+        response = send_from_directory(self.static_folder, filename + suffix, mimetype=mimetype, max_age=self.max_age)
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        if encodings:
+            response.vary.add("Accept-Encoding") # Caches in between must keep each encoding separately
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    def vendor_url(self, name):
+        """ The URL of a vendored file: its local copy once it's been downloaded with --vendor, or else the CDN it comes from. """
+        if name in self.manifest or os.path.exists(os.path.join(self.static_folder, name)):
+            return url_for("static", filename=name)
+        return VENDOR[name]
+
+def main():
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description="Builds fingerprinted, precompressed copies of QuizLive's static files into static/dist.")
+    parser.add_argument("--vendor", action="store_true", help="first download the client libraries and fonts in VENDOR into static/vendor")
+    parser.add_argument("--scss", action="store_true", help="first compile sass/styles.scss into static/styles/styles.css (needs libsass)")
+    args = parser.parse_args()
+
+    package_folder = os.path.dirname(os.path.abspath(__file__))
+    static_folder = os.path.join(package_folder, "static")
+    if args.vendor:
+        vendor(static_folder)
+    if args.scss:
+        compile_scss(package_folder)
+    if load_brotli() is None:
+        print("brotli isn't installed (pip install brotli), so only gzip copies are made", file=sys.stderr)
+    build(static_folder)
+
+if __name__ == "__main__":
+    main()
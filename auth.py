@@ -1,8 +1,7 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash
-from werkzeug.security import generate_password_hash, check_password_hash
 from .models import User
 from flask_login import login_user, logout_user, login_required, current_user
-from . import db
+from . import db, password_hasher
 import random
 import string
 import re
@@ -28,10 +27,13 @@ def login_post():
 
     user = User.query.filter_by(email=email).first()
     # checks if the user exists
-    # takes the password and compares its hash to the hash in the database
-    if not user or not check_password_hash(user.password, password):
+    # takes the password and compares its hash to the hash in the database. The hash is worked out on the password hashing pool (see passwords.py), so other requests carry on meanwhile
+    if not user or not password_hasher.check(user.password, password):
         flash('Please check your login details and try again.')
         return redirect(url_for('auth.login')) # reloads the page with the flashed error message if there is an error in credentials.
+    if password_hasher.needs_rehash(user.password): # Hashes made with an older method (e.g. sha256) or weaker settings are upgraded now that we have the password
+        user.password = password_hasher.hash(password)
+        db.session.commit()
 
     # logs user in using Flask_login
     login_user(user, remember=remember) # remember attribute checks if the remember me checkbox was ticked. Stores cookie if so
@@ -66,7 +68,7 @@ def signup_post():
         flash('Email address already exists. Please go to the Login page.')
         return redirect(url_for('auth.signup'))
     friendID = ''.join((random.choice(string.ascii_letters + string.digits) for i in range(10))) # create a random ten character string for the friend ID.
-    new_user = User(email=email, name=name, password=generate_password_hash(password, method='sha256'), friendid=friendID, elo=1000, wincount=0, matchcount=0) # hashes password for storage in database using the sha256 algorithm
+    new_user = User(email=email, name=name, password=password_hasher.hash(password), friendid=friendID, elo=1000, wincount=0, matchcount=0) # hashes password for storage in database with PASSWORD_HASH_METHOD
     db.session.add(new_user) # instantiates new user
     db.session.commit()
 
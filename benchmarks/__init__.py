@@ -0,0 +1,7 @@
+"""
+Benchmarks for QuizLive. Each module can be run from the folder above QuizLive, e.g.
+
+    python -m QuizLive.benchmarks.matchmaking
+
+and prints its results to the terminal.
+"""
@@ -0,0 +1,93 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from .connections import free_port, PACKAGE, ROOT
+
+"""
+Measures how long a newly started QuizLive worker takes to answer its first request, and how slow its first few pages are.
+
+Each run starts a real server with python -m QuizLive.serve on a fresh database, and polls / until it answers. The time from starting the
+process to that first response is the time to first request. Then each of --pages is fetched twice: the first fetch of a page is when its
+template used to be compiled, and the second shows the same page warm.
+
+It is run with three setups (see startup.py):
+    no cache    TEMPLATE_CACHE_DIR = False and TEMPLATE_PRECOMPILE = False, so every template is compiled by the first request to use it, as before
+    cold cache  templates are precompiled at startup, into an empty bytecode cache
+    warm cache  templates are precompiled at startup, from the bytecode cache the cold runs filled
+Startup is noisy, so each setup is run --runs times and the medians are shown.
+
+Run it from the folder above QuizLive, e.g.
+
+    python -m QuizLive.benchmarks.coldstart --runs 5
+"""
+
+def fetch(url):
+    # Returns the seconds taken to fetch a page, whatever its status
+    start = time.perf_counter()
+    try:
+        urllib.request.urlopen(url, timeout=30).read()
+    except urllib.error.HTTPError as e: # e.g. the 404 page, which is as much a template as any other
+        e.read()
+    return time.perf_counter() - start
+
+def run(folder, cache, precompile, args):
+    port = free_port()
+    settings = os.path.join(folder, "settings.py")
+    with open(settings, "w") as f:
+        f.write("SQLALCHEMY_DATABASE_URI = %r\n" % ("sqlite:///" + os.path.join(folder, "coldstart.sqlite")))
+        f.write("TEMPLATE_CACHE_DIR = %r\n" % cache)
+        f.write("TEMPLATE_PRECOMPILE = %r\n" % precompile)
+    env = dict(os.environ, QUIZLIVE_SETTINGS=settings)
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", PACKAGE + ".serve", "--async-mode", args.async_mode, "--port", str(port)], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base = "http://127.0.0.1:%d" % port
+        while True:
+            try:
+                urllib.request.urlopen(base + "/", timeout=30).read()
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if server.poll() is not None:
+                    raise RuntimeError("the server exited with code %d" % server.returncode)
+                if time.perf_counter() - start > 60:
+                    raise RuntimeError("the server didn't answer within a minute")
+                time.sleep(0.005)
+        first_request = time.perf_counter() - start
+        first = [fetch(base + page) for page in args.pages]
+        warm = [fetch(base + page) for page in args.pages]
+    finally:
+        server.terminate()
+        server.wait()
+        os.remove(os.path.join(folder, "coldstart.sqlite"))
+    return first_request, sum(first), sum(warm)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures a new QuizLive worker's time to first request, and its first page loads, with and without the template cache.")
+    parser.add_argument("--runs", type=int, default=3, help="runs of each setup")
+    parser.add_argument("--async-mode", default="threading", choices=["threading", "eventlet", "gevent"])
+    parser.add_argument("--pages", nargs="+", default=["/login", "/signup", "/missing"], help="pages fetched after the first request to /")
+    args = parser.parse_args()
+
+    print("%-12s %20s %20s %20s" % ("setup", "first request ms", "first pages ms", "warm pages ms"))
+    with tempfile.TemporaryDirectory() as folder:
+        cache = os.path.join(folder, "jinja-cache")
+        setups = [("no cache", False, False), ("cold cache", cache, True), ("warm cache", cache, True)]
+        for name, cache_dir, precompile in setups:
+            results = []
+            for _ in range(args.runs):
+                if name == "cold cache" and os.path.isdir(cache): # Each cold run starts with the cache empty again
+                    for entry in os.listdir(cache):
+                        os.remove(os.path.join(cache, entry))
+                results.append(run(folder, cache_dir, precompile, args))
+            print("%-12s %20.1f %20.1f %20.1f" % (name, *[statistics.median(column) * 1000 for column in zip(*results)]))
+            sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import simple_websocket
+
+from .loadtest import percentile
+
+"""
+Measures how many open Socket.IO connections one QuizLive worker holds in each async mode (see serve.py), and what they cost it.
+
+For each mode, a real server is started with python -m QuizLive.serve on a fresh database, and --connections WebSocket clients connect to it
+(speaking the Engine.IO/Socket.IO protocol directly, so no Socket.IO client library is needed). Once they are all open, the server's
+resident memory and OS thread count are read from /proc, and a sample of the clients send an event and time how long it takes to be acknowledged.
+Modes whose library isn't installed are skipped. Clients are only held open for --hold seconds, well inside Socket.IO's 25 second ping interval.
+
+Run it from the folder above QuizLive, e.g.
+
+    python -m QuizLive.benchmarks.connections --connections 2000 --modes threading eventlet
+"""
+
+PACKAGE = __package__.split(".")[0]
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # The folder above QuizLive, for python -m
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def proc_status(pid):
+    # Returns (resident memory in MB, OS threads) for a process, from Linux's /proc
+    fields = {}
+    with open("/proc/%d/status" % pid) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            fields[key] = value.strip()
+    return int(fields["VmRSS"].split()[0]) / 1024, int(fields["Threads"])
+
+def start_server(mode, port, folder):
+    settings = os.path.join(folder, "settings.py")
+    with open(settings, "w") as f:
+        f.write("SQLALCHEMY_DATABASE_URI = %r\n" % ("sqlite:///" + os.path.join(folder, "connections.sqlite")))
+    env = dict(os.environ, QUIZLIVE_SETTINGS=settings)
+    server = subprocess.Popen([sys.executable, "-m", PACKAGE + ".serve", "--async-mode", mode, "--port", str(port)], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("the %s server exited with code %d" % (mode, server.returncode))
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("the %s server didn't start listening" % mode)
+
+def connect(port):
+    # Opens a WebSocket, and joins the default Socket.IO namespace. Returns the client.
+    ws = simple_websocket.Client.connect("ws://127.0.0.1:%d/socket.io/?EIO=4&transport=websocket" % port)
+    try:
+        if not (ws.receive(timeout=10) or "").startswith("0"): # Engine.IO open packet
+            raise TimeoutError("no Engine.IO handshake")
+        ws.send("40") # Socket.IO connect to "/"
+        while True:
+            message = ws.receive(timeout=10)
+            if message is None:
+                raise TimeoutError("no Socket.IO connect")
+            if message.startswith("40"):
+                return ws
+    except BaseException:
+        ws.close()
+        raise
+
+def round_trip(ws, ack):
+    # Sends an event which asks for an acknowledgement, and returns the seconds until it arrives. cancel_find_game is harmless for a client that isn't queued.
+    start = time.perf_counter()
+    ws.send('42%d["cancel_find_game"]' % ack)
+    while True:
+        message = ws.receive(timeout=10)
+        if message is None:
+            raise TimeoutError("no acknowledgement")
+        if message == "2": # Engine.IO ping
+            ws.send("3")
+        elif message.startswith("43%d" % ack):
+            return time.perf_counter() - start
+
+def run(mode, args):
+    with tempfile.TemporaryDirectory() as folder:
+        port = free_port()
+        server = start_server(mode, port, folder)
+        clients, failures = [], []
+        try:
+            idle_memory, idle_threads = proc_status(server.pid)
+            def open_one(i):
+                try:
+                    clients.append(connect(port))
+                except Exception as e:
+                    failures.append(e)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.parallel) as pool:
+                list(pool.map(open_one, range(args.connections)))
+            connect_time = time.perf_counter() - start
+            time.sleep(min(args.hold, 20)) # Let the server settle with every connection open
+            memory, threads = proc_status(server.pid)
+            sample = random.Random(0).sample(clients, min(args.probes, len(clients)))
+            latencies = [round_trip(ws, i) for i, ws in enumerate(sample)]
+        finally:
+            for ws in clients:
+                try:
+                    ws.close()
+                except Exception:
+                    pass
+            server.terminate()
+            server.wait()
+        return {
+            "open": len(clients), "failed": len(failures), "connect_s": connect_time, "memory_mb": memory, "per_connection_kb": (memory - idle_memory) * 1024 / max(len(clients), 1),
+            "threads": threads, "idle_threads": idle_threads, "ack_p50_ms": percentile(latencies, 0.5) * 1000, "ack_p99_ms": percentile(latencies, 0.99) * 1000,
+            "error": repr(failures[0]) if failures else None,
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the open Socket.IO connections one QuizLive worker can hold in each async mode, and their cost.")
+    parser.add_argument("--modes", nargs="+", default=["threading", "eventlet", "gevent"], choices=["threading", "eventlet", "gevent"])
+    parser.add_argument("--connections", type=int, default=500)
+    parser.add_argument("--parallel", type=int, default=50, help="connections opened at once")
+    parser.add_argument("--probes", type=int, default=100, help="connections which time an acknowledged event")
+    parser.add_argument("--hold", type=float, default=2, help="seconds to wait with every connection open before measuring")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes:
+        if mode != "threading" and importlib.util.find_spec(mode) is None:
+            print("%s isn't installed, skipping" % mode)
+            continue
+        results[mode] = run(mode, args)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("%-10s %8s %8s %10s %10s %14s %8s %12s %12s" % ("mode", "open", "failed", "connect s", "RSS MB", "KB/connection", "threads", "ack p50 ms", "ack p99 ms"))
+    for mode, result in results.items():
+        print("%-10s %8d %8d %10.1f %10.1f %14.1f %8d %12.2f %12.2f" % (mode, result["open"], result["failed"], result["connect_s"], result["memory_mb"], result["per_connection_kb"], result["threads"], result["ack_p50_ms"], result["ack_p99_ms"]))
+        if result["error"]:
+            print("           e.g. %s" % result["error"])
+
+if __name__ == "__main__":
+    main()
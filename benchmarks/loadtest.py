@@ -0,0 +1,160 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import resource
+import tempfile
+import time
+
+"""
+Plays thousands of simulated two-player matches against a real QuizLive app and reports how it copes.
+
+Every simulated player is a Flask test client and a Flask-SocketIO test client sharing its cookies, logged in as one of the seeded users.
+Each player goes through the same steps as a browser: find_game for a random opponent, wait for found_room, load /play, begin_timing,
+submit_answer for every question, then load /results until the opponent has finished (using the results_ready push in between).
+
+The players of each pair are given the same deck and a similar ELO, and are started together, so every player waiting in the
+matchmaking queue always has a running opponent to be matched with. Players run on a thread pool of --concurrency threads.
+
+The database is a fresh SQLite file seeded from --seed, so runs with the same arguments do the same work and can be compared,
+e.g. between the state backends or async modes on the same machine.
+Logging in is skipped (the user ID is put straight into the session), as password hashing would otherwise dominate the results.
+"""
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def seed_database(db, players, decks, questions, rng):
+    from ..models import User, Deck, Question
+    db.create_all()
+    elos = []
+    for pair in range(players // 2): # Both players of a pair get a similar ELO, so they fall within each other's band straight away
+        base = rng.gauss(1000, 200)
+        elos += [base + rng.uniform(-20, 20), base + rng.uniform(-20, 20)]
+    db.session.add_all(User(email="player%d@loadtest" % i, name="player%d" % i, password="", friendid="%010d" % i, elo=elo, wincount=0, matchcount=0) for i, elo in enumerate(elos))
+    db.session.add_all(Deck(name="deck%d" % i, creator="player%d" % (i % players), uid=i % players + 1) for i in range(decks))
+    db.session.commit()
+    db.session.add_all(
+        Question(question="Question %d of deck %d" % (q, d), answer1="A", answer2="B", answer3="C", answer4="D", correct=str(rng.randrange(1, 5)), deck_id=d + 1)
+        for d in range(decks) for q in range(questions)
+    )
+    db.session.commit()
+
+class Player():
+    def __init__(self, app, socketio, uid, deckID, rng, timeout):
+        self.app = app
+        self.socketio = socketio
+        self.uid = uid
+        self.deckID = deckID
+        self.rng = rng
+        self.timeout = timeout # Longest a player waits for an opponent before giving up, so one lost message can't hang the run
+        self.latencies = {} # event or page -> list of seconds
+        self.received = []
+
+    def time(self, name, f, *args, **kwargs):
+        start = time.perf_counter()
+        result = f(*args, **kwargs)
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+        return result
+
+    def emit(self, event, data):
+        self.time(event, self.sock.emit, event, data)
+        self.received += self.sock.get_received()
+
+    def wait_for(self, *names):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            for message in self.received:
+                if message["name"] in names:
+                    self.received.remove(message)
+                    return message
+            if time.monotonic() > deadline:
+                raise TimeoutError("player %d gave up waiting for %s" % (self.uid, " or ".join(names)))
+            time.sleep(0.001)
+            self.received += self.sock.get_received()
+
+    def run(self):
+        self.web = self.app.test_client()
+        with self.web.session_transaction() as session:
+            session["_user_id"] = str(self.uid)
+            session["_fresh"] = True
+        self.sock = self.time("connect", self.socketio.test_client, self.app, flask_test_client=self.web, auth={"protocol": 2}) # The compact protocol the pages use, see protocol.py
+        try:
+            self.emit("find_game", {"random": True, "deckID": str(self.deckID)})
+            roomID = self.wait_for("found_room")["args"][0]["roomID"]
+            self.time("/play", self.web.get, "/play/%s" % roomID)
+            self.emit("begin_timing", roomID)
+            questionID = 0
+            while True: # Answer each question as it arrives, until the server says the quiz is over
+                self.emit("submit_answer", [questionID, self.rng.randrange(1, 5)])
+                message = self.wait_for("submit_question", "score", "end_quiz") # With PREFETCH_QUESTIONS the page already has every question, and only gets its score back
+                if message["name"] == "end_quiz":
+                    break
+                questionID = message["args"][0][0]
+            while b"Waiting" in self.time("/results", self.web.get, "/results/%s" % roomID).data: # The waiting page, so wait for the opponent to finish
+                self.wait_for("results_ready", "refresh")
+        finally:
+            self.sock.disconnect()
+
+def main():
+    parser = argparse.ArgumentParser(description="Plays simulated two-player matches against QuizLive and reports matches per second, event latency and peak memory.")
+    parser.add_argument("--players", type=int, default=1000, help="number of simulated players (rounded down to an even number)")
+    parser.add_argument("--concurrency", type=int, default=100, help="players running at once (rounded down to an even number)")
+    parser.add_argument("--decks", type=int, default=20)
+    parser.add_argument("--questions", type=int, default=20, help="questions in each deck")
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="memory", help="state backend to test")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=30, help="seconds a player waits for any one message before giving up")
+    args = parser.parse_args()
+    players = args.players - args.players % 2
+    concurrency = max(2, args.concurrency - args.concurrency % 2)
+
+    from .. import create_app, db, socketio, results_writer
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as folder:
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(folder, "loadtest.sqlite"),
+            "STATE_BACKEND": args.backend,
+            "STATE_SQLITE_PATH": os.path.join(folder, "state.sqlite"),
+            "TESTING": True,
+        })
+        with app.app_context():
+            seed_database(db, players, args.decks, args.questions, rng)
+
+        # Players are created in pairs, and the pool starts them in this order, so both players of a pair run at the same time
+        simulated = [Player(app, socketio, i + 1, (i // 2) % args.decks + 1, random.Random(rng.random()), args.timeout) for i in range(players)]
+        failures = []
+        def run(player):
+            try:
+                player.run()
+            except Exception as e:
+                failures.append(e)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(run, simulated))
+        elapsed = time.perf_counter() - start
+        results_writer.flush() # Include the background writes in the run, as they are part of the cost of a match
+        written = time.perf_counter() - start
+
+        latencies = {}
+        for player in simulated:
+            for name, values in player.latencies.items():
+                latencies.setdefault(name, []).extend(values)
+
+        print("%d players, %d at once, %s backend, %s async mode" % (players, concurrency, args.backend, socketio.async_mode))
+        print("%.1f matches/s (%.1fs), %.1f matches/s including the results writer (%.1fs)" % (players / 2 / elapsed, elapsed, players / 2 / written, written))
+        print("%-16s %8s %10s %10s %10s" % ("", "count", "p50 ms", "p99 ms", "max ms"))
+        for name in sorted(latencies):
+            values = latencies[name]
+            print("%-16s %8d %10.2f %10.2f %10.2f" % (name, len(values), percentile(values, 0.5) * 1000, percentile(values, 0.99) * 1000, max(values) * 1000))
+        print("peak memory %.1f MB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)) # ru_maxrss is in kilobytes on Linux
+        print("results writer %s" % results_writer.stats())
+        if failures:
+            print("%d players failed, e.g. %r" % (len(failures), failures[0]))
+
+if __name__ == "__main__":
+    main()
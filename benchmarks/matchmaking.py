@@ -0,0 +1,55 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from ..matchmaking import MatchPolicy, Ticket
+from ..state import MemoryBackend, SQLiteBackend
+
+"""
+Measures how many matchmaking operations per second each state backend can sustain.
+
+Players with random ELOs queue for random decks. Every tenth player cancels instead of waiting, and the queue is swept every 1000 operations,
+which is the same mix of work find_game, cancel_find_game and the matchmaker background task give the queue.
+"""
+
+def run(backend, operations, decks, seed=0):
+    rng = random.Random(seed)
+    waiting = []
+    matched = 0
+    start = time.perf_counter()
+    for i in range(operations):
+        if waiting and i % 10 == 9:
+            backend.cancel_wait(waiting.pop(rng.randrange(len(waiting))))
+        else:
+            ticket = Ticket("sid%d" % i, i, "player%d" % i, rng.gauss(1000, 200), rng.randrange(decks))
+            if backend.enqueue(ticket) is not None:
+                matched += 1
+            else:
+                waiting.append(ticket.sid)
+        if i % 1000 == 999:
+            matches, expired = backend.sweep_queue()
+            matched += len(matches)
+    elapsed = time.perf_counter() - start
+    stats = backend.stats()
+    return operations / elapsed, matched, stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures matchmaking operations per second for each state backend.")
+    parser.add_argument("--operations", type=int, default=50000)
+    parser.add_argument("--decks", type=int, default=20)
+    args = parser.parse_args()
+
+    policy = MatchPolicy()
+    with tempfile.TemporaryDirectory() as folder:
+        backends = {
+            "memory": MemoryBackend(policy=policy),
+            "sqlite": SQLiteBackend(os.path.join(folder, "state.sqlite"), policy=policy),
+        }
+        for name, backend in backends.items():
+            rate, matched, stats = run(backend, args.operations, args.decks)
+            print("%-7s %10.0f ops/s  matched %6d  still queued %6d  time to match p50 %.4fs p99 %.4fs" % (name, rate, matched, stats["queued"], stats["time_to_match_p50"], stats["time_to_match_p99"]))
+
+if __name__ == "__main__":
+    main()
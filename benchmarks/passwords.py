@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from .loadtest import percentile
+
+"""
+Measures how fast QuizLive can log people in, and how much those logins hold up everything else running on the same worker.
+
+Concurrent clients log in over and over through the real /login route, while a ticker task asks to wake up every few milliseconds and
+records how late it actually wakes. The ticker stands in for the game's socket events: under eventlet or gevent, any hash worked out on
+the worker's one thread delays it by the whole hash. Each hash method is run with hashing inline (PASSWORD_HASH_WORKERS = 0), as
+login_post used to, and on the password hashing pool (see passwords.py).
+
+Run it from the folder above QuizLive, e.g.
+
+    python -m QuizLive.benchmarks.passwords --async-mode eventlet --concurrency 20
+"""
+
+def run(method, workers, args):
+    from .. import create_app, db, socketio
+    from ..models import User
+    from werkzeug.security import generate_password_hash
+    with tempfile.TemporaryDirectory() as folder:
+        app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(folder, "passwords.sqlite"), "PASSWORD_HASH_METHOD": method, "PASSWORD_HASH_WORKERS": workers, "SOCKETIO_ASYNC_MODE": args.async_mode})
+        with app.app_context():
+            pwhash = generate_password_hash("Password1!", method) # Everyone has the same password, so it only has to be hashed once here
+            db.session.add_all([User(email="player%d@passwords" % i, name="player%d" % i, password=pwhash, friendid="PW%08d" % i, elo=1000, wincount=0, matchcount=0) for i in range(args.concurrency)])
+            db.session.commit()
+
+        lateness, durations = [], []
+        running = [args.concurrency]
+        def ticker():
+            while running[0]:
+                start = time.perf_counter()
+                socketio.sleep(args.tick / 1000)
+                lateness.append(time.perf_counter() - start - args.tick / 1000)
+        def client(i):
+            web = app.test_client()
+            for _ in range(args.logins):
+                start = time.perf_counter()
+                response = web.post("/login", data={"email": "player%d@passwords" % i, "password": "Password1!"})
+                assert response.location.endswith("/profile"), "login failed"
+                durations.append(time.perf_counter() - start)
+                web.get("/logout")
+            running[0] -= 1
+
+        socketio.start_background_task(ticker)
+        start = time.perf_counter()
+        for i in range(args.concurrency):
+            socketio.start_background_task(client, i)
+        while running[0]:
+            socketio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        return len(durations) / elapsed, durations, lateness
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures logins per second, and how late other tasks on the worker run, for each password hash method.")
+    parser.add_argument("--async-mode", default="threading", choices=["threading", "eventlet", "gevent"])
+    parser.add_argument("--methods", nargs="+", default=["scrypt", "pbkdf2:sha256:600000"])
+    parser.add_argument("--workers", type=int, default=2, help="PASSWORD_HASH_WORKERS for the pooled runs")
+    parser.add_argument("--concurrency", type=int, default=8, help="clients logging in at once")
+    parser.add_argument("--logins", type=int, default=5, help="logins per client")
+    parser.add_argument("--tick", type=float, default=5, help="milliseconds the ticker sleeps for")
+    args = parser.parse_args()
+
+    from ..serve import patch
+    patch(args.async_mode) # As early as this module can, see serve.py
+
+    print("%-24s %8s %10s %14s %14s %14s %14s" % ("method", "workers", "logins/s", "login p50 ms", "login p99 ms", "tick p99 ms", "tick max ms"))
+    for method in args.methods:
+        for workers in (0, args.workers):
+            rate, durations, lateness = run(method, workers, args)
+            print("%-24s %8d %10.1f %14.1f %14.1f %14.1f %14.1f" % (method, workers, rate, percentile(durations, 0.5) * 1000, percentile(durations, 0.99) * 1000, percentile(lateness, 0.99) * 1000, max(lateness) * 1000))
+            sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
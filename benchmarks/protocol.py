@@ -0,0 +1,136 @@
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import zlib
+
+from socketio import packet
+
+from .loadtest import seed_database
+
+"""
+Compares the versions of the game's socket protocol (see protocol.py): the bytes a match sends each way, and the server CPU time per event.
+The newest version is also run with PREFETCH_QUESTIONS, where the questions are sent once at the start and each answer only gets its score back.
+
+Matches are played between pairs of Flask-SocketIO test clients, which run the socket handlers in this thread, so the CPU time measured
+around each emit is the server's (decoding the packet, the handler, and encoding its replies). Every event sent and received in a match
+is then encoded as it would go over a WebSocket:
+    json            the default serializer
+    json+deflate    the same, with permessage-deflate (context kept between messages, as browsers and simple-websocket do)
+    msgpack         SOCKETIO_SERIALIZER = 'msgpack', if the msgpack package is installed
+    msgpack+deflate
+
+Run it from the folder above QuizLive, e.g.
+
+    python -m QuizLive.benchmarks.protocol --matches 200 --questions 5
+"""
+
+try:
+    from socketio import msgpack_packet
+    import msgpack # msgpack_packet imports it lazily
+except ImportError:
+    msgpack_packet = None
+
+class Deflate():
+    # Sizes messages as permessage-deflate sends them: raw deflate, flushed after each message, minus the 4 byte tail the extension drops
+    def __init__(self):
+        self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+
+    def size(self, data):
+        return len(self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+def encodings():
+    # name -> function making the bytes of one Socket.IO event as sent in a WebSocket message
+    def json_event(name, args):
+        return ("4" + packet.Packet(packet.EVENT, data=[name] + list(args), namespace="/").encode()).encode() # "4" is Engine.IO's message type
+    found = {"json": json_event}
+    if msgpack_packet is not None:
+        found["msgpack"] = lambda name, args: msgpack_packet.MsgPackPacket(packet.EVENT, data=[name] + list(args), namespace="/").encode()
+    return found
+
+def play(app, socketio, version, uids, deckID, rng, cpu):
+    # Plays one match, returning every event each socket sent and received as (socket, direction, name, args)
+    events = []
+    players = []
+    for uid in uids:
+        web = app.test_client()
+        with web.session_transaction() as session:
+            session["_user_id"] = str(uid)
+            session["_fresh"] = True
+        sock = socketio.test_client(app, flask_test_client=web, auth={"protocol": version} if version > 1 else None)
+        players.append(sock)
+
+    def emit(i, name, *args):
+        start = time.process_time()
+        players[i].emit(name, *args)
+        if name in ("begin_timing", "submit_answer"): # Only the game's events changed between versions. Matchmaking is the same in both.
+            cpu.append(time.process_time() - start)
+        events.append((i, "sent", name, args))
+        for message in players[i].get_received():
+            events.append((i, "received", message["name"], tuple(message["args"])))
+        return events[-1]
+
+    try:
+        emit(0, "find_game", {"random": True, "deckID": str(deckID)})
+        emit(1, "find_game", {"random": True, "deckID": str(deckID)})
+        for i in range(2): # Both sockets were told about the room, and it's the last thing either received
+            for message in players[i].get_received():
+                events.append((i, "received", message["name"], tuple(message["args"])))
+        roomID = [args[0]["roomID"] for socket, direction, name, args in events if name == "found_room"][0]
+        for i in range(2):
+            url = {"pathname": "/play/%d" % roomID, "href": "http://localhost:5000/play/%d" % roomID, "host": "localhost:5000", "origin": "http://localhost:5000",
+                   "hostname": "localhost", "port": "5000", "protocol": "http:", "search": "", "hash": ""} # A browser's document.location, as version 1 sent it
+            emit(i, "begin_timing", roomID if version > 1 else {"url": url})
+            questionID = 0
+            while True:
+                answerID = rng.randrange(1, 5)
+                socket, direction, name, args = emit(i, "submit_answer", [questionID, answerID] if version > 1 else {"questionID": questionID, "answerID": answerID, "url": url})
+                if name not in ("submit_question", "score"):
+                    break
+                questionID = args[0][0] if version > 1 else args[0]["question_ID"]
+    finally:
+        for sock in players:
+            sock.disconnect()
+    return events
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the bytes per match and server CPU per event of each version of QuizLive's socket protocol.")
+    parser.add_argument("--matches", type=int, default=200, help="matches played with each version")
+    parser.add_argument("--questions", type=int, default=5, help="questions in the deck")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from .. import create_app, db, socketio, protocol
+    with tempfile.TemporaryDirectory() as folder:
+        app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(folder, "protocol.sqlite"), "TESTING": True, "MATCHMAKING_BASE_BAND": 100000}) # The same two players meet every time, however far apart their ELOs drift
+        with app.app_context():
+            seed_database(db, 2, 1, args.questions, random.Random(args.seed))
+
+        formats = encodings()
+        print("%-14s %10s %12s" % ("version", "events", "CPU us p50") + "".join(" %16s %16s" % (name + " up", name + " down") for format in formats for name in (format, format + "+deflate")))
+        versions = [(version, False) for version in range(1, protocol.VERSION + 1)] + [(protocol.VERSION, True)] # (version, PREFETCH_QUESTIONS)
+        rngs = {version: random.Random(args.seed) for version in versions} # Every version gives the same answers
+        cpu = {version: [] for version in versions}
+        totals = {version: {} for version in versions}
+        for _ in range(args.matches):
+            for version in versions: # Taking turns, so warming up and any slowdown during the run affect every version alike
+                app.config["PREFETCH_QUESTIONS"] = version[1]
+                events = play(app, socketio, version[0], (1, 2), 1, rngs[version], cpu[version])
+                for format, encode in formats.items():
+                    compressors = {}
+                    for socket, direction, name, event_args in events:
+                        data = encode(name, event_args)
+                        deflate = compressors.setdefault((socket, direction), Deflate()) # Each direction of each connection has its own deflate context
+                        for key, size in ((format, len(data)), (format + "+deflate", deflate.size(data))):
+                            totals[version][key, direction] = totals[version].get((key, direction), 0) + size
+        for version in versions:
+            sizes = "".join(" %16.0f %16.0f" % (totals[version][name, "sent"] / args.matches, totals[version][name, "received"] / args.matches) for format in formats for name in (format, format + "+deflate"))
+            print("%-14s %10d %12.1f" % ("%d%s" % (version[0], " + prefetch" if version[1] else ""), len(cpu[version]), statistics.median(cpu[version]) * 1e6) + sizes)
+        print("Bytes are per match, for both players, client to server (up) and server to client (down). CPU is the median per begin_timing or submit_answer.")
+        if "msgpack" not in formats:
+            print("msgpack isn't installed, so MessagePack wasn't measured.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import io
+import os
+import random
+import re
+import sys
+import tempfile
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from .loadtest import Player, seed_database
+
+"""
+Runs EXPLAIN QUERY PLAN over every query QuizLive issues, and fails if any of them has to scan a whole table to filter it.
+
+The app is run against a fresh, seeded SQLite database, and every page, form and socket event is used at least once:
+a few simulated matches are played (see loadtest.py), then a logged in user visits each page and submits each form.
+Every SQL statement sent to the database is captured, along with the page or socket event that sent it and its parameters.
+Each distinct statement is then explained, and any step which SCANs a table (rather than SEARCHing it with an index) is reported.
+
+A scan is only a failure when the statement has a WHERE clause, as that means an index is missing for the lookup.
+Statements without one (such as listing every deck) read the whole table whatever the indexes are, so they are only listed as notes.
+The exit code is 1 if there are any failures, so this can be run before every release:
+
+    python -m QuizLive.benchmarks.queryplan
+"""
+
+def exercise(app, socketio, db, matches, rng):
+    from ..models import User, Deck, Question
+    from .. import results_writer
+
+    # Play some matches, so the socket events and the results writer issue their queries
+    players = [Player(app, socketio, i + 1, i // 2 + 1, random.Random(rng.random()), 10) for i in range(matches * 2)]
+    for a, b in zip(players[::2], players[1::2]): # The two players of a match take turns, so that nothing needs to run in parallel
+        run_pair(a, b)
+    results_writer.flush()
+
+    with app.app_context():
+        user = db.session.get(User, 1) # player0, who owns the first deck
+        user.password = generate_password_hash("Password1!")
+        friend = db.session.get(User, 2)
+        db.session.commit()
+        friendid = friend.friendid
+        deck = Deck.query.filter_by(uid=1).first()
+        question = Question.query.filter_by(deck_id=deck.id).first()
+        deckID, deckname, questionID = deck.id, deck.name, question.id
+
+    web = app.test_client()
+    web.post("/signup", data={"email": "new@queryplan", "name": "new", "password": "Password1!"})
+    web.post("/login", data={"email": "player0@loadtest", "password": "Password1!"})
+    for path in ["/", "/profile", "/user/2", "/browse", "/select", "/make", "/add", "/decks/%d" % deckID, "/decks/%d/edit-question/%d" % (deckID, questionID)]:
+        web.get(path)
+    for sort in ("newest", "oldest", "name"): # Follow a cursor for every sort, as each has its own keyset query
+        page = web.get("/api/decks", query_string={"sort": sort}).get_json()
+        web.get("/api/decks", query_string={"sort": sort, "after": page["next"]})
+        web.get("/browse", query_string={"sort": sort, "after": page["next"]})
+    web.get("/search", query_string={"q": "deck1"})
+    web.get("/user/1/stats")
+    page = web.get("/api/users/1/matches", query_string={"limit": 1}).get_json()
+    web.get("/api/users/1/matches", query_string={"before": page["next"]})
+    web.get("/api/users/1/stats")
+    web.get("/leaderboard")
+    web.get("/leaderboard/%d" % deckID)
+    web.get("/api/leaderboard", query_string={"deck": deckID})
+    web.get("/api/search", query_string={"q": "Question deck"})
+    web.post("/profile", data={"friendid": friendid})
+    web.post("/profile", data={"friendid": friendid}) # Adding the same friend again takes a different path
+    web.get("/profile")
+    web.post("/make", data={"title": "queryplan deck"})
+    web.post("/add", data={"question": "Q", "question1": "A", "question2": "B", "question3": "C", "question4": "D", "correct": "1", "deckselect": deckname})
+    web.post("/add", data={"question": "Q", "question1": "A", "question2": "B", "question3": "C", "question4": "D", "correct": "2", "deckselect": deckname, "edit": str(questionID + 1)})
+    exported = web.get("/decks/%d/export.jsonl" % deckID).get_data()
+    web.get("/decks/%d/export.csv" % deckID).get_data()
+    web.post("/decks/import", data={"title": "queryplan import", "file": (io.BytesIO(exported), "deck.jsonl")}, content_type="multipart/form-data")
+    web.get("/decks/%d/delete-question/%d" % (deckID, questionID))
+    web.get("/decks/%d/delete" % deckID)
+    web.get("/logout")
+
+def run_pair(a, b):
+    # Both players connect and queue, then each plays through their questions before the other loads the results
+    for player in (a, b):
+        player.web = player.app.test_client()
+        with player.web.session_transaction() as session:
+            session["_user_id"] = str(player.uid)
+        player.sock = player.socketio.test_client(player.app, flask_test_client=player.web)
+    a.emit("find_game", {"random": True, "deckID": str(a.deckID)})
+    b.emit("find_game", {"random": True, "deckID": str(b.deckID)})
+    roomID = a.wait_for("found_room")["args"][0]["roomID"]
+    url = {"pathname": "/play/%s" % roomID}
+    for player in (a, b):
+        player.web.get("/play/%s" % roomID)
+        player.emit("begin_timing", {"url": url})
+        questionID = 0
+        while True:
+            player.emit("submit_answer", {"questionID": questionID, "answerID": player.rng.randrange(1, 5), "url": url})
+            message = player.wait_for("submit_question", "end_quiz")
+            if message["name"] == "end_quiz":
+                break
+            questionID = message["args"][0]["question_ID"]
+        player.web.get("/results/%s" % roomID)
+    for player in (a, b):
+        player.sock.disconnect()
+
+def main():
+    parser = argparse.ArgumentParser(description="Explains every query QuizLive issues and fails if any of them filters with a full table scan.")
+    parser.add_argument("--matches", type=int, default=3, help="matches to play before visiting the pages")
+    parser.add_argument("--verbose", action="store_true", help="print the plan of every statement, not just the problems")
+    args = parser.parse_args()
+
+    from .. import create_app, db, socketio, storage
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as folder:
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(folder, "queryplan.sqlite"),
+            "DECKS_PER_PAGE": 5, # Small pages, so that there is a next page to follow
+            "LEADERBOARD_TTL": 0, # Every leaderboard visit after the first catches up with the results, so those queries are explained too
+        }) # TESTING is left off, so a page which errors is logged as a 500 rather than stopping the audit
+        with app.app_context():
+            seed_database(db, 200, 200, 20, rng) # Enough rows that SQLite's planner has a reason to prefer an index
+            db.session.execute(db.text("ANALYZE"))
+            db.session.commit()
+
+            statements = {} # statement -> (parameters, set of the places it was sent from)
+            def capture(conn, cursor, statement, parameters, context, executemany):
+                if not re.match(r"\s*(SELECT|UPDATE|DELETE)\b", statement, re.I):
+                    return
+                if executemany:
+                    parameters = parameters[0]
+                source = "background"
+                if has_request_context():
+                    source = request.event["message"] if getattr(request, "event", None) else request.endpoint
+                statements.setdefault(statement, (parameters, set()))[1].add(source)
+            engines = [db.engine] + ([storage.read_engine] if storage.read_engine is not None else []) # Read-only pages use their own connections
+            for engine in engines:
+                event.listen(engine, "before_cursor_execute", capture)
+
+        exercise(app, socketio, db, args.matches, rng)
+
+        failures = 0
+        with app.app_context():
+            for engine in engines:
+                event.remove(engine, "before_cursor_execute", capture)
+            with db.engine.connect() as conn:
+                tables = {row[0] for row in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table' AND sql NOT LIKE 'CREATE VIRTUAL TABLE%' AND name NOT LIKE '%fts%'")}
+                for statement, (parameters, sources) in sorted(statements.items(), key=lambda item: sorted(item[1][1])):
+                    plan = [row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+                    # Only scans of real tables count. Scans of subqueries, and of the full-text tables (which use their own index), are fine.
+                    scans = [step for step in plan if re.match(r"SCAN (\w+)", step) and re.match(r"SCAN (\w+)", step).group(1) in tables]
+                    filtered = re.search(r"\bWHERE\b", statement, re.I)
+                    if scans and filtered:
+                        failures += 1
+                        label = "FAIL"
+                    elif scans:
+                        label = "NOTE"
+                    elif args.verbose:
+                        label = "ok"
+                    else:
+                        continue
+                    print("%s  %s\n      %s\n      plan: %s\n" % (label, ", ".join(sorted(sources)), " ".join(statement.split()), "; ".join(plan)))
+        print("%d distinct statements explained, %d filter with a full table scan" % (len(statements), failures))
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
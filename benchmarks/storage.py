@@ -0,0 +1,94 @@
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from flask import g
+
+from .loadtest import percentile, seed_database
+
+"""
+Measures how the SQLite settings in storage.py cope with a mix of reads and writes from many threads at once.
+
+Each thread repeatedly either reads (a page of decks, then one deck's questions, as /browse and /decks do) inside a @read_only
+context, or writes (adds a question, or updates a user's ELO, each committed on its own, as add_question and the results writer do).
+The same seeded workload is run against SQLite's default settings and against QuizLive's, each on a fresh database.
+"""
+
+# SQLite's own defaults, with the read pool turned off, to compare against
+DEFAULTS = {
+    "SQLITE_JOURNAL_MODE": "delete",
+    "SQLITE_SYNCHRONOUS": "full",
+    "SQLITE_CACHE_SIZE": None,
+    "SQLITE_MMAP_SIZE": None,
+    "SQLITE_BUSY_TIMEOUT": None,
+    "SQLITE_READ_POOL_SIZE": 0,
+}
+
+def worker(app, db, operations, write_fraction, decks, users, seed, results):
+    from ..models import Question, User
+    from ..paging import page_decks
+    rng = random.Random(seed)
+    reads, writes, errors = [], [], []
+    for i in range(operations):
+        start = time.perf_counter()
+        try:
+            with app.app_context():
+                if rng.random() < write_fraction:
+                    if rng.random() < 0.5:
+                        db.session.add(Question(question="Benchmark question", answer1="A", answer2="B", answer3="C", answer4="D", correct="1", deck_id=rng.randrange(1, decks + 1)))
+                    else:
+                        db.session.get(User, rng.randrange(1, users + 1)).elo += 1
+                    db.session.commit()
+                    writes.append(time.perf_counter() - start)
+                else:
+                    g.read_only = True
+                    page, cursor = page_decks(rng.choice(["newest", "name"]), None, 30)
+                    Question.query.filter_by(deck_id=rng.choice(page).id).all()
+                    reads.append(time.perf_counter() - start)
+        except Exception as e: # e.g. "database is locked" once the busy timeout runs out
+            errors.append(e)
+    results.append((reads, writes, errors))
+
+def run(settings, threads, operations, write_fraction, seed):
+    from .. import create_app, db
+    with tempfile.TemporaryDirectory() as folder:
+        app = create_app(dict(settings, SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(folder, "storage.sqlite")))
+        users, decks = 1000, 500
+        with app.app_context():
+            seed_database(db, users, decks, 20, random.Random(seed))
+
+        results = []
+        pool = [threading.Thread(target=worker, args=(app, db, operations, write_fraction, decks, users, seed + i, results)) for i in range(threads)]
+        start = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        with app.app_context():
+            db.engine.dispose()
+        reads = [value for result in results for value in result[0]]
+        writes = [value for result in results for value in result[1]]
+        errors = [error for result in results for error in result[2]]
+        return (len(reads) + len(writes)) / elapsed, reads, writes, errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares SQLite's default settings with QuizLive's under a mixed read/write load.")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--operations", type=int, default=500, help="operations per thread")
+    parser.add_argument("--writes", type=float, default=0.2, help="fraction of operations which write")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("%-8s %10s %14s %14s %14s %14s %8s" % ("", "ops/s", "read p50 ms", "read p99 ms", "write p50 ms", "write p99 ms", "errors"))
+    for name, settings in (("default", DEFAULTS), ("tuned", {})):
+        rate, reads, writes, errors = run(settings, args.threads, args.operations, args.writes, args.seed)
+        print("%-8s %10.0f %14.2f %14.2f %14.2f %14.2f %8d" % (name, rate, percentile(reads, 0.5) * 1000, percentile(reads, 0.99) * 1000, percentile(writes, 0.5) * 1000, percentile(writes, 0.99) * 1000, len(errors)))
+        if errors:
+            print("         e.g. %r" % errors[0])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+
+from sqlalchemy import insert, select
+
+"""
+This module moves whole decks in and out of QuizLive as JSON Lines or CSV files.
+
+Both formats have one question per line (after a header line, for CSV) with the fields in FIELDS, the same as the columns of
+the questions table. correct is the number (1-4) of the right answer. For example, as JSON Lines:
+
+    {"question": "What is 2 + 2?", "answer1": "3", "answer2": "4", "answer3": "5", "answer4": "22", "correct": 2}
+
+An import reads the file a line at a time and inserts the questions BULK_BATCH_SIZE at a time, each batch as one executemany
+INSERT rather than one ORM object per question, so a deck of any size is imported in bounded memory. The new deck and all of its
+questions are committed in a single transaction, so a file with a bad line doesn't leave half a deck behind.
+The search triggers (see search.py) index the new questions as they are inserted.
+
+An export reads the deck's questions BULK_BATCH_SIZE at a time in ID order, and streams each batch out as it is read.
+Questions without a correct answer of 1-4 (which older versions allowed) can't be played or imported again, so they are left out and logged.
+"""
+
+FIELDS = ("question", "answer1", "answer2", "answer3", "answer4", "correct")
+FORMATS = {"jsonl": "application/x-ndjson", "csv": "text/csv"} # format -> MIME type
+
+class ImportFailed(ValueError):
+    """ Raised when a line of an import file can't be turned into a question. The message says which line, for showing to the user. """
+    def __init__(self, line, message):
+        super().__init__("Line %d: %s" % (line, message))
+        self.line = line
+
+
+def guess_format(filename, default="jsonl"):
+    # Works out the format from a file's extension, e.g. "bank.csv" -> "csv". ".json" and ".ndjson" are read as JSON Lines.
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if extension in ("json", "ndjson"):
+        return "jsonl"
+    return extension if extension in FORMATS else default
+
+def read_rows(text, format):
+    """ Yields (line number, dict) for each question in a text stream, without reading more than one line ahead. """
+    if format == "csv":
+        reader = csv.DictReader(text)
+        missing = [field for field in FIELDS if field not in (reader.fieldnames or [])]
+        if missing:
+            raise ImportFailed(1, "the header is missing %s" % ", ".join(missing))
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for number, line in enumerate(text, 1):
+            if not line.strip(): # Blank lines, e.g. at the end of the file, are skipped
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise ImportFailed(number, "not valid JSON")
+            if not isinstance(row, dict):
+                raise ImportFailed(number, "expected a JSON object")
+            yield number, row
+
+def clean(number, row):
+    # Checks one row and returns it with just the question columns, all as strings as the questions table stores them
+    question = {}
+    for field in FIELDS:
+        value = row.get(field)
+        if value is None or str(value).strip() == "":
+            raise ImportFailed(number, "%s is empty" % field)
+        question[field] = str(value)
+    if question["correct"].strip() not in ("1", "2", "3", "4"):
+        raise ImportFailed(number, "correct must be 1, 2, 3 or 4")
+    question["correct"] = question["correct"].strip()
+    return question
+
+def import_questions(text, format, deck_id, batch_size=500):
+    """ Inserts every question in a text stream into a deck, batch_size at a time. Returns how many were inserted.
+    Doesn't commit, so the caller decides what happens if a later line fails.
+    """
+    from . import db
+    from .models import Question
+    statement = insert(Question.__table__)
+    batch = []
+    count = 0
+    for number, row in read_rows(text, format):
+        batch.append(dict(clean(number, row), deck_id=deck_id))
+        if len(batch) >= batch_size:
+            db.session.execute(statement, batch) # A list of parameters is sent as one executemany
+            count += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(statement, batch)
+        count += len(batch)
+    return count
+
+def import_deck(text, format, title, user, batch_size=500):
+    """ Makes a new deck owned by user and imports the questions in a text stream into it.
+    Returns (deck, number of questions). Nothing is saved if any line is invalid, and ImportFailed says which one.
+    """
+    from . import db, deck_cache
+    from .models import Deck
+    deck = Deck(name=title.replace(" ", "_"), creator=user.name, uid=user.id) # The same as make_post, which doesn't allow spaces
+    try:
+        db.session.add(deck)
+        db.session.flush() # Gives the deck its ID
+        count = import_questions(text, format, deck.id, batch_size)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    deck_cache.invalidate(deck.id)
+    return deck, count
+
+def export_rows(deck_id, batch_size=500):
+    # Yields each question of a deck as a dict of FIELDS, loading batch_size at a time by keyset on ID
+    from . import db
+    from .models import Question
+    columns = [Question.id] + [getattr(Question, field) for field in FIELDS]
+    last = 0
+    while True:
+        rows = db.session.execute(select(*columns).where(Question.deck_id == deck_id, Question.id > last).order_by(Question.id).limit(batch_size)).all()
+        for row in rows:
+            yield dict(zip(FIELDS, row[1:]))
+        if len(rows) < batch_size:
+            return
+        last = rows[-1][0]
+
+def export_deck(deck_id, format, batch_size=500):
+    """ Yields a deck's questions as chunks of text in the given format, one chunk per batch of questions. """
+    from flask import current_app
+    from .deckcache import correct_answer
+    buffer = io.StringIO()
+    if format == "csv":
+        writer = csv.DictWriter(buffer, FIELDS)
+        writer.writeheader()
+    count = 0
+    skipped = 0
+    for row in export_rows(deck_id, batch_size):
+        row["correct"] = correct_answer(row["correct"])
+        if row["correct"] is None: # Checked before anything is written, as a stream can't be failed once it has started
+            skipped += 1
+            continue
+        if format == "csv":
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False) + "\n")
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+    if skipped:
+        current_app.logger.warning("Left %d questions of deck %d out of its export, as they have no valid correct answer", skipped, deck_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Imports a deck from, or exports a deck to, a JSON Lines or CSV file.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="make a new deck from a file")
+    importer.add_argument("file")
+    importer.add_argument("--title", required=True, help="name of the new deck")
+    importer.add_argument("--user", type=int, required=True, help="user ID of the deck's owner")
+    importer.add_argument("--format", choices=sorted(FORMATS), help="defaults to the file's extension")
+    exporter = commands.add_parser("export", help="write a deck's questions to a file")
+    exporter.add_argument("deck", type=int, help="deck ID")
+    exporter.add_argument("file", nargs="?", default="-", help="defaults to standard output")
+    exporter.add_argument("--format", choices=sorted(FORMATS), help="defaults to the file's extension")
+    args = parser.parse_args()
+
+    from . import create_app, db
+    from .models import User, Deck
+    app = create_app()
+    with app.app_context():
+        batch_size = app.config["BULK_BATCH_SIZE"]
+        if args.command == "import":
+            user = db.session.get(User, args.user)
+            if user is None:
+                sys.exit("There is no user %d" % args.user)
+            with open(args.file, encoding="utf-8-sig", newline="") as text:
+                try:
+                    deck, count = import_deck(text, args.format or guess_format(args.file), args.title, user, batch_size)
+                except ImportFailed as e:
+                    sys.exit(str(e))
+            print("Imported %d questions into deck %d (%s)" % (count, deck.id, deck.name))
+        else:
+            if db.session.get(Deck, args.deck) is None:
+                sys.exit("There is no deck %d" % args.deck)
+            format = args.format or guess_format(args.file)
+            out = sys.stdout if args.file == "-" else open(args.file, "w", encoding="utf-8", newline="")
+            try:
+                for chunk in export_deck(args.deck, format, batch_size):
+                    out.write(chunk)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+
+if __name__ == "__main__":
+    main()
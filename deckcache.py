@@ -0,0 +1,102 @@
+from array import array
+from collections import OrderedDict
+import random
+import threading
+import time
+
+"""
+This module caches the questions of each deck, so that creating a room doesn't have to load the whole deck through the ORM.
+
+Each deck is stored as a DeckSnapshot: an array of question IDs, an array of correct answers, and a tuple of question dicts.
+The question dicts are already in the format that the "submit_question" socket event sends, so they can be emitted as they are.
+Snapshots are shared between rooms, so they must never be changed. When a deck is edited, its snapshot is thrown away and rebuilt on the next request.
+
+The cache is an LRU, so only the most recently played decks are kept in memory.
+Each worker process has its own cache, and only hears about edits made in that process, so snapshots also expire after DECK_CACHE_TTL seconds.
+"""
+def correct_answer(value):
+    # The correct answer (1-4) stored for a question, or None if it's missing or isn't one of the four
+    try:
+        answer = int(value)
+    except (TypeError, ValueError):
+        return None
+    return answer if 1 <= answer <= 4 else None
+
+class DeckSnapshot():
+    __slots__ = ("deckID", "ids", "answers", "payloads", "loaded")
+
+    def __init__(self, deckID, rows):
+        self.deckID = deckID
+        rows = [row for row in rows if correct_answer(row[6]) is not None] # A question without a valid correct answer can't be played, so it's left out rather than breaking the whole deck
+        self.ids = array("q", (row[0] for row in rows)) # Question IDs
+        self.answers = array("b", (correct_answer(row[6]) for row in rows)) # The correct answer (1-4) for each question
+        self.payloads = tuple({"question":row[1], "a0":row[2], "a1":row[3], "a2":row[4], "a3":row[5]} for row in rows)
+        self.loaded = time.monotonic()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def sample(self, k):
+        # Picks up to k random question indices, in a random order. Only the chosen indices are generated, not a shuffled copy of the deck.
+        return random.sample(range(len(self.ids)), min(k, len(self.ids)))
+
+
+class DeckCache():
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._snapshots = OrderedDict() # deckID -> DeckSnapshot, from least to most recently used
+        self._generations = {} # deckID -> how many times it has been invalidated, so a load that started before an invalidate isn't cached
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.maxsize = app.config["DECK_CACHE_SIZE"]
+        self.ttl = app.config["DECK_CACHE_TTL"]
+        app.extensions["quizlive_deck_cache"] = self
+        if app.config["DECK_CACHE_WARM"]: # Optionally load the busiest decks up front, so the first rooms on a new worker don't have to
+            with app.app_context():
+                self.warm(app.config["DECK_CACHE_WARM"])
+
+    def get(self, deckID):
+        deckID = int(deckID)
+        with self._lock:
+            snapshot = self._snapshots.get(deckID)
+            if snapshot is not None and time.monotonic() - snapshot.loaded < self.ttl:
+                self._snapshots.move_to_end(deckID)
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+            generation = self._generations.get(deckID, 0)
+
+        snapshot = self._load(deckID) # Loaded outside the lock, so a slow query doesn't hold up rooms on other decks
+        with self._lock:
+            if self._generations.get(deckID, 0) != generation: # The deck changed while it was loading, so this copy may be old. It's still used this once.
+                return snapshot
+            self._snapshots[deckID] = snapshot
+            self._snapshots.move_to_end(deckID)
+            while len(self._snapshots) > self.maxsize:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    def _load(self, deckID):
+        from . import db
+        from .models import Question
+        # Only the columns are selected, so no ORM objects are created for the questions
+        rows = db.session.query(Question.id, Question.question, Question.answer1, Question.answer2, Question.answer3, Question.answer4, Question.correct).filter_by(deck_id=deckID).order_by(Question.id).all()
+        return DeckSnapshot(deckID, rows)
+
+    def invalidate(self, deckID):
+        # Called whenever a deck's questions change
+        with self._lock:
+            self._snapshots.pop(int(deckID), None)
+            self._generations[int(deckID)] = self._generations.get(int(deckID), 0) + 1
+
+    def warm(self, deckIDs):
+        for deckID in deckIDs:
+            self.get(deckID)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._snapshots), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+import threading
+import time
+
+"""
+This module caches each user's friends list, so that /profile doesn't run a query for every friend.
+
+A friendship is a row in the friends table. Each row used to store only the friend's friend ID, so showing a friends list meant
+looking up every friend's user by friend ID, one query per friend. Rows now also store the friend's user ID in friend_uid
+(filled in for old rows by migration 3), so the whole list can be loaded with a single query joining friends to users.
+
+The cache keeps each user's friends as a tuple of user IDs, in the order they were added. The friends' names and ELOs come from the
+identity cache, which the joined query fills, so a cached friends list costs at most one query however many friends it has.
+profile_post calls invalidate() whenever a friend is added. Each worker has its own cache, so lists also expire after FRIEND_CACHE_TTL seconds.
+"""
+class FriendGraph():
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._friends = OrderedDict() # user ID -> (tuple of friend user IDs, time loaded), from least to most recently used
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.maxsize = app.config["FRIEND_CACHE_SIZE"]
+        self.ttl = app.config["FRIEND_CACHE_TTL"]
+        app.extensions["quizlive_friends"] = self
+
+    def friend_ids(self, uid):
+        with self._lock:
+            entry = self._friends.get(uid)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self._friends.move_to_end(uid)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return self._load(uid)
+
+    def friends(self, uid):
+        # Returns the Identities of a user's friends, in the order they were added
+        from . import identities
+        return identities.get_many(self.friend_ids(uid))
+
+    def _load(self, uid):
+        from . import db, identities
+        from .models import User, Friend
+        users = db.session.query(User).join(Friend, Friend.friend_uid == User.id).filter(Friend.uid == uid).order_by(Friend.id).all()
+        for user in users: # The rows have been loaded anyway, so the identity cache may as well have them
+            identities.put(user)
+        ids = tuple(user.id for user in users)
+        with self._lock:
+            self._friends[uid] = (ids, time.monotonic())
+            self._friends.move_to_end(uid)
+            while len(self._friends) > self.maxsize:
+                self._friends.popitem(last=False)
+        return ids
+
+    def invalidate(self, uid):
+        with self._lock:
+            self._friends.pop(uid, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._friends), "hits": self.hits, "misses": self.misses}
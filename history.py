@@ -0,0 +1,143 @@
+from collections import namedtuple
+
+"""
+This module keeps each user's match history and statistics.
+
+Working out a user's statistics from the results table would mean reading every match they have played on every view, and their
+rolling ELO can't be worked back out from it anyway. Instead, two aggregate tables are updated as each match is recorded:
+
+    user_stats     one row per user: matches played, wins, draws, losses, total and best score, and current and best winning streak
+    head_to_head   one row per pair of users who have played each other, in both directions: wins, draws and losses against that opponent
+
+The results writer (see persistence.py) calls record() for every match, in the same transaction as the match's Result row, so the
+aggregates always agree with the results table. They can be rebuilt from it at any time with rebuild(), e.g. after migration 6 first adds them.
+
+Match history is still read from the results table, which is indexed by (user1, id) and (user2, id). A page of history is the newest
+matches before a given result ID, so it costs the same however many matches a user has played.
+"""
+
+# One match from one user's side, for the history page and API
+HistoryEntry = namedtuple("HistoryEntry", ["id", "deck_id", "opponent", "score", "opponent_score", "outcome", "finished"])
+
+def outcome(score, opponent_score):
+    return "win" if score > opponent_score else "draw" if score == opponent_score else "loss"
+
+
+class MatchHistory():
+    def __init__(self, per_page=20):
+        self.per_page = per_page
+
+    def init_app(self, app):
+        from . import results_writer
+        self.per_page = app.config["HISTORY_PER_PAGE"]
+        app.extensions["quizlive_history"] = self
+        if self.record not in results_writer.listeners:
+            results_writer.listeners.append(self.record)
+
+    def record(self, session, summary, users):
+        """ Called by the results writer for each match, before its transaction is committed. Adds the match to both players' aggregates. """
+        from .models import UserStats, HeadToHead
+        for index, (user, player) in enumerate(zip(users, summary.players)):
+            opponent = users[1 - index]
+            stats = session.get(UserStats, user.id)
+            if stats is None:
+                stats = UserStats(uid=user.id, played=0, wins=0, draws=0, losses=0, total_score=0, best_score=0, streak=0, best_streak=0)
+                session.add(stats)
+            record_match(stats, player.won, player.drew, player.score)
+
+            head = session.query(HeadToHead).filter_by(uid=user.id, opponent=opponent.id).first()
+            if head is None:
+                head = HeadToHead(uid=user.id, opponent=opponent.id, wins=0, draws=0, losses=0)
+                session.add(head)
+            head.wins += int(player.won)
+            head.draws += int(player.drew)
+            head.losses += int(not player.won and not player.drew)
+
+    def stats(self, uid):
+        # Returns a user's UserStats row, or None if they haven't played a match
+        from . import db
+        from .models import UserStats
+        return db.session.get(UserStats, uid)
+
+    def head_to_head(self, uid, opponents):
+        """ Returns the HeadToHead rows for a user against each of a list of opponents (e.g. their friends) that they have played, in the same order. """
+        from .models import HeadToHead
+        if not opponents:
+            return []
+        rows = {row.opponent: row for row in HeadToHead.query.filter(HeadToHead.uid == uid, HeadToHead.opponent.in_(opponents))}
+        return [rows[opponent] for opponent in opponents if opponent in rows]
+
+    def matches(self, uid, before=None, limit=None):
+        """ Returns (entries, next) for a page of a user's matches, newest first. next is the before value for the following page, or None.
+        The user can be either player of a result, so the newest matches as each player are loaded separately, each from its own index, and merged.
+        """
+        from . import db
+        from .models import Result
+        limit = limit or self.per_page
+        rows = []
+        for mine, theirs, score, opponent_score in ((Result.user1, Result.user2, Result.score1, Result.score2), (Result.user2, Result.user1, Result.score2, Result.score1)):
+            query = db.session.query(Result.id, Result.deck_id, theirs, score, opponent_score, Result.finished).filter(mine == uid)
+            if before is not None:
+                query = query.filter(Result.id < before)
+            rows.extend(query.order_by(Result.id.desc()).limit(limit + 1)) # One extra match is loaded to find out whether there is another page
+        rows.sort(key=lambda row: row[0], reverse=True)
+        entries = [HistoryEntry(row[0], row[1], row[2], row[3], row[4], outcome(row[3], row[4]), row[5]) for row in rows[:limit]]
+        return entries, entries[-1].id if len(rows) > limit else None
+
+
+def record_match(stats, won, drew, score):
+    # Adds one match to a UserStats row
+    stats.played += 1
+    stats.wins += int(won)
+    stats.draws += int(drew)
+    stats.losses += int(not won and not drew)
+    stats.total_score += score
+    stats.best_score = max(stats.best_score, score)
+    stats.streak = stats.streak + 1 if won else 0 # The current winning streak. A draw ends it as well as a loss.
+    stats.best_streak = max(stats.best_streak, stats.streak)
+
+
+def rebuild(conn):
+    """ Recomputes user_stats and head_to_head from the results table, oldest match first so that streaks come out right. Takes a sqlite3 connection. """
+    users = {}
+    heads = {}
+    for user1, user2, score1, score2 in conn.execute("SELECT user1, user2, score1, score2 FROM results ORDER BY id"):
+        if user1 is None or user2 is None or score1 is None or score2 is None:
+            continue
+        for uid, opponent, score, opponent_score in ((user1, user2, score1, score2), (user2, user1, score2, score1)):
+            stats = users.setdefault(uid, _Row(played=0, wins=0, draws=0, losses=0, total_score=0, best_score=0, streak=0, best_streak=0))
+            record_match(stats, score > opponent_score, score == opponent_score, score)
+            head = heads.setdefault((uid, opponent), [0, 0, 0])
+            head[("win", "draw", "loss").index(outcome(score, opponent_score))] += 1
+    conn.execute("DELETE FROM user_stats")
+    conn.execute("DELETE FROM head_to_head")
+    conn.executemany("INSERT INTO user_stats (uid, played, wins, draws, losses, total_score, best_score, streak, best_streak) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ((uid, s.played, s.wins, s.draws, s.losses, s.total_score, s.best_score, s.streak, s.best_streak) for uid, s in users.items()))
+    conn.executemany("INSERT INTO head_to_head (uid, opponent, wins, draws, losses) VALUES (?, ?, ?, ?, ?)",
+        ((uid, opponent, *counts) for (uid, opponent), counts in heads.items()))
+
+class _Row():
+    # A stand-in for a UserStats row, so rebuild() can use record_match without the ORM
+    def __init__(self, **columns):
+        self.__dict__.update(columns)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Rebuilds QuizLive's per-user statistics and head-to-head records from its match results.")
+    parser.parse_args()
+
+    from . import create_app, db
+    app = create_app()
+    with app.app_context():
+        raw = db.engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            rebuild(conn)
+            conn.commit()
+            print("Rebuilt statistics for %d users" % conn.execute("SELECT COUNT(*) FROM user_stats").fetchone()[0])
+        finally:
+            raw.close()
+
+if __name__ == "__main__":
+    main()
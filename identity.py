@@ -0,0 +1,98 @@
+from collections import OrderedDict
+import threading
+import time
+
+from flask_login import UserMixin
+
+"""
+This module caches the logged in users, so that current_user doesn't query the database on every request and socket event.
+
+Flask-Login calls load_user (in __init__.py) every time current_user is first used in a request, and Flask-SocketIO treats each socket event as a new request.
+Without a cache, that means a primary key query for nearly every socket event of a match.
+
+The cache holds Identity objects rather than User objects. An Identity is a plain copy of the user's columns (minus the password hash),
+so it can be shared between requests and threads without being attached to a database session.
+Whenever a user's row changes, invalidate() must be called so that the next request loads the new values.
+Each worker process has its own cache, so entries also expire after IDENTITY_CACHE_TTL seconds to pick up changes made by other workers.
+"""
+class Identity(UserMixin):
+    FIELDS = ("id", "email", "name", "friendid", "elo", "wincount", "matchcount")
+
+    def __init__(self, user):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(user, field))
+        self.loaded = time.monotonic()
+        self.valid = True # Set to False when the user changes, so that sockets holding on to this copy know to get a new one
+
+
+class IdentityCache():
+    def __init__(self, maxsize=10000, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._identities = OrderedDict() # user ID -> Identity, from least to most recently used
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.maxsize = app.config["IDENTITY_CACHE_SIZE"]
+        self.ttl = app.config["IDENTITY_CACHE_TTL"]
+        app.extensions["quizlive_identities"] = self
+
+    def fresh(self, identity): # Whether a copy can still be used
+        return identity.valid and time.monotonic() - identity.loaded < self.ttl
+
+    def get(self, uid):
+        # Returns the Identity for this user ID, or None if there is no such user
+        with self._lock:
+            identity = self._identities.get(uid)
+            if identity is not None and self.fresh(identity):
+                self._identities.move_to_end(uid)
+                self.hits += 1
+                return identity
+            self.misses += 1
+
+        from .models import User
+        user = User.query.get(uid)
+        if user is None:
+            return None
+        return self.put(user)
+
+    def get_many(self, uids):
+        # Returns the Identities for a list of user IDs, in the same order, skipping any which don't exist. Every miss is loaded in one query.
+        found = {}
+        with self._lock:
+            for uid in uids:
+                identity = self._identities.get(uid)
+                if identity is not None and self.fresh(identity):
+                    self._identities.move_to_end(uid)
+                    self.hits += 1
+                    found[uid] = identity
+        missing = [uid for uid in uids if uid not in found]
+        if missing:
+            from .models import User
+            with self._lock:
+                self.misses += len(missing)
+            for user in User.query.filter(User.id.in_(missing)):
+                found[user.id] = self.put(user)
+        return [found[uid] for uid in uids if uid in found]
+
+    def put(self, user):
+        # Caches a freshly loaded User row, e.g. one that another query has already fetched, and returns its Identity
+        identity = Identity(user)
+        with self._lock:
+            self._identities[user.id] = identity
+            self._identities.move_to_end(user.id)
+            while len(self._identities) > self.maxsize:
+                self._identities.popitem(last=False)
+        return identity
+
+    def invalidate(self, uid):
+        with self._lock:
+            identity = self._identities.pop(uid, None)
+            if identity is not None:
+                identity.valid = False
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._identities), "hits": self.hits, "misses": self.misses}
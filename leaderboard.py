@@ -0,0 +1,310 @@
+from collections import OrderedDict
+import threading
+import time
+
+"""
+This module keeps QuizLive's leaderboards: a global one of every player by ELO, and one for each deck of players by their wins on it.
+
+Sorting the users table by ELO for every view would read the whole table each time, so each board is kept in memory as a RankTree.
+A RankTree counts how many players have each score in a Fenwick (binary indexed) tree, which gives a player's rank, or the players
+ranked just below a given score, in O(log R) steps for scores up to R. The top N players are found by stepping down the scores which have
+players on them, so they cost O(N log R) however many players there are.
+
+The boards are updated as each match is recorded. The results writer (see persistence.py) calls record() for every match in the same
+transaction as the match's Result row and rating changes, and record() updates the players' rows in the deck_standings table. The in-memory
+boards are only given the new scores once that transaction has committed, so a batch that is rolled back never shows on them. deck_standings is the per-deck board's backing table, holding each player's wins, draws and matches on each deck,
+indexed by deck so a deck's board loads with one index search. It can be rebuilt from the results table at any time (see rebuild()).
+The global board is loaded from users.elo, which the results writer keeps up to date.
+
+Each worker has its own boards, and only sees the matches its own results writer records, so after LEADERBOARD_TTL seconds a board catches up
+with the others. Every match adds a row to the results table, whose IDs only go up, so each board remembers the last result it has seen and
+reloads just the scores of the players in newer results, using the primary key and one index search per player. Only the first use of a board
+(or a catch up with more players than REFRESH_LIMIT) reads all of its rows.
+Players with the same score share a rank, and ELOs are ranked by their whole number part.
+"""
+
+class RankTree():
+    """ Ranks keys (user IDs) by non-negative whole number scores. Scores below 0 count as 0, and the tree grows to fit larger ones. """
+    def __init__(self, size=1024):
+        self._tree = [0] * (size + 1) # Fenwick tree of how many keys have each score. Index i holds score i - 1.
+        self._scores = {} # key -> score
+        self._members = {} # score -> set of keys with that score
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, key):
+        return key in self._scores
+
+    def _add(self, score, change):
+        i = score + 1
+        while i < len(self._tree):
+            self._tree[i] += change
+            i += i & -i
+
+    def _count_to(self, score):
+        # How many keys have a score of at most score
+        i = min(score + 1, len(self._tree) - 1)
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _find(self, count):
+        # The lowest score which has count keys at or below it. This walks down the tree rather than searching, so is O(log R).
+        position = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            if position + step < len(self._tree) and self._tree[position + step] < count:
+                position += step
+                count -= self._tree[position]
+            step >>= 1
+        return position # The tree index after position is the one that holds the score, and tree index i holds score i - 1
+
+    def _grow(self, score):
+        size = len(self._tree) - 1
+        while size <= score:
+            size *= 2
+        self._tree = [0] * (size + 1)
+        for existing, keys in self._members.items():
+            self._add(existing, len(keys))
+
+    def set(self, key, score):
+        score = max(int(score), 0)
+        old = self._scores.get(key)
+        if old == score:
+            return
+        if old is not None:
+            self.remove(key)
+        if score >= len(self._tree) - 1:
+            self._grow(score)
+        self._scores[key] = score
+        self._members.setdefault(score, set()).add(key)
+        self._add(score, 1)
+
+    def remove(self, key):
+        score = self._scores.pop(key, None)
+        if score is None:
+            return
+        keys = self._members[score]
+        keys.discard(key)
+        if not keys:
+            del self._members[score]
+        self._add(score, -1)
+
+    def score(self, key):
+        return self._scores.get(key)
+
+    def rank(self, key):
+        # 1 + the number of keys with a higher score, or None if the key isn't on the board
+        score = self._scores.get(key)
+        if score is None:
+            return None
+        return 1 + len(self._scores) - self._count_to(score)
+
+    def top(self, n):
+        """ Returns up to n (rank, key, score) tuples, best first. Keys with the same score are in key order. """
+        entries = []
+        below = len(self._scores) # How many keys have a score at most the last score visited
+        while below and len(entries) < n:
+            score = self._find(below)
+            keys = sorted(self._members[score])
+            rank = 1 + len(self._scores) - below
+            entries.extend((rank, key, score) for key in keys[:n - len(entries)])
+            below -= len(keys)
+        return entries
+
+
+REFRESH_LIMIT = 900 # Most players a board catches up with one at a time. More than this and it's loaded again. It's under SQLite's oldest limit on parameters, 999.
+
+class Leaderboards():
+    def __init__(self, size=50, ttl=300, maxdecks=256):
+        self.size = size # How many players a board shows
+        self.ttl = ttl
+        self.maxdecks = maxdecks
+        self._global = None # [RankTree, time last brought up to date, ID of the last result it has seen]
+        self._decks = OrderedDict() # deck ID -> [RankTree, time last brought up to date, ID of the last result it has seen], from least to most recently used
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        from . import results_writer
+        self.size = app.config["LEADERBOARD_SIZE"]
+        self.ttl = app.config["LEADERBOARD_TTL"]
+        self.maxdecks = app.config["LEADERBOARD_DECKS"]
+        app.extensions["quizlive_leaderboards"] = self
+        if self.record not in results_writer.listeners:
+            results_writer.listeners.append(self.record)
+
+    def _board(self, deck_id):
+        # Returns the RankTree for a deck, or the global one for None, loading it if it isn't cached, or catching it up if its TTL has passed
+        now = time.monotonic()
+        with self._lock:
+            entry = self._global if deck_id is None else self._decks.get(deck_id)
+            if entry is not None:
+                if deck_id is not None:
+                    self._decks.move_to_end(deck_id)
+                if now - entry[1] < self.ttl:
+                    return entry[0]
+                seen = entry[2]
+        if entry is not None and self._refresh(deck_id, entry, seen, now):
+            return entry[0]
+        last = self._last_result() # Taken before the rows are read, so a match committed while they are read is caught up with next time
+        entry = [self._load(deck_id), now, last]
+        with self._lock:
+            if deck_id is None:
+                self._global = entry
+            else:
+                self._decks[deck_id] = entry
+                self._decks.move_to_end(deck_id)
+                while len(self._decks) > self.maxdecks:
+                    self._decks.popitem(last=False)
+        return entry[0]
+
+    def _last_result(self):
+        from . import db
+        from .models import Result
+        return db.session.query(db.func.max(Result.id)).scalar() or 0
+
+    def _scores(self, deck_id, uids=None):
+        # Yields (user ID, score or None) for every player on a board, or just for the players in uids. None means they aren't ranked.
+        from . import db
+        from .models import User, DeckStanding
+        if deck_id is None:
+            query = db.session.query(User.id, User.elo, User.matchcount)
+            if uids is not None:
+                query = query.filter(User.id.in_(uids))
+            for uid, elo, matchcount in query: # Players who haven't played a match aren't ranked
+                yield uid, elo if matchcount and elo is not None else None
+        else:
+            query = db.session.query(DeckStanding.uid, DeckStanding.wins).filter(DeckStanding.deck_id == deck_id)
+            if uids is not None:
+                query = query.filter(DeckStanding.uid.in_(uids))
+            for uid, wins in query:
+                yield uid, wins
+
+    def _load(self, deck_id):
+        board = RankTree()
+        for uid, score in self._scores(deck_id):
+            if score is not None:
+                board.set(uid, score)
+        return board
+
+    def _refresh(self, deck_id, entry, seen, now):
+        """ Catches a board up with the matches recorded since the last result it saw, by any worker. Returns False if so many players
+        have played since then that loading the board again is cheaper.
+        """
+        from . import db
+        from .models import Result
+        last = self._last_result()
+        query = db.session.query(Result.user1, Result.user2).filter(Result.id > seen, Result.id <= last) # A range of the primary key
+        if deck_id is not None:
+            query = query.filter(Result.deck_id == deck_id)
+        uids = set()
+        for user1, user2 in query:
+            uids.update((user1, user2))
+            if len(uids) > REFRESH_LIMIT:
+                return False
+        uids.discard(None)
+        scores = dict.fromkeys(uids) # A player with no row any more is taken off the board
+        if uids:
+            scores.update(self._scores(deck_id, uids))
+        with self._lock:
+            if entry[2] != seen: # Another thread caught it up first, with scores at least as new as these
+                return True
+            for uid, score in scores.items():
+                if score is None:
+                    entry[0].remove(uid)
+                else:
+                    entry[0].set(uid, score)
+            entry[1], entry[2] = now, last
+        return True
+
+    def top(self, deck_id=None, n=None):
+        """ Returns up to n (default LEADERBOARD_SIZE) (rank, Identity, score) tuples for a deck's board, or the global one, best first. """
+        from . import identities
+        board = self._board(deck_id)
+        with self._lock:
+            entries = board.top(n or self.size)
+        users = {user.id: user for user in identities.get_many([entry[1] for entry in entries])}
+        return [(rank, users[uid], score) for rank, uid, score in entries if uid in users]
+
+    def rank(self, uid, deck_id=None):
+        # Returns (rank, score, number of players) for a user on a board, with a rank of None if they aren't on it
+        board = self._board(deck_id)
+        with self._lock:
+            return board.rank(uid), board.score(uid), len(board)
+
+    def record(self, session, summary, users):
+        """ Called by the results writer for each match, before its transaction is committed. Updates the players' deck standings,
+        and returns a function which the writer calls once they're committed, to set the players' new scores on any boards in memory.
+        A match that the writer retries is recorded again from the database, so the boards only get the values that were committed.
+        """
+        from .models import DeckStanding
+        deck_id = int(summary.deckID)
+        standings = []
+        for user, player in zip(users, summary.players):
+            standing = session.query(DeckStanding).filter_by(deck_id=deck_id, uid=user.id).first()
+            if standing is None:
+                standing = DeckStanding(deck_id=deck_id, uid=user.id, wins=0, draws=0, played=0)
+                session.add(standing)
+            standing.played += 1
+            standing.wins += int(player.won)
+            standing.draws += int(player.drew)
+            standings.append(standing)
+        elos = [(user.id, user.elo) for user in users] # Read now, as the rows are expired when the transaction commits
+        wins = [(standing.uid, standing.wins) for standing in standings]
+
+        def committed():
+            with self._lock:
+                if self._global is not None:
+                    for uid, elo in elos:
+                        self._global[0].set(uid, elo)
+                entry = self._decks.get(deck_id)
+                if entry is not None:
+                    for uid, score in wins:
+                        entry[0].set(uid, score)
+        return committed
+
+    def clear(self):
+        with self._lock:
+            self._global = None
+            self._decks.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"decks": len(self._decks), "players": len(self._global[0]) if self._global is not None else 0}
+
+
+def rebuild(conn):
+    """ Recomputes deck_standings from the results table. Takes a sqlite3 connection. Matches recorded before results had a deck_id are left out. """
+    conn.execute("DELETE FROM deck_standings")
+    conn.execute("""
+        INSERT INTO deck_standings (deck_id, uid, wins, draws, played)
+        SELECT deck_id, uid, SUM(score > other), SUM(score = other), COUNT(*) FROM (
+            SELECT deck_id, user1 AS uid, score1 AS score, score2 AS other FROM results WHERE deck_id IS NOT NULL
+            UNION ALL
+            SELECT deck_id, user2, score2, score1 FROM results WHERE deck_id IS NOT NULL
+        ) GROUP BY deck_id, uid
+    """)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Rebuilds the per-deck leaderboards from QuizLive's match results.")
+    parser.parse_args()
+
+    from . import create_app, db
+    app = create_app()
+    with app.app_context():
+        raw = db.engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            rebuild(conn)
+            conn.commit()
+            print("Rebuilt %d deck standings" % conn.execute("SELECT COUNT(*) FROM deck_standings").fetchone()[0])
+        finally:
+            raw.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,22 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash, Flask
-from werkzeug.security import generate_password_hash, check_password_hash
-from .models import User, Deck, Question, Friend, Result
-from flask_login import login_user, logout_user, login_required, current_user
-from flask_socketio import SocketIO, rooms, send, emit, join_room, leave_room
-from . import db, socketio
-import random
-import datetime
+from flask import Blueprint, render_template, redirect, url_for, request, flash, abort, current_app, session, Response, stream_with_context
+from werkzeug.utils import secure_filename
+from .models import User, Deck, Question, Friend
+from flask_login import login_required, current_user
+from flask_socketio import emit, join_room
+from . import db, socketio, state, deck_cache, identities, results_writer, metrics, friend_graph, leaderboards, match_history, page_cache
+from .matchmaking import Ticket
+from .persistence import finalise_room
+from .paging import page_decks, SORTS
+from .search import search_decks
+from .storage import read_only
+from . import protocol
+import io
+import threading
+import time
 
 # I used Blueprinting here in order to make different modules of my program easily accessible from my pages. Any modules pertaining to authentication are under this auth blueprint, and all others come under the main blueprint.
 main = Blueprint('main', __name__)
-LFG_RANDOM = {} # These dictionaries are used with websockets and are populated as multiple users create different rooms at the same time. RANDOM is for random opponents
-LFG_FRIENDS = {} # FRIENDS is for friendly opponents added via link
-ROOMS = [] # This stores all the existing rooms.
+# Players looking for a game and all the existing rooms are kept in the state backend (see state.py), so that they can be shared between worker processes.
 
 """
 This section is a class to track games. It contains an ID, the ID of the deck currently playing, etc
@@ -22,154 +27,338 @@ class room():
     def __init__(self, roomID, deckID):
         self.roomID = roomID
         self.deckID = deckID
-        self.questions = list(Deck.query.filter_by(id=deckID).all()[0].questions)
         # This section chooses up to 5 random questions, based on the number of questions. They are also in a random order.
-        random.shuffle(self.questions)
-        if len(self.questions) > 5:
-            self.questions = self.questions[:5]
+        # The deck comes from the deck cache, so only the chosen questions are copied into the room.
+        deck = deck_cache.get(deckID)
+        chosen = deck.sample(5)
+        self.questionids = [deck.ids[i] for i in chosen]
+        self.questions = [deck.payloads[i] for i in chosen] # These are the question dicts sent to the client. They are shared with the cache, so must not be changed.
+        self.answers = [deck.answers[i] for i in chosen] # The correct answer for each question
         #
-        # This is a group of dicts and arrays to track everything to do with the users
-        self.users = []
-        self.usersids = []
-        self.usertimes = {}
-        self.userscores = {}
-        self.userqcounts = {}
-        self.usercorrects = {}
+        # Everything to do with the users is tracked in a PlayerState per user, keyed by user ID (names aren't unique).
+        self.players = {}
+        self.finished_count = 0 # How many players have answered every question, so checking whether the room is finished doesn't need a loop
+        self.summary = None # The MatchSummary (see persistence.py), set once by handle_answer when the last player finishes
+
+    def add_player(self, uid, name, sid):
+        if uid not in self.players:
+            self.players[uid] = PlayerState(uid, name, sid)
+        self.players[uid].sid = sid # Every page has its own socket, so keep the latest one
+        return self.players[uid]
+
+    def opponent(self, uid): # Returns the other player in the room, or None if they haven't joined yet
+        for player in self.players.values():
+            if player.uid != uid:
+                return player
+        return None
+
+"""
+This is a class to track a single player in a room.
+__slots__ stops Python giving each instance a dict, so each player only takes up a few fixed-size fields.
+The player's times are kept as the time they started and the time of their last answer, so the state stays the same size however long the match lasts.
+"""
+class PlayerState():
+    __slots__ = ("uid", "name", "sid", "started", "last", "answered", "correct", "score")
+
+    def __init__(self, uid, name, sid):
+        self.uid = uid
+        self.name = name
+        self.sid = sid
+        self.started = None # Time the player began the first question, or None if they haven't started yet
+        self.last = None # Time of the player's last answer (or their start time)
+        self.answered = 0
+        self.correct = 0
+        self.score = 0
 
 """ This function just checks whether a room is finished.
 It makes sure there are two users participating, and they have finished all of the questions.
-The inplace or operator is used to set `notfinished` to true if any of the users have not finished all questions
 """
 def getroomfinished(room):
-    notfinished = False
-    qcount = len(room.questions)
-    if len(room.userqcounts) == 2:
-        for key in room.userqcounts.keys():
-            notfinished |= (room.userqcounts[key] != qcount)
-    else:
-        return False
-    return not notfinished
+    return len(room.players) == 2 and room.finished_count == 2
 
 """ This is a websocket listener for "query_room_finished"
-This is called when the client JS wants to check whether the room is finished - used on the results screen.
+The waiting screen calls this once whenever its socket connects or reconnects.
+It joins the socket to the game's room so that it receives the "results_ready" push from handle_answer when the opponent finishes.
+It also checks whether the room finished while the socket was disconnected, in which case the push would have been missed.
 """
 @socketio.on("query_room_finished")
+@metrics.timed
 def query_finished(data):
-    room = ROOMS[data["roomID"]]
+    room = state.get_room(data["roomID"] if isinstance(data, dict) else data) # Version 2 pages send just the room ID (see protocol.py)
+    if room is None: # The room has been evicted, so there is nothing left to wait for
+        return
+    join_room(room.roomID)
     if getroomfinished(room):
         emit("refresh")
 
 """ This is a websocket listener for "find_game"
 This handles matchmaking, or generating a room useful for sending a challenge link to another player.
 
-The global LFG_RANDOM dictionary is used to keep track of players looking to play a specific deck.
-The keys in this dict are deck IDs, and are present when there is a player looking to play that deck.
-Should another player request a game for that deck, a room is created and both players are alerted about a room.
+The matchmaking queue in the state backend keeps track of players looking to play a specific deck, sorted by their ELO (see matchmaking.py).
+Should another player with a close enough ELO request a game for that deck, a room is created and both players are alerted about a room.
+Otherwise the player waits in the queue, and the matchmaker background task pairs them up once their acceptable ELO range has widened enough.
 """
 @socketio.on("find_game")
+@metrics.timed
 def find_game(data):
-    deckID = data["deckID"]
+    try:
+        deckID = str(int(data["deckID"])) # Pages send the deck ID as a string. Anything that isn't a number can't be a deck.
+    except (KeyError, TypeError, ValueError):
+        emit("empty_deck")
+        return
+    if not len(deck_cache.get(deckID)): # A deck with no playable questions (or no deck at all) can't make a match, so nobody is queued for it
+        emit("empty_deck")
+        return
     if data["random"]:
-        # dict.get here is used to check whether deckID exists in the keys for the random LFG dict
-        if LFG_RANDOM.get(deckID,False):
-            opponent = LFG_RANDOM[deckID]
-            room_id = len(ROOMS)
-            room_obj = room(room_id, deckID) # create room
-
-            join_room(room_id)
-            join_room(room_id,sid=opponent[0]) # This section lets socket send events to both players at once. SocketIO uses "rooms" to group sessions together.
-
-            room_obj.users.append(current_user.name)
-            room_obj.users.append(opponent[1])
-            room_obj.usersids.append(request.sid)
-            room_obj.usersids.append(opponent[0]) # This section lets the room object track the usernames and socket IDs of the players, for later reference
-
-            ROOMS.append(room_obj) # Keep global reference of the room object
-            LFG_RANDOM.pop(deckID) # Remove the request for the deck matchmaking
-            emit("found_room",{"roomID":room_id}, to=room_id) # Send found room notification to both players, prompting moving to play page.
-
-        else: # If first to request the pack, then add to the LFG dict and inform the user that they are waiting for a match
-            LFG_RANDOM[deckID] = [request.sid, data["username"]]
+        # This either takes the best opponent waiting for this deck, or queues us. It is atomic, so two players queueing at once can't overwrite each other.
+        ticket = Ticket(request.sid, current_user.id, current_user.name, current_user.elo, deckID)
+        opponent = state.enqueue(ticket)
+        if opponent:
+            start_match(deckID, ticket, opponent)
+        else: # If nobody suitable is waiting, then we have been queued. Inform the user that they are waiting for a match
+            start_matchmaker()
             emit("waiting")
-    
+
     else: # In the case of friend matchmaking...
-        room_id = len(ROOMS)
+        room_id = state.next_room_id()
         room_obj = room(room_id, deckID) # Make a new room
-        ROOMS.append(room_obj)
+        state.add_room(room_obj)
 
         emit("got_room", {"roomID":room_id}) # Tell that user that a room has been created for them
 
+""" This creates the room for two matched tickets and tells both players about it.
+The players are sent the room by socket ID rather than through a socket room, because their sockets may be connected to other workers.
+socketio.emit is used rather than emit, as this is also called from the matchmaker background task where there is no request.
+Both tickets have already left the queue by now, so if the room can't be made the players are told, rather than left waiting for good.
+"""
+def start_match(deckID, ticket, opponent):
+    try:
+        room_id = state.next_room_id()
+        room_obj = room(room_id, deckID) # create room
+
+        room_obj.add_player(ticket.uid, ticket.username, ticket.sid)
+        room_obj.add_player(opponent.uid, opponent.username, opponent.sid) # This section lets the room object track the players and their socket IDs, for later reference
+
+        state.add_room(room_obj) # Keep a shared reference of the room object
+    except Exception:
+        current_app.logger.exception("Starting a match on deck %s failed", deckID)
+        for player in (ticket, opponent):
+            socketio.emit("match_failed", to=player.sid)
+        return
+    socketio.emit("found_room", {"roomID":room_id}, to=ticket.sid) # Send found room notification to both players, prompting moving to play page.
+    socketio.emit("found_room", {"roomID":room_id}, to=opponent.sid)
+
+""" The matchmaker is a background task which sweeps the matchmaking queue every MATCHMAKING_INTERVAL seconds.
+Each sweep matches waiting players whose ELO bands have widened enough to accept each other, and times out players who have waited too long.
+It is started the first time a player has to wait, and then runs for the life of the worker.
+"""
+matchmaker_started = False
+matchmaker_lock = threading.Lock()
+
+def start_matchmaker():
+    global matchmaker_started
+    with matchmaker_lock:
+        if matchmaker_started:
+            return
+        matchmaker_started = True
+    socketio.start_background_task(matchmaker, current_app._get_current_object())
+
+def matchmaker(app):
+    while True:
+        socketio.sleep(app.config["MATCHMAKING_INTERVAL"])
+        try:
+            with app.app_context(): # Creating a room needs the database, so the sweep runs inside an app context
+                matches, expired = state.sweep_queue()
+                for a, b in matches: # start_match handles its own errors, so one match that can't start doesn't drop the rest
+                    start_match(a.deckID, a, b)
+                for ticket in expired:
+                    socketio.emit("queue_timeout", to=ticket.sid)
+        except Exception: # An error in one sweep shouldn't stop matchmaking for good
+            app.logger.exception("Matchmaking sweep failed")
+
+""" This is a websocket listener for "cancel_find_game", which takes the player out of the matchmaking queue."""
+@socketio.on("cancel_find_game")
+@metrics.timed
+def cancel_find_game(data=None):
+    state.cancel_wait(request.sid)
+
+""" This is a websocket listener for "connect".
+The socket's user is stored in its session when it connects, so load_user can hand it straight back for every event on this socket.
+Socket sessions are kept in memory by Flask-SocketIO and never sent back as a cookie, so the object can be stored as it is.
+"""
+@socketio.on("connect")
+@metrics.timed
+def connect(auth=None):
+    metrics.connected(1)
+    session["protocol"] = protocol.negotiate(auth) # The payload format this page understands. See protocol.py.
+    if current_user.is_authenticated:
+        session["identity"] = current_user._get_current_object()
+
+""" This is a websocket listener for "disconnect".
+A player who leaves the page while waiting for an opponent can't be matched any more, so they are taken out of the matchmaking queue.
+"""
+@socketio.on("disconnect")
+@metrics.timed
+def disconnect(*args):
+    metrics.connected(-1)
+    state.cancel_wait(request.sid)
+
 
 """ This is a websocket listener that listens for "begin_timing"
 The client calls this socket event in order to inform the server that they have begun answering the first question
 such that the server can keep timing of the first question as well as subsequent questions.
 """
 @socketio.on("begin_timing")
+@metrics.timed
 def begin_timing(data):
-    roomID = int(data["url"]["pathname"].split("/")[2]) # This gets the room ID from the URL, as doing this server-side is easier than client-side
-
-    ROOMS[roomID].usertimes[current_user.name] = [datetime.datetime.now()]
-    ROOMS[roomID].userqcounts[current_user.name] = 0
-    ROOMS[roomID].usercorrects[current_user.name] = 0 # Initialise room variables for current user to track corrects, answers, and times
+    roomID = protocol.room_id(data) # Version 2 pages send the room ID, and version 1 pages their URL (see protocol.py)
+    if roomID is None:
+        return
+    session["room"] = roomID # The socket is bound to this room, so its answers don't have to say which room they're for
+    with state.room(roomID) as room: # Changes made to the room inside this block are saved to the state backend at the end of it
+        if room is None or room.summary is not None: # A match can't be restarted once its result has been recorded
+            return
+
+        player = room.add_player(current_user.id, current_user.name, request.sid)
+        if player.answered == len(room.questions): # Starting again (e.g. by reloading the page) means the player is no longer finished
+            room.finished_count -= 1
+        player.started = player.last = time.time()
+        player.answered = 0
+        player.correct = 0
+        player.score = 0 # Initialise room variables for current user to track corrects, answers, and times
+        questions = room.questions
+
+    join_room(roomID) # The play page is a new socket connection, so it has to join the game's room again
+    # Pages which can show questions themselves are sent all of them now, so no question waits for the reply to the previous answer (see protocol.py)
+    session["prefetched"] = current_app.config['PREFETCH_QUESTIONS'] and session.get("protocol", 1) >= 2
+    if session["prefetched"]:
+        emit("questions", protocol.questions(questions))
 
 """ This is a websocket listener for "submit_answer"
 As the name implies, this listener handles the client answering a question.
 """
 @socketio.on("submit_answer")
+@metrics.timed
 def handle_answer(data):
-    roomID = int(data["url"]["pathname"].split("/")[2]) # This gets the room ID url
-    room = ROOMS[roomID] # Get room object from globals
-
-    qid = int(data["questionID"]) # Get the question ID from the socket event
-    q = room.questions[qid] # Get the corresponding question
-
-    time = datetime.datetime.now()
-    delta = time - room.usertimes[current_user.name][-1]
-    score = max((10 - delta.seconds) * 100, 0) # Calculate the score by calculating the seconds since the last answer was submitted, or the game was started.
-
-    room.userqcounts[current_user.name] += 1 # Acknowledge the user completing a question
-    if type(room.userscores.get(current_user.name, "")) == str: # Type == str is needed because 0 evaluates to false.
-        room.userscores[current_user.name] = 0 # Initialise dict value if needed
-
-    if int(data["answerID"]) == int(q.correct) and score > 0: # if the answer was correct, update score and correct count accordingly
-        room.userscores[current_user.name] += score
-        room.usercorrects[current_user.name] += 1
-
-    qid += 1
-    if qid == len(room.questions):
-        emit("end_quiz", {"roomID":roomID}) # If the quiz is over, inform the user that they have finished
-    else:
-        nextq = room.questions[qid] # Iterates through questions
-        emit("submit_question", {
-            "question_ID":qid,
-            "question":nextq.question,
-            "a0":nextq.answer1,
-            "a1":nextq.answer2,
-            "a2":nextq.answer3,
-            "a3":nextq.answer4,
-            "score":room.userscores[current_user.name]
-        }) # If the quiz is not over, send the user the next question.
+    answer = protocol.answer(data) # Get the question and answer IDs from the socket event
+    if answer is None: # Not an answer at all, so there's nothing to do
+        return
+    roomID, qid, answerID = answer
+    if roomID is None: # Version 2 answers are for the room the socket was bound to by begin_timing
+        roomID = session.get("room")
+        if roomID is None:
+            return
+    with state.room(roomID) as room: # Get room object from the state backend. Nobody else can change it until this block ends.
+        if room is None:
+            return
+
+        player = room.players.get(current_user.id)
+        if player is None or player.started is None or qid >= len(room.questions) or player.answered == len(room.questions) or qid != player.answered:
+            return # Ignore answers from players who haven't started, who have already answered everything, or to any question but the one they're on
+
+        now = time.time()
+        score = max((10 - int(now - player.last)) * 100, 0) # Calculate the score by calculating the seconds since the last answer was submitted, or the game was started.
+        player.last = now
+
+        player.answered += 1 # Acknowledge the user completing a question
+        if player.answered == len(room.questions):
+            room.finished_count += 1
+
+        if answerID == room.answers[qid] and score > 0: # if the answer was correct, update score and correct count accordingly
+            player.score += score
+            player.correct += 1
+
+        qid += 1
+        finished = getroomfinished(room)
+        if finished: # This was the last answer of the match, and the guard above means this only happens once per room
+            room.summary = finalise_room(room, identities)
+        nextq = room.questions[qid] if qid < len(room.questions) else None
+        userscore = player.score
+
+    if nextq is None:
+        if finished:
+            results_writer.submit(room.summary) # The result is written to the database in the background, along with any other matches finishing around now
+            state.mark_finished(roomID) # Both players are done, so the room can be evicted once the results have been seen
+            emit("results_ready", {"roomID":roomID}, to=roomID, include_self=False) # This user was the last to finish, so push the results to whoever is on the waiting screen
+        emit("end_quiz", protocol.finished(session.get("protocol", 1), roomID)) # If the quiz is over, inform the user that they have finished
+    elif session.get("prefetched"): # The page is already showing the next question, so it only needs the score
+        emit("score", protocol.scored(qid, userscore))
+    else: # Iterates through questions
+        emit("submit_question", protocol.question(session.get("protocol", 1), nextq, qid, userscore)) # If the quiz is not over, send the user the next question, in the format their page expects
 
 """ This is a websocket handler for "join_room"
 As the name implies, this is called when a player joins a room.
 This is only used when challenging another player via a link.
 """
 @socketio.on("join_room")
+@metrics.timed
 def join_room_sock(data):
-    roomID = int(data["url"]["pathname"].split("/")[2]) # Similar code as above used for getting the room ID from the URL
-    room_obj = ROOMS[roomID]
+    roomID = protocol.room_id(data) # Similar code as above used for getting the room ID
+    if roomID is None:
+        return
+    session["room"] = roomID
+    with state.room(roomID) as room_obj:
+        if room_obj is None:
+            return
 
-    join_room(roomID) # Join the socket room
+        room_obj.add_player(current_user.id, current_user.name, request.sid) # Add user to room object attributes where necessary
 
-    ROOMS[roomID].users.append(current_user.name) # Add user to room object attributes where necessary
-    ROOMS[roomID].usersids.append(request.sid)
+    join_room(roomID) # Join the socket room
 
 # Route handler for displaying another user's profile page.
 @main.route('/user/<int:id>') # This allows a user's profile to be referred to via their user ID. e.g. the first user in the DB would be at /user/1
 @login_required # this decorator is used throughout this file - it checks to see whether a user is logged in or not.
+@page_cache.cached(lambda id: ["user:%d" % id, "ranks"]) # Repeat views are served from the page cache until this user, or anyone's ranking, changes (see pagecache.py)
+@read_only
 def userreturn(id):
-    chosen_user = User.query.get_or_404(id) # if the user doesn't exist, 404, else get all their credentials
-    return render_template('user.html', user=chosen_user) 
+    chosen_user = identities.get(id) # if the user doesn't exist, 404, else get all their credentials. These come from the identity cache where possible.
+    if chosen_user is None:
+        abort(404)
+    return render_template('user.html', user=chosen_user, friendcount=len(friend_graph.friend_ids(id)), rank=leaderboards.rank(id)[0]) 
+
+# Route handler for a user's statistics: their totals, their records against each of their friends, and their latest matches.
+# Everything but the matches comes from the user_stats and head_to_head tables (see history.py), so no results are counted up here.
+@main.route('/user/<int:id>/stats')
+@login_required
+@read_only
+def user_stats(id):
+    chosen_user = identities.get(id)
+    if chosen_user is None:
+        abort(404)
+    friends = friend_graph.friends(id)
+    records = match_history.head_to_head(id, [friend.id for friend in friends])
+    names = {friend.id: friend.name for friend in friends}
+    matches, next_cursor = match_history.matches(id, request.args.get('before', type=int))
+    return render_template('stats.html', user=chosen_user, stats=match_history.stats(id), records=records, names=names, matches=describe_matches(matches), next_cursor=next_cursor, paged='before' in request.args)
+
+@main.route('/api/users/<int:id>/matches') # A user's match history as JSON, newest first. Pass the returned "next" as ?before= for the next page.
+@login_required
+@read_only
+def api_matches(id):
+    limit = min(request.args.get('limit', current_app.config['HISTORY_PER_PAGE'], type=int), current_app.config['HISTORY_PER_PAGE'])
+    matches, next_cursor = match_history.matches(id, request.args.get('before', type=int), max(limit, 1))
+    return {"matches": describe_matches(matches), "next": next_cursor}
+
+@main.route('/api/users/<int:id>/stats') # A user's totals as JSON
+@login_required
+@read_only
+def api_user_stats(id):
+    stats = match_history.stats(id)
+    if identities.get(id) is None:
+        abort(404)
+    if stats is None:
+        return {"played": 0}
+    return {column: getattr(stats, column) for column in ("played", "wins", "draws", "losses", "total_score", "best_score", "streak", "best_streak")}
+
+def describe_matches(matches):
+    # Turns HistoryEntries into dicts with the opponents' and decks' names, looked up all at once rather than per match
+    opponents = {user.id: user.name for user in identities.get_many(list({match.opponent for match in matches}))}
+    deck_ids = {match.deck_id for match in matches if match.deck_id is not None}
+    decks = {deck.id: deck.name for deck in Deck.query.filter(Deck.id.in_(deck_ids))} if deck_ids else {}
+    return [{
+        "id": match.id, "deck_id": match.deck_id, "deck": decks.get(match.deck_id), "opponent_id": match.opponent, "opponent": opponents.get(match.opponent),
+        "score": match.score, "opponent_score": match.opponent_score, "outcome": match.outcome, "finished": match.finished.isoformat() if match.finished else None,
+    } for match in matches]
 
 # Route handler for challenge page.
 @main.route("/challenge/<int:roomID>") # Similar syntax to above, allowing you to refer to a created room via its id
@@ -187,11 +376,9 @@ def index():
 
 @main.route('/profile') # Route for the profile page.
 @login_required
+@read_only
 def profile():
-    friends = Friend.query.filter_by(uid=current_user.id).all() # queries for all the friends associated with the current user's UID
-    friendlist = []
-    for friend in friends:
-        friendlist.append(User.query.filter_by(friendid=friend.friendid).first()) # Creates a list of all user objects that are designated by having friend IDs that are linked to the user in the Friend table
+    friendlist = friend_graph.friends(current_user.id) # The user's friends, from the friend cache. On a miss they are all loaded with one joined query (see friends.py).
     return render_template('profile.html', name=current_user.name, elo=current_user.elo, friendID=current_user.friendid, friends=friendlist)
 
 @main.route('/profile', methods=['POST']) # The only POST request occurring on this page is adding a friend.
@@ -201,10 +388,15 @@ def profile_post():
     if current_user.friendid == friendid: # prevents user from adding themselves as a friend
         flash('Unfortunately, as lonely as you may be, you cannot add yourself as a friend. :(') # A slightly mean error message
         return redirect(url_for('main.profile'))
+    elif user and Friend.query.filter_by(uid=current_user.id, friendid=friendid).first(): # Each friend can only be added once
+        flash('This user is already your friend.')
+        return redirect(url_for('main.profile'))
     elif user: 
-        new_friend = Friend(friendid=friendid, uid=current_user.id) # instantiates a new friend in the Friend table
+        new_friend = Friend(friendid=friendid, uid=current_user.id, friend_uid=user.id) # instantiates a new friend in the Friend table
         db.session.add(new_friend)
         db.session.commit()
+        friend_graph.invalidate(current_user.id) # The cached friends list is now missing the new friend
+        page_cache.bump("user:%d" % current_user.id) # Their profile shows how many friends they have
         return redirect(url_for('main.profile'))
     else: # this means the friend ID does not exist
         flash('A user with this friend ID doesn\'t exist. Try again and check your spelling.')
@@ -212,11 +404,68 @@ def profile_post():
 
 @main.route('/browse') # Allows user to browse decks.
 @login_required
+@page_cache.cached(lambda: ["decks"])
+@read_only
 def browse():
-    return render_template('browse.html', query=Deck.query.all()) # This query returns all decks in the entire database and displays them on this screen
+    # Decks are shown a page at a time, starting after the cursor in ?after= (see paging.py), so the page costs the same however many decks there are
+    sort = request.args.get('sort', 'newest')
+    decks, next_cursor = page_decks(sort, request.args.get('after'), current_app.config['DECKS_PER_PAGE'])
+    return render_template('browse.html', query=decks, sort=sort, sorts=SORTS, next_cursor=next_cursor, paged='after' in request.args)
+
+@main.route('/api/decks') # JSON listing of decks, a page at a time, for clients that don't need the HTML
+@login_required
+@page_cache.cached(lambda: ["decks"])
+@read_only
+def api_decks():
+    sort = request.args.get('sort', 'newest')
+    limit = min(request.args.get('limit', current_app.config['DECKS_PER_PAGE'], type=int), current_app.config['DECKS_API_MAX_LIMIT'])
+    decks, next_cursor = page_decks(sort, request.args.get('after'), max(limit, 1))
+    return {
+        "decks": [{"id": deck.id, "name": deck.name, "creator": deck.creator, "created": deck.creation_time.isoformat() if deck.creation_time else None} for deck in decks],
+        "next": next_cursor, # Pass this back as ?after= to get the next page. It is null on the last page.
+    }
+
+@main.route('/search') # Searches deck names and questions (see search.py), showing the matching decks best first
+@login_required
+@read_only
+def search():
+    text = request.args.get('q', '')
+    return render_template('search.html', query=search_decks(text, current_app.config['SEARCH_RESULTS']), text=text)
+
+@main.route('/api/search') # The same search as JSON
+@login_required
+@read_only
+def api_search():
+    decks = search_decks(request.args.get('q', ''), current_app.config['SEARCH_RESULTS'])
+    return {"decks": [{"id": deck.id, "name": deck.name, "creator": deck.creator} for deck in decks]}
+
+@main.route('/leaderboard') # The best players by ELO
+@main.route('/leaderboard/<int:deckID>') # The players with the most wins on one deck
+@login_required
+@read_only
+def leaderboard(deckID=None):
+    deck = Deck.query.get_or_404(deckID) if deckID is not None else None
+    entries = leaderboards.top(deckID) # These come from the in-memory boards (see leaderboard.py), so this doesn't sort any table
+    rank, score, players = leaderboards.rank(current_user.id, deckID)
+    return render_template('leaderboard.html', deck=deck, entries=entries, rank=rank, score=score, players=players)
+
+@main.route('/api/leaderboard') # The same leaderboards as JSON. ?deck= picks a deck's board, and ?limit= how many players are returned.
+@login_required
+@read_only
+def api_leaderboard():
+    deckID = request.args.get('deck', type=int)
+    limit = min(request.args.get('limit', current_app.config['LEADERBOARD_SIZE'], type=int), current_app.config['LEADERBOARD_SIZE'])
+    rank, score, players = leaderboards.rank(current_user.id, deckID)
+    return {
+        "players": [{"rank": entry_rank, "id": user.id, "name": user.name, "score": entry_score} for entry_rank, user, entry_score in leaderboards.top(deckID, max(limit, 1))],
+        "me": {"rank": rank, "score": score},
+        "ranked": players,
+    }
 
 @main.route('/decks/<int:id>') # Route handler for an existing deck
 @login_required
+@page_cache.cached(lambda id: ["deck:%d" % id], vary_user=True) # Cached per viewer, as only the deck's owner sees the edit and delete buttons
+@read_only
 def decks(id):
     chosen_deck = Deck.query.get_or_404(id) # 404s if deck doesn't exist
     questions = Question.query.filter_by(deck_id=id).all() # Displays all questions associated with the deck
@@ -229,6 +478,8 @@ def delete_deck(id):
     if current_user.id == deck.uid: # checks if the user has permission to delete this deck i.e. owns it
         db.session.delete(deck)
         db.session.commit()
+        deck_cache.invalidate(id) # The deck's questions can no longer be played
+        page_cache.bump("decks", "deck:%d" % id) # Take it out of the deck listings too
         return redirect(url_for('.browse')) # redirects to the deck browsing page with deleted deck now gone
     else:
         flash('You do not have permission to delete this deck.') # Flashes a message to the user saying they don't have deletion perms
@@ -243,6 +494,8 @@ def delete_question(deckid, qID):
     if current_user.id == deck.uid: # checks if the user trying to delete is the same as the creator of the deck
         db.session.delete(question)
         db.session.commit()
+        deck_cache.invalidate(deckid) # Stop the deleted question from being picked for new rooms
+        page_cache.bump("deck:%d" % deckid)
         return redirect(url_for('.decks', id=deckid)) # redirects the user to the deck's page with the question now gone
     else:
         flash('You do not have permission to delete this question.') # Flashes a message to say the user trying to delete the question doesn't own the deck and hence doesn't have deletion perms
@@ -260,64 +513,73 @@ def make_post():
     new_deck = Deck(name=title, creator=current_user.name, uid=current_user.id) # uses current user's credentials to instantiate a deck with their details
     db.session.add(new_deck) 
     db.session.commit() 
+    page_cache.bump("decks") # The deck listings now have a new deck
 
     return redirect(url_for('main.browse'))
 
+@main.route('/decks/import', methods=['POST']) # Creates a new deck from an uploaded JSON Lines or CSV file of questions (see bulk.py)
+@login_required
+def import_post():
+    from .bulk import import_deck, guess_format, ImportFailed, FORMATS # Only imported when needed, as few requests use it. See startup.py.
+    import csv
+
+    def failed(message): # Shows the form again with the flashed message. Nothing was saved, so the user can fix the file and upload it again.
+        flash(message)
+        return render_template('make.html', name=current_user.name), 400
+
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return failed('Choose a file to import.')
+    title = request.form.get('title') or upload.filename.rsplit('.', 1)[0] # Defaults to the file's name
+    format = request.form.get('format') or guess_format(upload.filename)
+    if format not in FORMATS:
+        return failed('The format must be one of %s.' % ', '.join(sorted(FORMATS)))
+    text = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='') # Large uploads are spooled to disk by Werkzeug, and this reads them a line at a time
+    try:
+        deck, count = import_deck(text, format, title, current_user, current_app.config['BULK_BATCH_SIZE'])
+    except ImportFailed as e: # Says which line was wrong
+        return failed(str(e))
+    except UnicodeDecodeError:
+        return failed('The file must be UTF-8 text.')
+    except (csv.Error, ValueError): # e.g. a CSV field longer than the csv module allows
+        return failed('The file isn\'t valid %s.' % format.upper())
+    page_cache.bump("decks")
+    return redirect(url_for('.decks', id=deck.id))
+
+@main.route('/decks/<int:id>/export.<format>') # Downloads all of a deck's questions as JSON Lines or CSV, in the format import_post reads
+@login_required
+def export(id, format):
+    from .bulk import export_deck, FORMATS
+    if format not in FORMATS:
+        abort(404)
+    deck = Deck.query.get_or_404(id)
+    filename = '%s.%s' % (secure_filename(deck.name or '') or 'deck', format)
+    # The file is sent a batch of questions at a time as they are read, so a large deck is never held in memory all at once
+    return Response(stream_with_context(export_deck(id, format, current_app.config['BULK_BATCH_SIZE'])), mimetype=FORMATS[format], headers={'Content-Disposition': 'attachment; filename="%s"' % filename})
+
 # Web route for results page post-quiz.
 @main.route('/results/<int:roomID>') 
 @login_required
 def results(roomID):
 
-    room = ROOMS[roomID]
-    qcount = len(room.questions)
-    finished = getroomfinished(room) # Get room object and whether the game has finished or not
-
-    score = room.userscores[current_user.name] # Get user score
-
-    if not finished: # If waiting, render the waiting page, which includes a listener to auto-refresh when the other user finishes.
-        return render_template('waiting.html', score=score, roomID=roomID)
-
-    else: # Once the game has finished (i.e both players are done)
-        recorded = Result.query.filter_by(roomid=roomID).all() # Check whether there's an entry in the db for this game already
-
-        oppscore = set(room.userscores.keys()) - {current_user.name}
-        oppcorrects = room.usercorrects[list(oppscore)[0]]
-        oppscore = room.userscores[list(oppscore)[0]] # Work out how the opponent did
-
-        corrects = room.usercorrects[current_user.name] # Fetch user's successful answers
-
-        win = score == max(score, oppscore)
-        draw = win and (score == min(score, oppscore)) # Calculate win condition and check for draws
-
-        if not recorded: # IF THE GAME RESULT HAS NOT BEEN RECORDED YET
-            users = []
-            scores = []
-            for user in room.users:
-                user_obj = User.query.filter_by(name=user).first()
-                users.append(user_obj)
-                score = room.userscores[user]
-                scores.append(score) ### This block gets some data for each of the users; their database object and their scores.
-
-            for user in enumerate(users): # For each user (tracking index too)
-                user[1].elo *= user[1].matchcount
-                user[1].elo += users[1-user[0]].elo # Rolling ELO algorithm (average of +/-400 or 0 for every game played)
+    room = state.get_room(roomID)
+    if room is None: # The room never existed or has been evicted
+        abort(404)
 
-                score = scores[user[0]]
-                if score == max(room.userscores.values()) and not score == min(room.userscores.values()): # Check win condition
-                    user[1].wincount += 1
-                    user[1].elo += 400
-                elif score == min(room.userscores.values()): # Check loss condition, mutually exlusive with win
-                    user[1].elo -= 400
+    player = room.players.get(current_user.id)
+    if player is None: # This user isn't playing in this room
+        abort(404)
 
-                user[1].matchcount += 1
-                user[1].elo /= user[1].matchcount # Increment matchcount and finalise ELO calculation
+    if room.summary is None: # If waiting, render the waiting page, which includes a listener to auto-refresh when the other user finishes.
+        return render_template('waiting.html', score=player.score, roomID=roomID)
 
-            res = Result(roomid=roomID, user1=users[0].id, user2=users[1].id, score1=scores[0], score2=scores[1]) # Store game result in database
-            db.session.add(res)
-            db.session.commit()
+    # Once the game has finished (i.e both players are done), everything on the page comes from the room's summary.
+    # The result itself is recorded by the results writer (see persistence.py), so this page never writes to the database.
+    summary = room.summary
+    mine, theirs = summary.players if summary.players[0].uid == current_user.id else reversed(summary.players)
 
-        # Render the results page, displaying various statistics   
-        return render_template('results.html',winner=win, draw=draw, score=score, oppscore=oppscore, elo=current_user.elo, total=qcount, correct=corrects, oppcorrect=oppcorrects)
+    # Render the results page, displaying various statistics
+    return render_template('results.html', winner=mine.won or mine.drew, draw=mine.drew, score=mine.score, oppscore=theirs.score, elo=mine.elo, total=summary.total, correct=mine.correct, oppcorrect=theirs.correct)
 
 # Route handler for /play/
 # Render the play page, starting with the game's first question
@@ -325,12 +587,15 @@ def results(roomID):
 @main.route('/play/<int:roomID>')
 @login_required
 def play(roomID, joining=False):
-    room = ROOMS[roomID]
+    room = state.get_room(roomID)
+    if room is None or not room.questions: # Rooms are only made for decks with questions, but one made by an older version might not have any
+        abort(404)
     firstq = room.questions[0]
-    return render_template('play.html', joining=joining, firstq=firstq) 
+    return render_template('play.html', joining=joining, firstq=firstq, roomID=roomID) 
 
 @main.route('/add') # This screen allows you to add a question to any deck that the user owns
 @login_required
+@read_only
 def add():
     decklist = Deck.query.filter_by(uid=current_user.id).all() # Querying for all decks associated with the current user's ID.
     return render_template('add.html', edit=False, decklist=decklist)
@@ -350,6 +615,7 @@ def add_question():
     correct = request.form["correct"]
     deck_name = request.form.get('deckselect')
     deck_id = Deck.query.filter_by(name=deck_name).first()
+    old_deck_id = None
     if not edit: # If the question isn't being edited, then a new question object can be instantiated
         new_question = Question(question=question, answer1=question1, answer2=question2, answer3=question3, answer4=question4, correct=correct, deck_id=deck_id.id)
         db.session.add(new_question)
@@ -357,6 +623,7 @@ def add_question():
         ### THIS SECTION ACCOUNTS FOR WHEN EDITING THE QUESTION, NOT CREATING A NEW ONE
         edit = edit - 1
         question_obj = Question.query.filter_by(id=edit).first() 
+        old_deck_id = question_obj.deck_id # The question may be moving to another deck, so its old deck changes too
         question_obj.question = question
         question_obj.answer1 = question1
         question_obj.answer2 = question2
@@ -366,12 +633,18 @@ def add_question():
         question_obj.deck_id = deck_id.id
 
     db.session.commit()
+    deck_cache.invalidate(deck_id.id) # New rooms on this deck will now see the new or edited question. This is after the commit, so a room made in between can't cache the old questions again.
+    page_cache.bump("deck:%d" % deck_id.id) # and its page will show it
+    if old_deck_id is not None and old_deck_id != deck_id.id:
+        deck_cache.invalidate(old_deck_id)
+        page_cache.bump("deck:%d" % old_deck_id)
 
     return redirect(url_for('main.browse')) # returns to deck browsing screen
 
 # Edit route for the questions, largely just the add page but with the values filled in already.
 @main.route("/decks/<int:deckID>/edit-question/<int:qID>")
 @login_required
+@read_only
 def edit_question(deckID, qID):
     decklist = Deck.query.filter_by(uid=current_user.id).all()
     deck = Deck.query.get_or_404(deckID) # checking if IDs exist 
@@ -380,9 +653,12 @@ def edit_question(deckID, qID):
 
 @main.route('/select') # deck selection screen for playing a match.
 @login_required
+@page_cache.cached(lambda: ["decks"], vary_user=True) # The page has the user's name in it
+@read_only
 def select():
-    decklist = Deck.query.all() # queries for all existing decks and returns them to the dropdown.
-    return render_template('select.html', decklist=decklist, user=current_user)
+    decklist, next_cursor = page_decks(request.args.get('sort', 'name'), request.args.get('after'), current_app.config['DECKS_PER_PAGE']) # A page of decks for the dropdown, in name order so it is easy to search
+    return render_template('select.html', decklist=decklist, user=current_user, next_cursor=next_cursor, paged='after' in request.args)
 
-if __name__ == '__main__': # runs socket.io so that websockets can be opened across the application.
-    socketio.run(main,debug=True)
\ No newline at end of file
+if __name__ == '__main__': # runs socket.io so that websockets can be opened across the application. The server itself is in serve.py, which also picks the async mode.
+    from .serve import main as serve
+    serve()
\ No newline at end of file
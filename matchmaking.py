@@ -0,0 +1,168 @@
+from bisect import bisect_left, insort
+from collections import deque
+import itertools
+import threading
+import time
+
+"""
+This module contains the matchmaking engine used when a player challenges a random opponent.
+
+Players waiting for a deck are kept in a list sorted by ELO, so the closest rated opponent can be found with a binary search.
+Two players can be matched if the difference in their ELO is within the band of either of them.
+A player's band starts at base_band and widens by band_growth every second they wait (up to max_band), so nobody waits forever just because nobody near their rating is online.
+Players who wait longer than timeout seconds are removed from the queue.
+"""
+
+class Ticket():
+    __slots__ = ("sid", "uid", "username", "elo", "deckID", "queued")
+
+    def __init__(self, sid, uid, username, elo, deckID, queued=None):
+        self.sid = sid # Socket ID of the waiting player, used to tell them when they have been matched
+        self.uid = uid
+        self.username = username
+        self.elo = elo or 0
+        self.deckID = str(deckID)
+        self.queued = queued if queued is not None else time.time() # Wall clock time, so tickets can be compared between worker processes
+
+
+class MatchPolicy():
+    def __init__(self, base_band=100, band_growth=25, max_band=1000, timeout=120):
+        self.base_band = base_band
+        self.band_growth = band_growth
+        self.max_band = max_band
+        self.timeout = timeout
+
+    def band(self, ticket, now):
+        return min(self.base_band + self.band_growth * (now - ticket.queued), self.max_band)
+
+    def acceptable(self, a, b, now):
+        # The same user can't play themselves, e.g. if they queued from two tabs
+        return a.uid != b.uid and abs(a.elo - b.elo) <= max(self.band(a, now), self.band(b, now))
+
+    def expired(self, ticket, now):
+        return now - ticket.queued > self.timeout
+
+
+"""
+QueueMetrics keeps the counters reported by stats().
+The last 1000 times-to-match are kept so that the median and 99th percentile can be reported.
+"""
+class QueueMetrics():
+    def __init__(self):
+        self.enqueued = 0
+        self.matched = 0
+        self.cancelled = 0
+        self.expired = 0
+        self.waits = deque(maxlen=1000)
+
+    def record_match(self, waited):
+        self.matched += 1
+        self.waits.append(waited)
+
+    def report(self):
+        waits = sorted(self.waits)
+        return {
+            "enqueued": self.enqueued,
+            "matched": self.matched,
+            "cancelled": self.cancelled,
+            "expired": self.expired,
+            "time_to_match_p50": waits[len(waits) // 2] if waits else 0,
+            "time_to_match_p99": waits[min(len(waits) - 1, len(waits) * 99 // 100)] if waits else 0,
+        }
+
+
+class MatchmakingQueue():
+    def __init__(self, policy=None):
+        self.policy = policy or MatchPolicy()
+        self.metrics = QueueMetrics()
+        self._decks = {} # deckID -> list of (elo, seq, ticket), sorted by ELO. seq breaks ties so tickets are never compared.
+        self._tickets = {} # sid -> (elo, seq, ticket), so a ticket can be found and removed when it is cancelled
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def enqueue(self, ticket):
+        """ Returns the best waiting opponent for this ticket, removing them from the queue.
+        If there is nobody acceptable, the ticket is queued and None is returned.
+        """
+        now = time.time()
+        with self._lock:
+            self._remove(ticket.sid) # Queueing again replaces any earlier ticket from the same socket
+            self.metrics.enqueued += 1
+            queue = self._decks.setdefault(ticket.deckID, [])
+            opponent = self._nearest(queue, ticket, now)
+            if opponent is not None:
+                self._remove(opponent.sid)
+                self.metrics.record_match(now - opponent.queued)
+                return opponent
+            entry = (ticket.elo, next(self._seq), ticket)
+            insort(queue, entry)
+            self._tickets[ticket.sid] = entry
+            return None
+
+    def _nearest(self, queue, ticket, now):
+        # The closest ratings either side of this player are found with a binary search.
+        # A couple of neighbours are checked on each side in case the nearest is the same user on another tab.
+        i = bisect_left(queue, (ticket.elo,))
+        candidates = queue[max(i - 2, 0):i + 2]
+        candidates = [entry[2] for entry in candidates if self.policy.acceptable(ticket, entry[2], now)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda other: abs(other.elo - ticket.elo))
+
+    def cancel(self, sid):
+        with self._lock:
+            if self._remove(sid):
+                self.metrics.cancelled += 1
+                return True
+            return False
+
+    def _remove(self, sid):
+        entry = self._tickets.pop(sid, None)
+        if entry is None:
+            return False
+        queue = self._decks[entry[2].deckID]
+        queue.pop(bisect_left(queue, entry))
+        if not queue:
+            del self._decks[entry[2].deckID]
+        return True
+
+    def sweep(self):
+        """ Expires tickets which have waited too long, then matches waiting players whose bands have widened enough.
+        Returns a list of matched (ticket, ticket) pairs and a list of expired tickets. This is called regularly by a background task.
+        """
+        now = time.time()
+        matches = []
+        expired = []
+        with self._lock:
+            for deckID in list(self._decks):
+                for entry in list(self._decks[deckID]):
+                    if self.policy.expired(entry[2], now):
+                        self._remove(entry[2].sid)
+                        self.metrics.expired += 1
+                        expired.append(entry[2])
+
+                queue = self._decks.get(deckID, [])
+                i = 0
+                while i < len(queue) - 1: # Neighbours in the sorted list are the closest ratings, so only adjacent pairs need checking
+                    a, b = queue[i][2], queue[i + 1][2]
+                    if self.policy.acceptable(a, b, now):
+                        self._remove(a.sid)
+                        self._remove(b.sid)
+                        self.metrics.record_match(now - a.queued)
+                        self.metrics.record_match(now - b.queued)
+                        matches.append((a, b))
+                        queue = self._decks.get(deckID, [])
+                    else:
+                        i += 1
+        return matches, expired
+
+    def stats(self):
+        with self._lock:
+            stats = self.metrics.report()
+            stats["queued"] = len(self._tickets)
+            stats["queued_decks"] = len(self._decks)
+            stats["queue_depth_max"] = max((len(queue) for queue in self._decks.values()), default=0)
+            return stats
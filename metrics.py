@@ -0,0 +1,173 @@
+from bisect import bisect_left
+from functools import wraps
+import threading
+import time
+
+from flask import Response, g, request
+
+"""
+This module times QuizLive's socket events and web pages, and serves the timings on /metrics.
+
+Every socket listener in main.py is wrapped with @metrics.timed, and every web request is timed by hooks registered in init_app.
+Each one gets a latency histogram: a count of calls which took no longer than each of a fixed list of bucket times, plus the total time.
+Recording a call is a binary search and two additions, so it is cheap enough to leave on all the time.
+
+/metrics is only added when METRICS_ENABLED is set, and serves the histograms and gauges in the Prometheus text format.
+Gauges (live rooms, queued players, connected sockets and so on) are read from the other extensions when /metrics is requested.
+Each worker process keeps its own numbers, so with several workers each one should be scraped separately.
+"""
+
+# Upper bounds of the histogram buckets in seconds. Anything slower than the last bucket is only counted in +Inf.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram():
+    __slots__ = ("counts", "count", "total", "_lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # The last count is for calls slower than every bucket
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += seconds
+
+    def snapshot(self): # Returns (cumulative bucket counts, count, total), as the text format expects buckets to include everything below them
+        with self._lock:
+            counts = list(self.counts)
+            count, total = self.count, self.total
+        cumulative = []
+        running = 0
+        for n in counts:
+            running += n
+            cumulative.append(running)
+        return cumulative, count, total
+
+
+class Metrics():
+    def __init__(self):
+        self.enabled = False
+        self.app = None
+        self._histograms = {} # (kind, name) -> Histogram, where kind is "event" or "endpoint"
+        self._errors = {} # (kind, name) -> number of calls which raised an exception
+        self._lock = threading.Lock()
+        self.sockets = 0 # Connected sockets, counted by the connect and disconnect listeners
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config["METRICS_ENABLED"]
+        app.extensions["quizlive_metrics"] = self
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule(app.config["METRICS_PATH"], "metrics", self.view)
+
+    def histogram(self, kind, name):
+        histogram = self._histograms.get((kind, name))
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault((kind, name), Histogram())
+        return histogram
+
+    def error(self, kind, name):
+        with self._lock:
+            self._errors[(kind, name)] = self._errors.get((kind, name), 0) + 1
+
+    def timed(self, f):
+        """ Decorator for socket listeners, recording how long each call takes under the event's name (e.g. "submit_answer" rather than handle_answer).
+        It goes underneath @socketio.on, so that the time is recorded for the function Flask-SocketIO calls.
+        """
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return f(*args, **kwargs)
+            event = getattr(request, "event", None) # Flask-SocketIO stores the event being handled on the request
+            name = event["message"] if event else f.__name__
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            except Exception:
+                self.error("event", name)
+                raise
+            finally:
+                self.histogram("event", name).observe(time.perf_counter() - start)
+        return wrapper
+
+    def connected(self, change): # Called with 1 when a socket connects and -1 when it disconnects
+        with self._lock:
+            self.sockets += change
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+
+    def _teardown_request(self, exc):
+        start = g.pop("metrics_start", None)
+        if start is None or request.endpoint in (None, "metrics", "static"): # Unknown pages, scrapes and static files aren't worth a histogram each
+            return
+        if exc is not None:
+            self.error("endpoint", request.endpoint)
+        self.histogram("endpoint", request.endpoint).observe(time.perf_counter() - start)
+
+    def gauges(self):
+        # These are read from the other extensions each time, so they can't drift from the real values
+        from . import state, deck_cache, identities, results_writer
+        state_stats = state.stats()
+        writer_stats = results_writer.stats()
+        gauges = {
+            "quizlive_rooms_live": state_stats["live"],
+            "quizlive_rooms_finished": state_stats["finished"],
+            "quizlive_queue_players": state_stats["queued"],
+            "quizlive_queue_decks": state_stats["queued_decks"],
+            "quizlive_queue_depth_max": state_stats["queue_depth_max"],
+            "quizlive_time_to_match_p50_seconds": state_stats["time_to_match_p50"],
+            "quizlive_time_to_match_p99_seconds": state_stats["time_to_match_p99"],
+            "quizlive_sockets_connected": self.sockets,
+            "quizlive_results_pending": writer_stats["pending"],
+            "quizlive_deck_cache_size": deck_cache.stats()["size"],
+            "quizlive_identity_cache_size": identities.stats()["size"],
+        }
+        counters = {
+            "quizlive_matches_total": state_stats["matched"],
+            "quizlive_queue_expired_total": state_stats["expired"],
+            "quizlive_results_written_total": writer_stats["written"],
+            "quizlive_results_failed_total": writer_stats["failed"],
+        }
+        return gauges, counters
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            errors = sorted(self._errors.items())
+        for kind, description in (("event", "socket event"), ("endpoint", "web request, by endpoint")):
+            metric = "quizlive_%s_duration_seconds" % kind
+            lines.append("# HELP %s Time taken to handle each %s." % (metric, description))
+            lines.append("# TYPE %s histogram" % metric)
+            for (histogram_kind, name), histogram in histograms:
+                if histogram_kind != kind:
+                    continue
+                cumulative, count, total = histogram.snapshot()
+                for bound, n in zip(BUCKETS + ("+Inf",), cumulative):
+                    lines.append('%s_bucket{%s="%s",le="%s"} %d' % (metric, kind, name, bound, n))
+                lines.append('%s_sum{%s="%s"} %f' % (metric, kind, name, total))
+                lines.append('%s_count{%s="%s"} %d' % (metric, kind, name, count))
+        lines.append("# HELP quizlive_errors_total Socket events and web requests which raised an exception.")
+        lines.append("# TYPE quizlive_errors_total counter")
+        for (kind, name), n in errors:
+            lines.append('quizlive_errors_total{kind="%s",name="%s"} %d' % (kind, name, n))
+
+        gauges, counters = self.gauges()
+        for metric_type, values in (("gauge", gauges), ("counter", counters)):
+            for metric, value in values.items():
+                lines.append("# TYPE %s %s" % (metric, metric_type))
+                lines.append("%s %s" % (metric, value))
+        return "\n".join(lines) + "\n"
+
+    def view(self):
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
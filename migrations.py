@@ -0,0 +1,138 @@
+"""
+This module keeps the schema of existing databases up to date with models.py.
+
+db.create_all() only creates tables which don't exist yet, so a db.sqlite made by an older version of QuizLive never gets the
+indexes and constraints added to models.py since. Each change to an existing table is written here as a numbered migration instead.
+The number of the last migration applied is kept in the database itself, in SQLite's user_version pragma (0 for a database that has never been migrated).
+
+upgrade() first creates any missing tables, then applies every migration newer than the database's version, in order.
+Each migration runs in its own BEGIN IMMEDIATE transaction along with the change to user_version, so a failed migration leaves
+the database as it was, and two workers starting at once can't both apply the same one.
+Migrations must be written so that they also work on a brand new database, where create_all() has already made everything in models.py.
+
+create_app runs upgrade() on startup when MIGRATE_ON_STARTUP is set. It can also be run by hand from the folder above QuizLive:
+
+    python -m QuizLive.migrations           (applies any pending migrations)
+    python -m QuizLive.migrations --status  (only prints the database's version)
+"""
+
+MIGRATIONS = [] # (version, description, function) in the order they are applied
+
+def migration(version, description):
+    def register(f):
+        assert not MIGRATIONS or MIGRATIONS[-1][0] == version - 1, "Migrations must be numbered in order"
+        MIGRATIONS.append((version, description, f))
+        return f
+    return register
+
+
+@migration(1, "Index the columns used to look up users, decks, questions, friends and results")
+def add_lookup_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_users_name ON users (name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_decks_uid ON decks (uid)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_questions_deck_id ON questions (deck_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_results_roomid ON results (roomid)")
+
+@migration(2, "Make friend IDs unique, and stop a user adding the same friend twice")
+def unique_friends(conn):
+    duplicates = conn.execute("SELECT friendid FROM users WHERE friendid IS NOT NULL GROUP BY friendid HAVING COUNT(*) > 1").fetchall()
+    if duplicates: # Which user a friend ID should belong to can't be decided automatically, so these have to be fixed by hand
+        raise RuntimeError("These friend IDs belong to more than one user, so they can't be made unique: %s" % ", ".join(row[0] for row in duplicates))
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_friendid ON users (friendid)")
+    conn.execute("DELETE FROM friends WHERE id NOT IN (SELECT MIN(id) FROM friends GROUP BY uid, friendid)") # Keep the first of any repeated friendships
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_friends_uid_friendid ON friends (uid, friendid)")
+
+@migration(3, "Store each friend's user ID alongside their friend ID")
+def add_friend_uid(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(friends)")]
+    if "friend_uid" not in columns: # A new database already has the column from create_all()
+        conn.execute("ALTER TABLE friends ADD COLUMN friend_uid INTEGER REFERENCES users (id)")
+    conn.execute("UPDATE friends SET friend_uid = (SELECT users.id FROM users WHERE users.friendid = friends.friendid) WHERE friend_uid IS NULL")
+
+@migration(4, "Add full-text search over deck names and questions")
+def add_search(conn):
+    from . import search
+    if search.fts5_available(conn): # Otherwise searches fall back to matching deck names, see search.py
+        search.create(conn)
+
+@migration(5, "Record the deck each match was played on, and work out the per-deck leaderboards")
+def add_deck_standings(conn):
+    from . import leaderboard
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(results)")]
+    if "deck_id" not in columns:
+        conn.execute("ALTER TABLE results ADD COLUMN deck_id INTEGER REFERENCES decks (id)")
+    leaderboard.rebuild(conn) # deck_standings itself is made by create_all()
+
+@migration(6, "Index each user's match history, and work out every user's statistics and head-to-head records")
+def add_user_stats(conn):
+    from . import history
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(results)")]
+    if "finished" not in columns:
+        conn.execute("ALTER TABLE results ADD COLUMN finished DATETIME")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_results_user1_id ON results (user1, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_results_user2_id ON results (user2, id)")
+    history.rebuild(conn) # user_stats and head_to_head themselves are made by create_all()
+
+@migration(7, "Index deck names as the name sort compares them, with no name as \"\"")
+def add_sort_name_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_decks_sort_name ON decks (coalesce(name, ''))")
+
+
+def version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def latest():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+def upgrade(db, log=None):
+    """ Creates missing tables and applies pending migrations. Must be called inside an app context.
+    Returns the list of migration versions applied.
+    """
+    from . import models # The models have to be imported for create_all() to know about their tables
+    db.create_all()
+    applied = []
+    raw = db.engine.raw_connection() # The sqlite3 connection is used directly, so that the transactions below are exactly what is run
+    try:
+        conn = raw.driver_connection
+        isolation_level = conn.isolation_level
+        conn.isolation_level = None # Stops sqlite3 from opening and committing transactions by itself around the DDL
+        try:
+            for number, description, f in MIGRATIONS:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if version(conn) >= number: # Checked inside the transaction, in case another worker has just applied it
+                        conn.execute("COMMIT")
+                        continue
+                    f(conn)
+                    conn.execute("PRAGMA user_version = %d" % number)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                applied.append(number)
+                if log is not None:
+                    log("Applied migration %d: %s" % (number, description))
+        finally:
+            conn.isolation_level = isolation_level
+    finally:
+        raw.close()
+    return applied
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Brings the schema of QuizLive's database up to date.")
+    parser.add_argument("--status", action="store_true", help="only print the database's migration version")
+    args = parser.parse_args()
+
+    from . import create_app, db
+    app = create_app({"MIGRATE_ON_STARTUP": False}) # Migrate below instead, so that what happens can be printed
+    with app.app_context():
+        if not args.status:
+            upgrade(db, log=print)
+        with db.engine.connect() as conn:
+            current = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        print("%s is at version %d of %d" % (app.config["SQLALCHEMY_DATABASE_URI"], current, latest()))
+
+if __name__ == "__main__":
+    main()
@@ -10,11 +10,11 @@ class User(UserMixin, db.Model):
     __table_args__ = {'extend_existing': True} # This means that if the database is reinitialised, existing records will be extended and not replaced. I set this to True across this file to avoid completely removing testing credentials.
     id = db.Column(db.Integer, primary_key=True) # All SQLite tables must possess primary keys.
     email = db.Column(db.String(100), unique=True)
-    password = db.Column(db.String(100))
-    name = db.Column(db.String(1000))
-    friendid = db.Column(db.String(10))
+    password = db.Column(db.String(255)) # scrypt hashes are around 160 characters. SQLite doesn't enforce the length, so existing databases don't need a migration.
+    name = db.Column(db.String(1000), index=True)
+    friendid = db.Column(db.String(10), unique=True, index=True) # Friends are looked up by friend ID, so each one must belong to a single user
     elo = db.Column(db.Integer)
-    friends = db.relationship('Friend', backref='user', lazy='dynamic') # This models a relationship to the Friend table, allowing each user to have multiple friends associated with their profile.
+    friends = db.relationship('Friend', backref='user', lazy='dynamic', foreign_keys='Friend.uid') # This models a relationship to the Friend table, allowing each user to have multiple friends associated with their profile.
     wincount = db.Column(db.Integer, default=0)
     matchcount = db.Column(db.Integer, default=0)
 
@@ -23,12 +23,12 @@ The Deck class models any set of quiz questions.
 '''
 class Deck(db.Model):
     __tablename__ = 'decks'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (db.Index('ix_decks_sort_name', db.func.coalesce(db.text('name'), '')), {'extend_existing': True}) # Serves the name sort in paging.py, which lists unnamed decks under ""
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), index=True)
     creation_time = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     creator = db.Column(db.String(1000))
-    uid = db.Column(db.Integer)
+    uid = db.Column(db.Integer, index=True)
     questions = db.relationship('Question', backref='deck', lazy='dynamic') # This models a one to many relationship to the Question table.
     def __repr__(self):
         return '<Deck: %r>' % self.name
@@ -38,10 +38,11 @@ The Friend class models friends which a user possesses on their friends list. Th
 '''
 class Friend(db.Model):
     __tablename__ = 'friends'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (db.Index('ix_friends_uid_friendid', 'uid', 'friendid', unique=True), {'extend_existing': True}) # A user can only add each friend once. The index also serves lookups of a user's friends by uid.
     id = db.Column(db.Integer, primary_key=True)
     friendid = db.Column(db.String(10))
     uid = db.Column(db.Integer, db.ForeignKey('users.id')) # Foreign key to a user, allowing each user to "possess" the friend designated by their friend ID.
+    friend_uid = db.Column(db.Integer, db.ForeignKey('users.id')) # The user ID of the friend, so friends lists can be loaded with a join rather than a query per friend
 
 '''
 The Question class models a singular question, with appropriate answers and a link back to its corresponding deck via a foreign key.
@@ -56,23 +57,69 @@ class Question(db.Model):
     answer3 = db.Column(db.Text)
     answer4 = db.Column(db.Text)
     correct = db.Column(db.Text) # This contains the value of the Radio button clicked when creating a question.
-    deck_id = db.Column(db.Integer, db.ForeignKey('decks.id'))
+    deck_id = db.Column(db.Integer, db.ForeignKey('decks.id'), index=True)
 
 '''
 The Result class models the results of a quiz match. The users associated with each match are stored in it, along with their final scores. 
 '''
 class Result(db.Model):
     __tablename__ = 'results'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (db.Index('ix_results_user1_id', 'user1', 'id'), db.Index('ix_results_user2_id', 'user2', 'id'), {'extend_existing': True}) # These serve each user's match history, newest first
     id = db.Column(db.Integer, primary_key=True)
-    roomid = db.Column(db.Integer)
+    roomid = db.Column(db.Integer, index=True) # Not unique, as room IDs start again from 1 when the memory state backend restarts
+    deck_id = db.Column(db.Integer, db.ForeignKey('decks.id')) # The deck the match was played on. Matches recorded before this column was added don't have one.
     user1 = db.Column(db.Integer, db.ForeignKey("users.id"))
     user2 = db.Column(db.Integer, db.ForeignKey("users.id"))
     score1 = db.Column(db.Integer)
     score2 = db.Column(db.Integer)
+    finished = db.Column(db.DateTime) # When the match finished. Matches recorded before this column was added don't have one.
+
+'''
+The DeckStanding class models how a user has done on one deck: their wins, draws and matches played on it. These are the per-deck leaderboards (see leaderboard.py).
+Each row is updated as each match is recorded, so a deck's leaderboard never has to be worked out from the results table.
+'''
+class DeckStanding(db.Model):
+    __tablename__ = 'deck_standings'
+    __table_args__ = (db.Index('ix_deck_standings_deck_id_uid', 'deck_id', 'uid', unique=True), {'extend_existing': True}) # One row per user per deck. The index also serves loading a deck's whole board.
+    id = db.Column(db.Integer, primary_key=True)
+    deck_id = db.Column(db.Integer, db.ForeignKey('decks.id'))
+    uid = db.Column(db.Integer, db.ForeignKey('users.id'))
+    wins = db.Column(db.Integer, default=0)
+    draws = db.Column(db.Integer, default=0)
+    played = db.Column(db.Integer, default=0)
+
+'''
+The UserStats class models the totals of every match a user has played, so their statistics page doesn't have to read all of their results (see history.py).
+'''
+class UserStats(db.Model):
+    __tablename__ = 'user_stats'
+    __table_args__ = {'extend_existing': True}
+    uid = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    played = db.Column(db.Integer, default=0)
+    wins = db.Column(db.Integer, default=0)
+    draws = db.Column(db.Integer, default=0)
+    losses = db.Column(db.Integer, default=0)
+    total_score = db.Column(db.Integer, default=0)
+    best_score = db.Column(db.Integer, default=0)
+    streak = db.Column(db.Integer, default=0) # Wins in a row up to the latest match
+    best_streak = db.Column(db.Integer, default=0)
+
+'''
+The HeadToHead class models a user's record against one opponent. Every pair of users who have played each other has two rows, one from each side.
+'''
+class HeadToHead(db.Model):
+    __tablename__ = 'head_to_head'
+    __table_args__ = (db.Index('ix_head_to_head_uid_opponent', 'uid', 'opponent', unique=True), {'extend_existing': True})
+    id = db.Column(db.Integer, primary_key=True)
+    uid = db.Column(db.Integer, db.ForeignKey('users.id'))
+    opponent = db.Column(db.Integer, db.ForeignKey('users.id'))
+    wins = db.Column(db.Integer, default=0)
+    draws = db.Column(db.Integer, default=0)
+    losses = db.Column(db.Integer, default=0)
 
 def init_db(): # This function allows me to quickly initialise the database through a Python REPL.
-    db.create_all()
+    from .migrations import upgrade
+    upgrade(db) # Creates any missing tables, then brings the indexes and constraints of existing ones up to date
 
 if __name__ == '__main__':
     init_db()
\ No newline at end of file
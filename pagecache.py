@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import itertools
+import os
+import threading
+import time
+
+from flask import current_app, request, session
+from flask_login import current_user
+
+"""
+This module caches whole pages which are read far more often than they change, like /browse and /decks/<id>, and answers
+conditional GETs for them with 304 Not Modified.
+
+Each cached view names the things its page is made from, as version keys: e.g. "decks" for the deck catalogue, "deck:5" for deck 5
+and its questions, or "user:3" for user 3's profile. Every key has a version number, which changes whenever bump() is called for it.
+Views which change something bump its key (make_post bumps "decks", add_question bumps the deck it changed, and so on), and the results
+writer bumps both players once a match is recorded.
+
+A page's ETag is a hash of the request and the current versions of its keys, so it can be worked out without touching the database:
+    - If the browser already has that ETag (or the page hasn't changed since its If-Modified-Since), the view isn't run and a 304 is sent.
+    - Otherwise, if the rendered page is in the cache under the same ETag, it is sent without running the view.
+    - Otherwise the view runs as normal, and its response is cached.
+Pages are sent with "Cache-Control: private, no-cache", so browsers keep them but check back every time, which is what makes the 304s happen.
+
+Pages which show something about the viewer (e.g. the Edit buttons on a deck only its owner sees) are cached per viewer with vary_user.
+Pages are never served from the cache while a flashed message is waiting to be shown, so the message can't be lost or cached.
+
+Each worker process has its own versions, and only sees the bumps made in that process, so a version also changes on its own once it is
+PAGE_CACHE_TTL seconds old. That bounds how long a change made on another worker can go unseen, as with the other caches.
+Versions come from one counter that only goes up, so a key that expires never gets an old version (and so an old ETag) back.
+"""
+class PageCache():
+    def __init__(self, maxsize=1000, ttl=60):
+        self.maxsize = maxsize # Most rendered pages kept. 0 keeps none, but still answers conditional GETs.
+        self.ttl = ttl
+        self._pages = OrderedDict() # cache key -> (ETag, body, mimetype), from least to most recently used
+        self._versions = {} # version key -> (version, time changed, monotonic time made)
+        self._counter = itertools.count(1)
+        self._epoch = os.urandom(8).hex() # Part of every ETag, so ETags from before a restart, or from another worker, never match by accident
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def init_app(self, app):
+        self.maxsize = app.config["PAGE_CACHE_SIZE"]
+        self.ttl = app.config["PAGE_CACHE_TTL"]
+        app.extensions["quizlive_page_cache"] = self
+
+    def _version(self, key, now):
+        # Must be called with the lock held
+        entry = self._versions.get(key)
+        if entry is None or now - entry[2] >= self.ttl:
+            entry = self._versions[key] = (next(self._counter), time.time(), now)
+            if len(self._versions) > 4 * max(self.maxsize, 1000): # Forget versions which have expired anyway, so the dict can't grow forever
+                for expired in [k for k, v in self._versions.items() if now - v[2] >= self.ttl]:
+                    del self._versions[expired]
+        return entry
+
+    def bump(self, *keys):
+        """ Records that the things named by these version keys have changed, so pages made from them are rendered again. """
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._versions[key] = (next(self._counter), time.time(), now)
+
+    def cached(self, keys, vary_user=False):
+        """ Decorator for GET views whose page only changes when one of its version keys is bumped.
+        keys is a function taking the view's arguments and returning the list of version keys the page is made from.
+        Put it after @login_required, so logged out users are still redirected, and before @read_only.
+        """
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if request.method != "GET" or session.get("_flashes"):
+                    return f(*args, **kwargs)
+
+                now = time.monotonic()
+                cache_key = (request.endpoint, tuple(sorted(request.view_args.items())), request.query_string, current_user.get_id() if vary_user else None)
+                with self._lock:
+                    versions = [self._version(key, now) for key in keys(*args, **kwargs)]
+                etag = hashlib.sha1(repr((self._epoch, cache_key, [version[0] for version in versions])).encode()).hexdigest()
+                modified = max([version[1] for version in versions], default=time.time())
+
+                # If-Modified-Since is only to the second, so it is only used by clients which didn't send the ETag back
+                if request.if_none_match.contains(etag) or (not request.if_none_match and request.if_modified_since and request.if_modified_since.timestamp() >= int(modified)):
+                    with self._lock:
+                        self.not_modified += 1
+                    response = current_app.response_class(status=304)
+                else:
+                    with self._lock:
+                        page = self._pages.get(cache_key)
+                        if page is not None and page[0] == etag:
+                            self._pages.move_to_end(cache_key)
+                            self.hits += 1
+                        else:
+                            page = None
+                            self.misses += 1
+                    if page is not None:
+                        response = current_app.response_class(page[1], mimetype=page[2])
+                    else:
+                        response = current_app.make_response(f(*args, **kwargs))
+                        if response.status_code != 200 or response.is_streamed: # Only complete, successful pages are cached
+                            return response
+                        if self.maxsize:
+                            with self._lock:
+                                self._pages[cache_key] = (etag, response.get_data(), response.mimetype)
+                                self._pages.move_to_end(cache_key)
+                                while len(self._pages) > self.maxsize:
+                                    self._pages.popitem(last=False)
+
+                response.set_etag(etag)
+                response.last_modified = int(modified)
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                return response
+            return wrapper
+        return decorator
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._versions.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._pages), "hits": self.hits, "misses": self.misses, "not_modified": self.not_modified}
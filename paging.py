@@ -0,0 +1,74 @@
+import base64
+from datetime import datetime
+import json
+
+from sqlalchemy import and_, func, literal_column, or_
+
+"""
+This module pages through the deck catalogue for /browse, /select and /api/decks.
+
+Pages use keyset (cursor) pagination rather than OFFSET. Each page ends with a cursor holding the sort key of its last deck,
+and the next page starts from the first deck after that key. As every sort is served by an index (ix_decks_creation_time or
+ix_decks_sort_name, which SQLite also orders by ID), a page costs the same however far into the catalogue it is, and decks added
+while someone is browsing can't shift later pages and show a deck twice.
+
+The deck ID is always part of the key, so that decks with the same name or creation time still have a fixed order.
+A deck without a name sorts as if its name were "", since NULL can't be compared with a cursor's key and those decks would never be listed.
+Cursors are opaque to the client: the key is JSON encoded with URL-safe base64, so it can go straight into a query string.
+"""
+
+SORTS = ("newest", "oldest", "name")
+
+def _key_columns(sort):
+    from .models import Deck
+    if sort == "name":
+        return func.coalesce(Deck.name, literal_column("''")), Deck.id # Written out exactly as ix_decks_sort_name is, rather than as a parameter, so SQLite can use it
+    return Deck.creation_time, Deck.id
+
+def _beyond(key, start, descending):
+    # The decks after start in the sort's order. Written out rather than as a row value comparison, which SQLite can't seek to in an expression index.
+    value, deckID = start
+    if descending:
+        return and_(key[0] <= value, or_(key[0] < value, key[1] < deckID))
+    return and_(key[0] >= value, or_(key[0] > value, key[1] > deckID))
+
+def encode_cursor(sort, deck):
+    value = (deck.name or "") if sort == "name" else deck.creation_time.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, deck.id]).encode()).decode().rstrip("=")
+
+def decode_cursor(sort, cursor):
+    # Returns the (sort value, deck ID) key held by a cursor, or None if the cursor isn't valid for this sort
+    try:
+        value, deckID = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if sort != "name":
+            value = datetime.fromisoformat(value)
+        return value, int(deckID)
+    except (ValueError, TypeError):
+        return None
+
+def page_decks(sort="newest", cursor=None, limit=30):
+    """ Returns (decks, next cursor) for one page of decks. The next cursor is None on the last page.
+    An unknown sort falls back to newest, and an invalid cursor to the first page, so a mangled link still shows something.
+    """
+    from .models import Deck
+    if sort not in SORTS:
+        sort = "newest"
+    key = _key_columns(sort)
+    query = Deck.query
+    if sort != "name": # Cursors need a creation time to compare with, so decks without one are only listed by name
+        query = query.filter(Deck.creation_time.isnot(None))
+
+    start = decode_cursor(sort, cursor) if cursor else None
+    if sort == "newest":
+        if start is not None:
+            query = query.filter(_beyond(key, start, True))
+        query = query.order_by(key[0].desc(), key[1].desc())
+    else:
+        if start is not None:
+            query = query.filter(_beyond(key, start, False))
+        query = query.order_by(key[0], key[1])
+
+    decks = query.limit(limit + 1).all() # One extra deck is loaded to find out whether there is another page
+    more = len(decks) > limit
+    decks = decks[:limit]
+    return decks, encode_cursor(sort, decks[-1]) if more else None
@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import hmac
+import threading
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+"""
+This module hashes and checks passwords away from the request path.
+
+A good password hash is slow on purpose (around a tenth of a second of CPU for scrypt), and signup_post and login_post used to work it out
+inline. Under an eventlet or gevent worker every socket shares one thread, so each login stalled every game on that worker until it was done.
+Hashes are now worked out on a small pool of real OS threads. hashlib's scrypt and PBKDF2 release the GIL while they run, so the worker
+keeps handling other requests and socket events in the meantime, and at most PASSWORD_HASH_WORKERS hashes run at once, however many people log in.
+With eventlet or gevent the hub's own native thread pool is used instead (sized by eventlet's EVENTLET_THREADPOOL_SIZE, or gevent's threadpool),
+because their monkey patching would make a normal thread pool out of green threads. PASSWORD_HASH_WORKERS = 0 works hashes out inline, as before.
+
+New passwords are hashed with PASSWORD_HASH_METHOD (any method Werkzeug accepts, e.g. 'scrypt' or 'pbkdf2:sha256:600000').
+Older accounts have 'sha256$salt$hash' hashes from before Werkzeug 2.3, which Werkzeug no longer reads, so those are checked here.
+Whenever a user logs in with a hash made by any other method, or with other settings, it is replaced with a new hash made with PASSWORD_HASH_METHOD.
+"""
+
+LEGACY_METHODS = ("sha1", "sha224", "sha256", "sha384", "sha512", "md5") # Salted HMAC methods which old versions of Werkzeug made
+
+def check_legacy_hash(pwhash, password):
+    # Checks a 'method$salt$hash' hash made by Werkzeug before 2.3, which was an HMAC of the password keyed with the salt
+    method, salt, hashval = pwhash.split("$", 2)
+    if salt:
+        actual = hmac.new(salt.encode(), password.encode(), method).hexdigest()
+    else:
+        actual = hashlib.new(method, password.encode()).hexdigest()
+    return hmac.compare_digest(actual, hashval)
+
+def hash_method(pwhash):
+    # The method and settings part of a hash, e.g. 'scrypt:32768:8:1'
+    return pwhash.split("$", 1)[0] if pwhash else None
+
+def check(pwhash, password):
+    if not pwhash or "$" not in pwhash:
+        return False
+    if hash_method(pwhash) in LEGACY_METHODS:
+        return check_legacy_hash(pwhash, password)
+    try:
+        return check_password_hash(pwhash, password)
+    except ValueError: # An unknown method
+        return False
+
+
+class PasswordHasher():
+    def __init__(self, method="scrypt", workers=2):
+        self.method = method
+        self.workers = workers
+        self._current = None # The method part of a hash made with self.method, e.g. 'scrypt:32768:8:1', found the first time it's needed
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.method = app.config["PASSWORD_HASH_METHOD"]
+        self.workers = app.config["PASSWORD_HASH_WORKERS"]
+        self._current = None
+        app.extensions["quizlive_passwords"] = self
+
+    def _run(self, f, *args):
+        # Runs f on a native thread, waiting without blocking the rest of the worker
+        from . import socketio
+        if not self.workers:
+            return f(*args)
+        mode = getattr(socketio, "async_mode", "threading")
+        if mode == "eventlet":
+            from eventlet import tpool
+            return tpool.execute(f, *args)
+        if mode == "gevent":
+            import gevent
+            return gevent.get_hub().threadpool.apply(f, args)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="quizlive-passwords")
+        return self._executor.submit(f, *args).result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        """ Returns whether password matches pwhash. """
+        return self._run(check, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        # Whether a hash was made by a different method or with different settings from PASSWORD_HASH_METHOD
+        if self._current is None:
+            self._current = hash_method(self._run(generate_password_hash, "", self.method))
+        return hash_method(pwhash) != self._current
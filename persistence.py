@@ -0,0 +1,168 @@
+from collections import namedtuple
+from datetime import datetime
+import atexit
+import queue
+import threading
+import time
+
+"""
+This module records finished matches in the database.
+
+When the last player in a room finishes, handle_answer calls finalise_room exactly once. This works out the result of the match
+and stores it on the room as a MatchSummary, which the results page reads without touching the database.
+The Result row and the rating changes are then handed to the ResultWriter, a background thread which writes many matches in a single transaction.
+This keeps commits (and the SQLite write lock) off the request path, and means the results page can't race to record the same match twice.
+"""
+
+# These are namedtuples so that summaries can't be changed once made. They are shared by both players' results pages.
+PlayerResult = namedtuple("PlayerResult", ["uid", "name", "score", "correct", "elo", "won", "drew"])
+MatchSummary = namedtuple("MatchSummary", ["roomID", "deckID", "total", "players", "finished"])
+
+NEW_PLAYER = (1000, 0, 0) # The (elo, matchcount, wincount) a new account starts with (see auth.py), used for a player whose account was deleted mid-match
+
+""" This is QuizLive's rolling ELO algorithm.
+A player's ELO is the average, over every match they've played, of their opponent's ELO plus 400 for a win or minus 400 for a loss (or a draw).
+It takes a list of (elo, matchcount, wincount, score) tuples for the players before the match, and returns a list of the same tuples after it.
+Every player is rated against their opponent's ELO from before the match, so the order of the players doesn't matter.
+"""
+def rate_match(players):
+    scores = [player[3] for player in players]
+    rated = []
+    for index, (elo, matchcount, wincount, score) in enumerate(players):
+        opponent_elo = players[1 - index][0]
+        elo = elo * matchcount + opponent_elo
+        if score == max(scores) and not score == min(scores): # Check win condition
+            wincount += 1
+            elo += 400
+        elif score == min(scores): # Check loss condition, mutually exclusive with win
+            elo -= 400
+        matchcount += 1
+        rated.append((elo / matchcount, matchcount, wincount, score))
+    return rated
+
+""" Works out the result of a finished room and returns its MatchSummary.
+The ELOs in the summary are worked out from the players' cached identities. The ResultWriter works them out again from the database when it
+records the match, so the database stays correct even if one of the players finished another match at the same time.
+A player whose account has been deleted since the match began has no identity, and is rated as a new player so the match can still finish.
+"""
+def finalise_room(room, identities):
+    players = list(room.players.values())
+    users = [identities.get(player.uid) for player in players]
+    ratings = [NEW_PLAYER if user is None else (user.elo, user.matchcount, user.wincount) for user in users]
+    rated = rate_match([rating + (player.score,) for rating, player in zip(ratings, players)])
+    scores = [player.score for player in players]
+    results = tuple(
+        PlayerResult(player.uid, player.name, player.score, player.correct, rating[0], player.score == max(scores) and player.score != min(scores), max(scores) == min(scores))
+        for player, rating in zip(players, rated)
+    )
+    return MatchSummary(room.roomID, room.deckID, len(room.questions), results, time.time())
+
+
+class ResultWriter():
+    def __init__(self, batch_size=100, interval=0.5):
+        self.batch_size = batch_size # Most matches written in one transaction
+        self.interval = interval # Longest a match waits for others to join its batch
+        self.app = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.listeners = [] # Functions called with (session, summary, users) for each match in a batch, before it is committed. They can return a function to call once it has been.
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config["RESULT_WRITER_BATCH"]
+        self.interval = app.config["RESULT_WRITER_INTERVAL"]
+        app.extensions["quizlive_result_writer"] = self
+        atexit.register(self.flush) # Don't lose matches still waiting in the queue when the server stops
+
+    def submit(self, summary):
+        self._start()
+        self._queue.put(summary)
+
+    def flush(self): # Blocks until every submitted match has been written. Useful for scripts and shutting down.
+        self._queue.join()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="quizlive-result-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()] # Wait for the first match, then give others up to interval seconds to join the batch
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            with self.app.app_context():
+                self._write(batch)
+            for i in range(len(batch)):
+                self._queue.task_done()
+
+    def _write(self, batch):
+        from . import db, identities, page_cache
+        try:
+            recorded, committed = self._record(batch)
+            db.session.commit()
+            self.written += recorded # Only counted once committed, as a failed batch is recorded again below
+            self.batches += 1
+        except Exception:
+            committed = [] # Nothing in the batch was committed
+            # If the batch fails, write the matches one at a time, so that one bad match can't lose the others
+            db.session.rollback()
+            self.app.logger.exception("Writing a batch of %d results failed, retrying them one at a time", len(batch))
+            for summary in batch:
+                try:
+                    recorded, done = self._record([summary])
+                    db.session.commit()
+                    self.written += recorded
+                    committed += done
+                except Exception:
+                    db.session.rollback()
+                    self.failed += 1
+                    self.app.logger.exception("Recording the result of room %s failed", summary.roomID)
+        finally:
+            db.session.remove()
+        for summary in batch: # The players' ELOs and counters have changed, so their cached identities and profile pages are out of date
+            for player in summary.players:
+                identities.invalidate(player.uid)
+                page_cache.bump("user:%d" % player.uid)
+        page_cache.bump("ranks") # Every player's rank may have moved
+        for callback in committed:
+            try:
+                callback()
+            except Exception:
+                self.app.logger.exception("Updating after a batch of results was committed failed")
+
+    def _record(self, batch):
+        # Adds a batch's results and rating changes to the session. Returns how many matches it recorded, and the listeners' functions to call once they're committed.
+        from . import db
+        from .models import User, Result
+        uids = {player.uid for summary in batch for player in summary.players}
+        users = {user.id: user for user in User.query.filter(User.id.in_(uids))} # Every player in the batch is loaded in one query
+        recorded = 0
+        committed = []
+        for summary in batch:
+            if any(player.uid not in users for player in summary.players): # A player's account was deleted before the match was written, so there's nobody to rate
+                self.app.logger.warning("Not recording the result of room %s, as one of its players no longer exists", summary.roomID)
+                continue
+            players = [users[player.uid] for player in summary.players]
+            rated = rate_match([(user.elo, user.matchcount, user.wincount, player.score) for user, player in zip(players, summary.players)])
+            for user, (elo, matchcount, wincount, score) in zip(players, rated):
+                user.elo, user.matchcount, user.wincount = elo, matchcount, wincount
+            db.session.add(Result(roomid=summary.roomID, deck_id=int(summary.deckID), user1=players[0].id, user2=players[1].id, score1=summary.players[0].score, score2=summary.players[1].score, finished=datetime.utcfromtimestamp(summary.finished)))
+            for listener in self.listeners:
+                callback = listener(db.session, summary, players)
+                if callback is not None:
+                    committed.append(callback)
+            recorded += 1
+        return recorded, committed
+
+    def stats(self):
+        return {"pending": self._queue.qsize(), "written": self.written, "batches": self.batches, "failed": self.failed}
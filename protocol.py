@@ -0,0 +1,87 @@
+"""
+This module reads and writes the payloads of the game's socket events, in each version of the protocol.
+
+Version 1 is what the pages used to send. Every join_room, begin_timing and submit_answer carried the whole document.location object,
+which the server turned back into a room ID by splitting its pathname, and every submit_question reply was a dict keyed by field name:
+
+    begin_timing      {"url": {"href": "...", "pathname": "/play/12", ... every other field of the location ...}}
+    submit_answer     {"questionID": 0, "answerID": 3, "url": { ... the location again ... }}
+    submit_question   {"question": "...", "a0": "...", "a1": "...", "a2": "...", "a3": "...", "question_ID": 1, "score": 900}
+    end_quiz          {"roomID": 12}
+
+Version 2 binds the socket to its room once, and after that only sends integers:
+
+    join_room         12                  (the room ID, which is also stored in the socket's session)
+    begin_timing      12                  (likewise)
+    submit_answer     [0, 3]              (question ID, answer ID. The room is the one the socket is bound to.)
+    submit_question   [1, 900, "...", "...", "...", "...", "..."]   (question ID, score, question, then the four answers)
+    end_quiz          12
+
+With PREFETCH_QUESTIONS, version 2 sockets are also sent every question of the match once, when they begin timing, so the page can show the
+next question as soon as an answer is clicked rather than waiting for the server's reply. The correct answers are never sent. The server still
+checks and times every answer as it arrives, and replies with the score instead of the next question:
+
+    questions         [["...", "...", "...", "...", "..."], ...]   (each question, then its four answers, in the order they are asked)
+    score             [1, 900]            (the ID of the next question, and the player's score so far)
+
+The page's clock doesn't matter, as the score still comes from the time between answers arriving at the server. Every answer is delayed by
+about the same network latency, so that latency no longer adds to each question's time.
+
+A page asks for version 2 with auth={"protocol": 2} when it connects, and the connect listener keeps the version in the socket's session.
+Sockets which don't ask are served version 1, so pages loaded before an upgrade keep working until they are reloaded.
+Handlers accept either form of each payload, so the version only decides how replies are written.
+
+Independently of the version, SOCKETIO_SERIALIZER = 'msgpack' sends packets as MessagePack rather than JSON (it needs the msgpack package on
+the server, and the client bundle with the msgpack parser, see assets.py), and browsers negotiate permessage-deflate with simple-websocket and eventlet
+on their own. benchmarks/protocol.py compares the bytes and server CPU of a match for each of these.
+"""
+
+VERSION = 2 # The newest version, which the pages ask for
+
+def negotiate(auth):
+    # The version a connecting socket asked for in its auth data, or 1 if it didn't ask (or asked for one this server doesn't know)
+    try:
+        version = int((auth or {}).get("protocol", 1))
+    except (AttributeError, TypeError, ValueError):
+        return 1
+    return version if 1 <= version <= VERSION else 1
+
+def room_id(data):
+    """ The room ID from a join_room or begin_timing payload, or None if it doesn't have one. """
+    if isinstance(data, dict): # Version 1, e.g. {"url": {"pathname": "/play/12"}}
+        try:
+            return int(data["url"]["pathname"].split("/")[2])
+        except (KeyError, IndexError, TypeError, ValueError):
+            return None
+    try:
+        return int(data)
+    except (TypeError, ValueError):
+        return None
+
+def answer(data):
+    """ (room ID or None, question ID, answer ID) from a submit_answer payload, or None if it isn't one. The room ID is only in version 1 payloads. """
+    try:
+        if isinstance(data, dict):
+            return room_id(data), int(data["questionID"]), int(data["answerID"])
+        questionID, answerID = data
+        return None, int(questionID), int(answerID)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def question(version, payload, questionID, score):
+    """ The submit_question reply for a question dict from the deck cache. """
+    if version >= 2:
+        return [questionID, score, payload["question"], payload["a0"], payload["a1"], payload["a2"], payload["a3"]]
+    return dict(payload, question_ID=questionID, score=score)
+
+def questions(payloads):
+    """ The questions payload: every question dict of a room, without the answers. The dicts from the deck cache never have the answers in them. """
+    return [[payload["question"], payload["a0"], payload["a1"], payload["a2"], payload["a3"]] for payload in payloads]
+
+def scored(questionID, score):
+    # The reply to an answer when the page already has the next question
+    return [questionID, score]
+
+def finished(version, roomID):
+    # The end_quiz payload
+    return roomID if version >= 2 else {"roomID": roomID}
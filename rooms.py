@@ -0,0 +1,118 @@
+from collections import OrderedDict
+import itertools
+import threading
+import time
+
+"""
+This module contains the room registry, which replaces the old global list of rooms.
+
+Rooms are stored in a dict keyed by their ID, so looking one up is O(1) rather than relying on the room ID being its index in a list.
+Every room is also timestamped whenever it is touched, which lets the registry evict rooms that have finished or been abandoned.
+Without this, every room ever created stays in memory (along with its questions and player data) until the server restarts.
+"""
+class RoomRegistry():
+    def __init__(self, finished_ttl=600, idle_ttl=3600, max_rooms=None, sweep_interval=30):
+        self.finished_ttl = finished_ttl # Seconds a finished room is kept for, so both players can still load their results page
+        self.idle_ttl = idle_ttl # Seconds a room can go untouched before it counts as abandoned
+        self.max_rooms = max_rooms # Optional cap on live rooms. None means no cap.
+        self.sweep_interval = sweep_interval # Minimum number of seconds between eviction sweeps
+
+        self._rooms = OrderedDict() # roomID -> room object, ordered from least to most recently touched
+        self._touched = {} # roomID -> time the room was last touched
+        self._finished = OrderedDict() # roomID -> time the room finished, in the order they finished
+        self._ids = itertools.count(1) # Room IDs are never reused, even once the room has been evicted. They start at 1 because Flask-SocketIO treats to=0 as no room at all.
+        self._lock = threading.RLock() # Socket handlers run concurrently, so every change to the registry happens under this lock
+        self._last_sweep = time.monotonic()
+
+        # Counters which can be read via stats() to keep an eye on the registry
+        self.created = 0
+        self.misses = 0
+        self.evicted_finished = 0
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def __contains__(self, roomID):
+        return roomID in self._rooms
+
+    def next_id(self): # Hands out the next unused room ID
+        return next(self._ids)
+
+    def add(self, room_obj):
+        with self._lock:
+            self.sweep()
+            if self.max_rooms is not None: # If the registry is full, make space by evicting the least recently touched rooms
+                while len(self._rooms) >= self.max_rooms:
+                    self._evict(next(iter(self._rooms)))
+                    self.evicted_capacity += 1
+            self._rooms[room_obj.roomID] = room_obj
+            self._touched[room_obj.roomID] = time.monotonic()
+            self.created += 1
+            return room_obj
+
+    def get(self, roomID):
+        # Returns the room with this ID, or None if it doesn't exist or has been evicted.
+        # Getting a room counts as activity, so it is moved to the back of the eviction queue.
+        with self._lock:
+            room_obj = self._rooms.get(roomID)
+            if room_obj is None:
+                self.misses += 1
+                return None
+            self._rooms.move_to_end(roomID)
+            self._touched[roomID] = time.monotonic()
+            return room_obj
+
+    def mark_finished(self, roomID):
+        # Once both players have finished, the room only needs to live long enough for the results to be shown.
+        with self._lock:
+            if roomID in self._rooms and roomID not in self._finished:
+                self._finished[roomID] = time.monotonic()
+
+    def remove(self, roomID):
+        with self._lock:
+            if roomID in self._rooms:
+                self._evict(roomID)
+
+    def _evict(self, roomID):
+        self._rooms.pop(roomID, None)
+        self._touched.pop(roomID, None)
+        self._finished.pop(roomID, None)
+
+    def sweep(self, force=False):
+        """ Evicts finished rooms older than finished_ttl and rooms that haven't been touched for idle_ttl.
+        Both queues are kept in time order, so a sweep stops at the first room that is still fresh and only costs as much as the rooms it evicts.
+        Sweeps are rate limited by sweep_interval unless forced.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+
+            while self._finished:
+                roomID, finished_at = next(iter(self._finished.items()))
+                if now - finished_at < self.finished_ttl:
+                    break
+                self._evict(roomID)
+                self.evicted_finished += 1
+
+            while self._rooms:
+                roomID = next(iter(self._rooms))
+                if now - self._touched[roomID] < self.idle_ttl:
+                    break
+                self._evict(roomID)
+                self.evicted_idle += 1
+
+    def stats(self): # Snapshot of the registry's counters
+        with self._lock:
+            return {
+                "live": len(self._rooms),
+                "finished": len(self._finished),
+                "created": self.created,
+                "misses": self.misses,
+                "evicted_finished": self.evicted_finished,
+                "evicted_idle": self.evicted_idle,
+                "evicted_capacity": self.evicted_capacity,
+            }
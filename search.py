@@ -0,0 +1,133 @@
+import re
+
+"""
+This module searches deck names and question content using SQLite's FTS5 full-text search.
+
+There are two FTS5 tables, decks_fts over decks.name and questions_fts over each question and its four answers.
+Both are "external content" tables: they only hold the search index, and read the text itself from the decks and questions tables.
+Triggers on decks and questions keep the indexes up to date as rows are inserted, edited and deleted, so make_post, add_question,
+the delete routes and anything else that writes those tables never have to remember to update the index.
+The tables and triggers are made by migration 4 (see migrations.py), which also indexes any existing decks and questions.
+
+A search returns decks, ranked by BM25. A match in a deck's name counts for more than a match in one of its questions.
+Only the best QUESTION_CANDIDATES question matches are looked at, so common words stay fast however many questions there are.
+If this SQLite was built without FTS5, migration 4 skips the tables, and searches fall back to matching deck names with LIKE.
+"""
+
+NAME_WEIGHT = 3 # How much more a match in a deck's name counts than a match in one of its questions
+QUESTION_CANDIDATES = 1000
+MIN_PREFIX = 4
+
+SCHEMA = [ # One statement per string, so they can be run inside the migration's transaction
+    "CREATE VIRTUAL TABLE IF NOT EXISTS decks_fts USING fts5(name, content='decks', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='4')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(question, answer1, answer2, answer3, answer4, content='questions', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='4')",
+
+    """CREATE TRIGGER IF NOT EXISTS decks_fts_insert AFTER INSERT ON decks BEGIN
+        INSERT INTO decks_fts (rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS decks_fts_delete AFTER DELETE ON decks BEGIN
+        INSERT INTO decks_fts (decks_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS decks_fts_update AFTER UPDATE OF name ON decks BEGIN
+        INSERT INTO decks_fts (decks_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO decks_fts (rowid, name) VALUES (new.id, new.name);
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+        INSERT INTO questions_fts (rowid, question, answer1, answer2, answer3, answer4) VALUES (new.id, new.question, new.answer1, new.answer2, new.answer3, new.answer4);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN
+        INSERT INTO questions_fts (questions_fts, rowid, question, answer1, answer2, answer3, answer4) VALUES ('delete', old.id, old.question, old.answer1, old.answer2, old.answer3, old.answer4);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE OF question, answer1, answer2, answer3, answer4 ON questions BEGIN
+        INSERT INTO questions_fts (questions_fts, rowid, question, answer1, answer2, answer3, answer4) VALUES ('delete', old.id, old.question, old.answer1, old.answer2, old.answer3, old.answer4);
+        INSERT INTO questions_fts (rowid, question, answer1, answer2, answer3, answer4) VALUES (new.id, new.question, new.answer1, new.answer2, new.answer3, new.answer4);
+    END""",
+]
+
+def fts5_available(conn):
+    return bool(conn.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0])
+
+def create(conn):
+    # Makes the search tables and triggers, then indexes every existing deck and question. Takes a sqlite3 connection.
+    for statement in SCHEMA:
+        conn.execute(statement)
+    rebuild(conn)
+
+def rebuild(conn):
+    # Rebuilds both indexes from the decks and questions tables, e.g. if they were changed while the triggers didn't exist
+    conn.execute("INSERT INTO decks_fts (decks_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO questions_fts (questions_fts) VALUES ('rebuild')")
+
+def match_expression(text):
+    """ Turns what someone typed into an FTS5 query. Each word is quoted, so characters like " and * can't be used to
+    write FTS5 syntax, and the last word is a prefix, so results appear while a word is still being typed.
+    Very short prefixes match so many words that ranking them all would be slow, so the last word is only a prefix from MIN_PREFIX letters.
+    Returns None if there are no words to search for.
+    """
+    words = re.findall(r"\w+", text or "")[:10]
+    if not words:
+        return None
+    return " ".join('"%s"' % word for word in words) + ("*" if len(words[-1]) >= MIN_PREFIX else "")
+
+_indexed = {} # database URL -> whether it has the search tables, so this is only checked once per database
+
+def has_index(conn):
+    url = str(conn.engine.url)
+    if url not in _indexed:
+        _indexed[url] = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'decks_fts'").first() is not None
+    return _indexed[url]
+
+def search_decks(text, limit=30):
+    """ Returns up to limit Deck objects matching the search, best first. """
+    from . import db
+    from .models import Deck
+    expression = match_expression(text)
+    if expression is None:
+        return []
+    conn = db.session.connection()
+    if not has_index(conn):
+        # Without FTS5, match each word against deck names instead
+        query = Deck.query
+        for word in re.findall(r"\w+", text)[:10]:
+            query = query.filter(Deck.name.like("%" + word + "%"))
+        return query.order_by(Deck.name, Deck.id).limit(limit).all()
+
+    # Questions outlive their deck when it's deleted, so matches are joined to decks before grouping, and a page is never cut short by decks that are gone
+    rows = conn.exec_driver_sql("""
+        SELECT matches.deck_id, MIN(matches.score) AS best FROM (
+            SELECT rowid AS deck_id, bm25(decks_fts) * ? AS score FROM decks_fts WHERE decks_fts MATCH ?
+            UNION ALL
+            SELECT questions.deck_id, candidates.score FROM (
+                SELECT rowid AS id, rank AS score FROM questions_fts WHERE questions_fts MATCH ? ORDER BY rank LIMIT ?
+            ) AS candidates JOIN questions ON questions.id = candidates.id
+            WHERE questions.deck_id IS NOT NULL
+        ) AS matches JOIN decks ON decks.id = matches.deck_id
+        GROUP BY matches.deck_id ORDER BY best LIMIT ?
+    """, (NAME_WEIGHT, expression, expression, QUESTION_CANDIDATES, limit)).fetchall() # BM25 scores are negative, and lower is better
+    decks = {deck.id: deck for deck in Deck.query.filter(Deck.id.in_([row[0] for row in rows]))} # A deck deleted since the search ran is left out
+    return [decks[row[0]] for row in rows if row[0] in decks]
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Rebuilds QuizLive's full-text search index from the decks and questions tables.")
+    parser.parse_args()
+
+    from . import create_app, db
+    app = create_app()
+    with app.app_context():
+        raw = db.engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            if not fts5_available(conn):
+                print("This SQLite was built without FTS5, so searches match deck names only")
+                return
+            create(conn)
+            conn.commit()
+            print("Indexed %d decks and %d questions" % (conn.execute("SELECT COUNT(*) FROM decks").fetchone()[0], conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]))
+        finally:
+            raw.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import os
+
+"""
+This module starts a QuizLive server with the async mode chosen in SOCKETIO_ASYNC_MODE, e.g. from the folder above QuizLive:
+
+    python -m QuizLive.serve                          (the mode from QUIZLIVE_SETTINGS, or threading)
+    python -m QuizLive.serve --async-mode eventlet --port 5000
+
+The modes are the ones Flask-SocketIO supports:
+    threading   Werkzeug's development server. Every request and every open socket has its own OS thread, so each connection costs a
+                thread's stack. It's for development and the benchmarks, not for production: Flask-SocketIO refuses to start it outside
+                debug mode unless told to, and this module only tells it to in this mode.
+    eventlet    One OS thread per worker, with a green thread per connection, so thousands of sockets fit in one worker.
+    gevent      The same idea as eventlet, using gevent (with gevent-websocket for WebSocket transport).
+
+eventlet and gevent only work if the standard library is monkey patched before anything else is imported, so that sockets, sleeps,
+locks and queues switch green threads rather than blocking. That is why this module patches first and only then imports QuizLive.
+Under gunicorn, the worker class does the patching instead, e.g.
+
+    gunicorn -k eventlet -w 1 'QuizLive:create_app({"SOCKETIO_ASYNC_MODE": "eventlet"})'
+
+How the blocking parts of QuizLive are adapted to each mode:
+    - Password hashes run on native threads (see passwords.py), as they are slow CPU work which would stall a green worker.
+    - The SQLite state backend opens a connection per green thread, as threading.local is patched to be per green thread. A room's
+      transaction stays open while its handler runs, and the handler can switch green threads part way (e.g. on a SQLAlchemy query),
+      so sharing one connection would let a second green thread issue BEGIN inside the first one's transaction.
+    - SQLAlchemy sessions are scoped to the app context, which Flask keeps per green thread, so they work unchanged. SQLite queries block
+      the worker while they run, but they are short and indexed (see benchmarks/queryplan.py). Commits of match results happen on the
+      results writer's own thread (green in these modes), so they never run inside a socket event.
+    - The matchmaker uses socketio.sleep and start_background_task, which already follow the mode.
+
+How each mode has been checked:
+    threading   tests/ run the socket handlers through Flask-SocketIO's test client, and benchmarks/connections.py and benchmarks/coldstart.py
+                start real servers with this module.
+    eventlet    Not verified. Neither eventlet nor gevent was installed where these modes were added, and the benchmarks skip a mode
+    gevent      whose package is missing. Before deploying one, install it and run benchmarks/connections.py --modes eventlet (or gevent),
+                which starts a server in that mode with this module, opens real WebSocket connections to it and times an acknowledged event.
+
+ASGI (python-socketio's AsyncServer under uvicorn) isn't offered. Flask-SocketIO is WSGI only, and every socket handler in main.py relies on
+Flask's request context (current_user, request.sid, emit), so that mode would need the handlers ported to async python-socketio handlers.
+"""
+
+MODES = ("threading", "eventlet", "gevent")
+
+def configured_mode():
+    # Reads SOCKETIO_ASYNC_MODE from the QUIZLIVE_SETTINGS file, in the same way as create_app, without importing Flask before patching
+    path = os.environ.get("QUIZLIVE_SETTINGS")
+    if not path:
+        return None
+    settings = {"__file__": path}
+    with open(path) as f:
+        exec(compile(f.read(), path, "exec"), settings)
+    return settings.get("SOCKETIO_ASYNC_MODE")
+
+def patch(mode):
+    if mode == "eventlet":
+        import eventlet
+        eventlet.monkey_patch()
+    elif mode == "gevent":
+        from gevent import monkey
+        monkey.patch_all()
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the QuizLive server with the chosen async mode.")
+    parser.add_argument("--async-mode", choices=MODES, help="defaults to SOCKETIO_ASYNC_MODE from QUIZLIVE_SETTINGS, or threading")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    mode = args.async_mode or configured_mode() or "threading"
+    patch(mode) # Must come before QuizLive, Flask or anything else that uses sockets or threads is imported
+
+    from . import create_app, socketio
+    app = create_app({"SOCKETIO_ASYNC_MODE": mode})
+    print("Serving QuizLive on http://%s:%d with async mode %s" % (args.host, args.port, socketio.async_mode))
+    options = {}
+    if mode == "threading": # Werkzeug's development server is only used in this mode, which is for development (see above)
+        options["allow_unsafe_werkzeug"] = True
+    socketio.run(app, host=args.host, port=args.port, debug=args.debug, use_reloader=False, **options)
+
+if __name__ == "__main__":
+    main()
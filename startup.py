@@ -0,0 +1,109 @@
+import os
+import re
+import sys
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+"""
+This module keeps a newly started worker's first requests fast, and reports where its startup time goes.
+
+Templates: Jinja compiles each template to Python the first time it is rendered, which took up to 9ms a template (70ms for them all),
+and every new worker used to pay that on its first requests. Now
+    - compiled templates are kept in a bytecode cache on disk (TEMPLATE_CACHE_DIR, by default jinja-cache in the instance folder),
+      which every worker and every restart shares. Jinja checks each entry against its template's source, so an edited template is compiled again.
+    - with TEMPLATE_PRECOMPILE, create_app loads every template before the worker takes its first request, so no request compiles one.
+      With the bytecode cache warm, that takes a few milliseconds.
+Running python -m QuizLive.startup once when deploying (e.g. while building the image) fills the cache ahead of time.
+
+Imports: modules only a few pages need are imported by those pages instead of when the app starts (e.g. bulk.py and csv, for imports and exports).
+Likewise, what only the command lines and the asset build use (argparse, subprocess, and the downloading and compressing in assets.py) is
+imported inside the functions that use it.
+Most of what's left is Flask, SQLAlchemy and Socket.IO themselves. Under gunicorn, --preload imports the app once in the master process
+before forking, so each worker starts with it already imported.
+
+Every create_app records how long each stage took in a StartupProfile, which is logged and kept in app.extensions["quizlive_startup"].
+python -m QuizLive.startup prints it, and --imports adds the slowest imports, from Python's -X importtime.
+benchmarks/coldstart.py tracks the time from starting a worker to its first response.
+"""
+
+class StartupProfile():
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.stages = [] # (name, seconds), in the order they happened
+        self._last = self.started
+
+    def add(self, name, seconds):
+        self.stages.append((name, seconds))
+
+    def mark(self, name):
+        """ Records the time since the last mark (or since the profile started) as the named stage. """
+        now = time.perf_counter()
+        self.stages.append((name, now - self._last))
+        self._last = now
+
+    @property
+    def total(self):
+        return sum(seconds for name, seconds in self.stages)
+
+    def report(self):
+        lines = ["%-20s %8.1f ms" % (name, seconds * 1000) for name, seconds in self.stages]
+        lines.append("%-20s %8.1f ms" % ("total", self.total * 1000))
+        return "\n".join(lines)
+
+
+def template_cache(app):
+    # The bytecode cache for TEMPLATE_CACHE_DIR, or None if it's turned off with False
+    folder = app.config["TEMPLATE_CACHE_DIR"]
+    if folder is False:
+        return None
+    folder = folder or os.path.join(app.instance_path, "jinja-cache")
+    os.makedirs(folder, exist_ok=True)
+    return FileSystemBytecodeCache(folder)
+
+def init_templates(app):
+    # Flask makes its Jinja environment from jinja_options the first time anything uses app.jinja_env (add_template_global, a render, ...),
+    # so this is called before the extensions are set up. If the environment has been made already anyway, the cache is put on it directly.
+    cache = template_cache(app)
+    if cache is not None:
+        app.jinja_options = dict(app.jinja_options, bytecode_cache=cache)
+        if "jinja_env" in app.__dict__: # jinja_env is a cached property, so it's only in the instance's dict once it has been made
+            app.jinja_env.bytecode_cache = cache
+
+def precompile(app):
+    """ Loads every template into the app's Jinja environment (and the bytecode cache), and returns how many there were. """
+    env = app.jinja_env
+    names = env.list_templates(filter_func=lambda name: name.endswith(".html"))
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+def slowest_imports(package, count=15):
+    # Starts the app in a new interpreter with -X importtime, and returns the packages whose modules took longest to import, as (package, seconds)
+    import subprocess
+    code = "import %s; %s.create_app()" % (package, package)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    totals = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+\d+ \|\s+(\S+)", line)
+        if match: # Each module's own time, not counting the modules it imported, added up by the package it's part of
+            name = match.group(2).split(".")[0]
+            totals[name] = totals.get(name, 0) + int(match.group(1)) / 1e6
+    return sorted(totals.items(), key=lambda item: -item[1])[:count]
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Starts the QuizLive app once, filling the template cache, and prints how long each stage of startup took.")
+    parser.add_argument("--imports", action="store_true", help="also list the slowest imports, from a separate interpreter")
+    args = parser.parse_args()
+
+    from . import create_app
+    app = create_app()
+    print(app.extensions["quizlive_startup"].report())
+    if args.imports:
+        print()
+        for module, seconds in slowest_imports(__package__):
+            print("%-40s %8.1f ms" % (module, seconds * 1000))
+
+if __name__ == "__main__":
+    main()
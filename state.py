@@ -0,0 +1,262 @@
+from contextlib import contextmanager
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from .matchmaking import MatchmakingQueue, MatchPolicy, QueueMetrics, Ticket
+from .rooms import RoomRegistry
+
+"""
+This module contains the state backends, which hold everything about games in progress: the matchmaking queue and the room objects.
+
+The memory backend keeps this state in the process, which is the fastest option but only works when QuizLive runs as a single process.
+The SQLite backend keeps it in a separate SQLite file which every worker process opens, so two players who land on different workers can still play each other.
+Socket.IO events between workers are carried by the message queue set in SOCKETIO_MESSAGE_QUEUE (see create_app).
+
+Both backends offer the same methods:
+    next_room_id()                       -> a room ID which has never been used
+    add_room(room)                       -> stores a newly created room
+    get_room(roomID)                     -> the room, or None. Changes to this copy are not saved.
+    room(roomID)                         -> context manager yielding the room (or None) which saves any changes made to it on exit.
+                                            Nobody else can change the room until the block ends.
+    mark_finished(roomID)                -> lets the room be evicted once finished_ttl has passed
+    enqueue(ticket)                      -> atomically takes the best waiting opponent for a matchmaking Ticket, or queues it if there isn't one
+    cancel_wait(sid)                     -> removes a socket from the matchmaking queue, e.g. when it disconnects
+    sweep_queue()                        -> expires old tickets and matches players whose ELO bands have widened. Returns (matches, expired).
+    stats()                              -> counters for keeping an eye on the backend
+"""
+
+class MemoryBackend():
+    def __init__(self, finished_ttl=600, idle_ttl=3600, max_rooms=None, policy=None):
+        self.rooms = RoomRegistry(finished_ttl=finished_ttl, idle_ttl=idle_ttl, max_rooms=max_rooms)
+        self.matchmaking = MatchmakingQueue(policy)
+        self._room_locks = [threading.Lock() for i in range(64)] # Striped locks, so that players in different rooms don't wait on each other
+
+    def next_room_id(self):
+        return self.rooms.next_id()
+
+    def add_room(self, room_obj):
+        self.rooms.add(room_obj)
+
+    def get_room(self, roomID):
+        return self.rooms.get(roomID)
+
+    @contextmanager
+    def room(self, roomID):
+        with self._room_locks[hash(roomID) % len(self._room_locks)]:
+            yield self.rooms.get(roomID) # Rooms live in this process, so changes are already "saved"
+
+    def mark_finished(self, roomID):
+        self.rooms.mark_finished(roomID)
+
+    def enqueue(self, ticket):
+        return self.matchmaking.enqueue(ticket)
+
+    def cancel_wait(self, sid):
+        return self.matchmaking.cancel(sid)
+
+    def sweep_queue(self):
+        return self.matchmaking.sweep()
+
+    def stats(self):
+        stats = self.rooms.stats()
+        stats.update(self.matchmaking.stats())
+        return stats
+
+
+class SQLiteBackend():
+    def __init__(self, path, finished_ttl=600, idle_ttl=3600, max_rooms=None, policy=None, sweep_interval=30, timeout=10):
+        self.path = path
+        self.policy = policy or MatchPolicy()
+        self.metrics = QueueMetrics() # These counters only cover this worker, as do the room counters below
+        self.created = 0
+        self.misses = 0
+        self.evicted_finished = 0
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+        self.finished_ttl = finished_ttl
+        self.idle_ttl = idle_ttl
+        self.max_rooms = max_rooms
+        self.sweep_interval = sweep_interval
+        self.timeout = timeout # Seconds to wait for another worker to release the database
+        # sqlite3 connections can't be shared between threads, so each thread gets its own. Under eventlet or gevent, threading.local is
+        # patched to be per green thread, which matters as much: room() holds a transaction open while the handler runs, and the handler can
+        # switch green threads (e.g. on a SQLAlchemy query), so another green thread must never issue BEGIN on the same connection.
+        self._local = threading.local()
+        self._last_sweep = 0
+
+        conn = self._conn()
+        conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS rooms (id INTEGER PRIMARY KEY AUTOINCREMENT, data BLOB, touched REAL, finished REAL);
+            CREATE INDEX IF NOT EXISTS ix_rooms_touched ON rooms (touched);
+            CREATE INDEX IF NOT EXISTS ix_rooms_finished ON rooms (finished);
+            CREATE TABLE IF NOT EXISTS tickets (sid TEXT PRIMARY KEY, uid INTEGER, username TEXT, elo REAL, deck_id TEXT, queued REAL);
+            CREATE INDEX IF NOT EXISTS ix_tickets_deck_elo ON tickets (deck_id, elo);
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None stops sqlite3 from opening transactions by itself, so the BEGIN IMMEDIATEs below are in charge of locking
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock straight away, so two workers can't both read a room and then overwrite each other's changes
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def next_room_id(self):
+        # The row is created empty here and filled in by add_room. AUTOINCREMENT makes sure IDs are never reused by any worker.
+        with self._transaction() as conn:
+            return conn.execute("INSERT INTO rooms (touched) VALUES (?)", (time.time(),)).lastrowid
+
+    def add_room(self, room_obj):
+        self.sweep()
+        with self._transaction() as conn:
+            conn.execute("UPDATE rooms SET data = ?, touched = ? WHERE id = ?", (pickle.dumps(room_obj), time.time(), room_obj.roomID))
+            if self.max_rooms is not None: # Evict the least recently touched rooms if there are too many
+                self.evicted_capacity += conn.execute("DELETE FROM rooms WHERE id IN (SELECT id FROM rooms ORDER BY touched DESC LIMIT -1 OFFSET ?)", (self.max_rooms,)).rowcount
+        self.created += 1
+
+    def get_room(self, roomID):
+        # Getting a room counts as activity, as it does in the RoomRegistry, so a room that is only being read (e.g. by the results page) isn't evicted as idle
+        with self._transaction() as conn:
+            conn.execute("UPDATE rooms SET touched = ? WHERE id = ?", (time.time(), roomID))
+            row = conn.execute("SELECT data FROM rooms WHERE id = ?", (roomID,)).fetchone()
+        if row is None or row[0] is None:
+            self.misses += 1
+            return None
+        return pickle.loads(row[0])
+
+    @contextmanager
+    def room(self, roomID):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM rooms WHERE id = ?", (roomID,)).fetchone()
+            room_obj = pickle.loads(row[0]) if row is not None and row[0] is not None else None
+            if room_obj is None:
+                self.misses += 1
+            yield room_obj
+            if room_obj is not None:
+                conn.execute("UPDATE rooms SET data = ?, touched = ? WHERE id = ?", (pickle.dumps(room_obj), time.time(), roomID))
+
+    def mark_finished(self, roomID):
+        with self._transaction() as conn:
+            conn.execute("UPDATE rooms SET finished = ? WHERE id = ? AND finished IS NULL", (time.time(), roomID))
+
+    def sweep(self, force=False):
+        # Same eviction rules as the RoomRegistry, but done with two indexed DELETEs
+        now = time.time()
+        if not force and now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        with self._transaction() as conn:
+            self.evicted_finished += conn.execute("DELETE FROM rooms WHERE finished < ?", (now - self.finished_ttl,)).rowcount
+            self.evicted_idle += conn.execute("DELETE FROM rooms WHERE touched < ?", (now - self.idle_ttl,)).rowcount
+
+    # The matchmaking queue works in the same way as MatchmakingQueue, but the sorted list is replaced by the (deck_id, elo) index on tickets.
+    # The nearest rating above and below are each found with an indexed lookup, so finding an opponent is still logarithmic.
+    _TICKET_COLUMNS = "sid, uid, username, elo, deck_id, queued"
+
+    def enqueue(self, ticket):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM tickets WHERE sid = ?", (ticket.sid,))
+            self.metrics.enqueued += 1
+            candidates = conn.execute("SELECT %s FROM tickets WHERE deck_id = ? AND elo >= ? ORDER BY elo LIMIT 2" % self._TICKET_COLUMNS, (ticket.deckID, ticket.elo)).fetchall()
+            candidates += conn.execute("SELECT %s FROM tickets WHERE deck_id = ? AND elo < ? ORDER BY elo DESC LIMIT 2" % self._TICKET_COLUMNS, (ticket.deckID, ticket.elo)).fetchall()
+            candidates = [other for other in (Ticket(*row) for row in candidates) if self.policy.acceptable(ticket, other, now)]
+            if candidates:
+                opponent = min(candidates, key=lambda other: abs(other.elo - ticket.elo))
+                conn.execute("DELETE FROM tickets WHERE sid = ?", (opponent.sid,))
+                self.metrics.record_match(now - opponent.queued)
+                return opponent
+            conn.execute("INSERT INTO tickets (%s) VALUES (?, ?, ?, ?, ?, ?)" % self._TICKET_COLUMNS, (ticket.sid, ticket.uid, ticket.username, ticket.elo, ticket.deckID, ticket.queued))
+            return None
+
+    def cancel_wait(self, sid):
+        with self._transaction() as conn:
+            if conn.execute("DELETE FROM tickets WHERE sid = ?", (sid,)).rowcount:
+                self.metrics.cancelled += 1
+                return True
+            return False
+
+    def sweep_queue(self):
+        now = time.time()
+        matches = []
+        with self._transaction() as conn:
+            expired = [Ticket(*row) for row in conn.execute("SELECT %s FROM tickets WHERE queued < ?" % self._TICKET_COLUMNS, (now - self.policy.timeout,))]
+            conn.execute("DELETE FROM tickets WHERE queued < ?", (now - self.policy.timeout,))
+            self.metrics.expired += len(expired)
+
+            previous = None
+            for ticket in [Ticket(*row) for row in conn.execute("SELECT %s FROM tickets ORDER BY deck_id, elo" % self._TICKET_COLUMNS)]:
+                if previous is not None and previous.deckID == ticket.deckID and self.policy.acceptable(previous, ticket, now):
+                    conn.execute("DELETE FROM tickets WHERE sid IN (?, ?)", (previous.sid, ticket.sid))
+                    self.metrics.record_match(now - previous.queued)
+                    self.metrics.record_match(now - ticket.queued)
+                    matches.append((previous, ticket))
+                    previous = None
+                else:
+                    previous = ticket
+        return matches, expired
+
+    def stats(self):
+        conn = self._conn()
+        stats = self.metrics.report()
+        stats["live"] = conn.execute("SELECT COUNT(*) FROM rooms").fetchone()[0]
+        stats["finished"] = conn.execute("SELECT COUNT(*) FROM rooms WHERE finished IS NOT NULL").fetchone()[0]
+        stats.update(created=self.created, misses=self.misses, evicted_finished=self.evicted_finished, evicted_idle=self.evicted_idle, evicted_capacity=self.evicted_capacity)
+        stats["queued"], stats["queued_decks"] = conn.execute("SELECT COUNT(*), COUNT(DISTINCT deck_id) FROM tickets").fetchone()
+        stats["queue_depth_max"] = conn.execute("SELECT COALESCE(MAX(depth), 0) FROM (SELECT COUNT(*) AS depth FROM tickets GROUP BY deck_id)").fetchone()[0]
+        return stats
+
+
+"""
+The State object is set up in the same way as the db and socketio objects in __init__.py.
+It is created empty at import time, so main.py can import it, and picks its backend when create_app calls init_app.
+Any attribute not found on State is looked up on the backend, so main.py can call state.get_room() and so on directly.
+"""
+class State():
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        policy = MatchPolicy(
+            base_band=app.config["MATCHMAKING_BASE_BAND"],
+            band_growth=app.config["MATCHMAKING_BAND_GROWTH"],
+            max_band=app.config["MATCHMAKING_MAX_BAND"],
+            timeout=app.config["MATCHMAKING_TIMEOUT"],
+        )
+        options = {
+            "finished_ttl": app.config["ROOM_FINISHED_TTL"],
+            "idle_ttl": app.config["ROOM_IDLE_TTL"],
+            "max_rooms": app.config["MAX_ROOMS"],
+            "policy": policy,
+        }
+        kind = app.config["STATE_BACKEND"]
+        if kind == "memory":
+            self.backend = MemoryBackend(**options)
+        elif kind == "sqlite":
+            path = app.config["STATE_SQLITE_PATH"] or os.path.join(app.instance_path, "state.sqlite")
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.backend = SQLiteBackend(path, **options)
+        else:
+            raise ValueError("Unknown STATE_BACKEND %r, expected 'memory' or 'sqlite'" % kind)
+        app.extensions["quizlive_state"] = self
+
+    def __getattr__(self, name):
+        if self.backend is None:
+            raise RuntimeError("The state backend hasn't been set up yet. Call state.init_app(app) first.")
+        return getattr(self.backend, name)
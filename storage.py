@@ -0,0 +1,86 @@
+from functools import wraps
+
+from flask import g
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+
+"""
+This module tunes how QuizLive uses its SQLite database.
+
+SQLite's defaults suit a single program using the database now and then, not a web server with many requests at once.
+init_app sets these pragmas on every connection the app opens, each from its own config key (None leaves SQLite's default):
+
+    SQLITE_JOURNAL_MODE   'wal' lets readers carry on while a write is being committed, instead of waiting for it
+    SQLITE_SYNCHRONOUS    'normal' is safe with WAL and skips a disk sync on every commit
+    SQLITE_CACHE_SIZE     pages (or KiB if negative) of the database each connection keeps in memory
+    SQLITE_MMAP_SIZE      bytes of the database file read through memory mapping rather than read() calls
+    SQLITE_BUSY_TIMEOUT   milliseconds a connection waits for another's write to finish before giving up with "database is locked"
+
+Pages which only read can also use a separate pool of read connections (SQLITE_READ_POOL_SIZE, 0 to turn this off).
+Read connections are query_only, so they never take the write lock, and they aren't held up waiting for a connection from
+the pool that writes are using. Views opt in with the @read_only decorator.
+The session still sends any flush to the normal connections, so a read_only view which does write something still works.
+"""
+
+def set_pragmas(dbapi_connection, config, query_only=False):
+    cursor = dbapi_connection.cursor()
+    if config["SQLITE_JOURNAL_MODE"]:
+        cursor.execute("PRAGMA journal_mode = %s" % config["SQLITE_JOURNAL_MODE"])
+    if config["SQLITE_SYNCHRONOUS"]:
+        cursor.execute("PRAGMA synchronous = %s" % config["SQLITE_SYNCHRONOUS"])
+    if config["SQLITE_CACHE_SIZE"] is not None:
+        cursor.execute("PRAGMA cache_size = %d" % config["SQLITE_CACHE_SIZE"])
+    if config["SQLITE_MMAP_SIZE"] is not None:
+        cursor.execute("PRAGMA mmap_size = %d" % config["SQLITE_MMAP_SIZE"])
+    if config["SQLITE_BUSY_TIMEOUT"] is not None:
+        cursor.execute("PRAGMA busy_timeout = %d" % config["SQLITE_BUSY_TIMEOUT"])
+    if query_only:
+        cursor.execute("PRAGMA query_only = ON")
+    cursor.close()
+
+
+class Storage():
+    def __init__(self):
+        self.read_engine = None
+
+    def init_app(self, app):
+        # Must be called after db.init_app, and before anything uses the database, so that every connection gets the pragmas
+        from . import db
+        app.extensions["quizlive_storage"] = self
+        config = app.config
+        with app.app_context():
+            engine = db.engine
+        if engine.url.get_backend_name() != "sqlite":
+            return
+        event.listen(engine, "connect", lambda dbapi_connection, record: set_pragmas(dbapi_connection, config))
+
+        database = engine.url.database
+        if config["SQLITE_READ_POOL_SIZE"] and database and database != ":memory:": # An in-memory database can't be opened twice
+            self.read_engine = create_engine(engine.url, pool_size=config["SQLITE_READ_POOL_SIZE"], max_overflow=config["SQLITE_READ_POOL_SIZE"])
+            event.listen(self.read_engine, "connect", lambda dbapi_connection, record: set_pragmas(dbapi_connection, config, query_only=True))
+        else:
+            self.read_engine = None
+
+
+def read_only(f):
+    """ Decorator for views which only read from the database, sending their queries to the read connections. """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.read_only = False
+    return wrapper
+
+
+"""
+The session used by db.session. It is the same as Flask-SQLAlchemy's, except that queries made inside a @read_only view
+are sent to the read connections. Writes (flushes) always go to the normal connections.
+"""
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        from . import storage
+        if bind is None and storage.read_engine is not None and not self._flushing and g and g.get("read_only"):
+            return storage.read_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
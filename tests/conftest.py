@@ -0,0 +1,50 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+"""
+The tests import QuizLive the way python -m does, from the folder above it, whatever the checkout's folder is called.
+
+There is one app for the whole session. Flask-SocketIO only registers main.py's socket handlers with the first app's server,
+so a second create_app in the same process would have no socket events.
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+@pytest.fixture(scope="session")
+def quizlive():
+    return importlib.import_module(os.path.basename(ROOT))
+
+@pytest.fixture(scope="session")
+def folder(tmp_path_factory):
+    return tmp_path_factory.mktemp("quizlive")
+
+@pytest.fixture(scope="session")
+def app(quizlive, folder):
+    return quizlive.create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(folder / "test.sqlite"),
+        "STATE_SQLITE_PATH": str(folder / "state.sqlite"),
+        "TEMPLATE_CACHE_DIR": str(folder / "jinja-cache"),
+        "TESTING": True,
+    })
+
+@pytest.fixture(scope="session")
+def user(quizlive, app):
+    # A player the tests can log in as. Returns their ID.
+    models = importlib.import_module(quizlive.__name__ + ".models")
+    with app.app_context():
+        user = models.User(email="a@test", name="a", password="", friendid="A", elo=1000, wincount=0, matchcount=0)
+        quizlive.db.session.add(user)
+        quizlive.db.session.commit()
+        return user.id
+
+@pytest.fixture
+def client(app, user):
+    # A test client logged in as user
+    web = app.test_client()
+    with web.session_transaction() as session:
+        session["_user_id"] = str(user)
+    return web
@@ -0,0 +1,37 @@
+import importlib
+import io
+
+import pytest
+
+def upload(client, data, filename, **form):
+    return client.post("/decks/import", data=dict(form, file=(io.BytesIO(data), filename)), content_type="multipart/form-data")
+
+@pytest.mark.parametrize("data, filename, form, message", [
+    (b'{"question": "q"}\n', "deck.jsonl", {"format": "xml"}, b"The format must be one of csv, jsonl."),
+    (b"\xff\xfe\x00", "deck.csv", {}, b"The file must be UTF-8 text."),
+    (b"question,answer1,answer2,answer3,answer4,correct\n" + b"q" * 200000 + b",a,b,c,d,1\n", "deck.csv", {}, b"The file isn&#39;t valid CSV."), # Longer than csv.field_size_limit()
+    (b"[1, 2]\n", "deck.jsonl", {}, b"expected a JSON object"),
+])
+def test_bad_imports_are_refused(client, data, filename, form, message):
+    response = upload(client, data, filename, **form)
+    assert response.status_code == 400
+    assert message in response.data
+
+def test_imports_make_a_deck(client):
+    response = upload(client, b"question,answer1,answer2,answer3,answer4,correct\nq,a,b,c,d,2\n", "capitals.csv")
+    assert response.status_code == 302
+
+@pytest.mark.parametrize("format", ["jsonl", "csv"])
+def test_exports_leave_out_questions_without_a_valid_answer(quizlive, app, client, user, format):
+    models = importlib.import_module(quizlive.__name__ + ".models")
+    with app.app_context():
+        deck = models.Deck(name="export", creator="a", uid=user)
+        quizlive.db.session.add(deck)
+        quizlive.db.session.flush()
+        quizlive.db.session.add_all(models.Question(question="q%d" % i, answer1="A", answer2="B", answer3="C", answer4="D", correct=correct, deck_id=deck.id) for i, correct in enumerate(["2", None, "x"]))
+        quizlive.db.session.commit()
+        deckID = deck.id
+    response = client.get("/decks/%d/export.%s" % (deckID, format))
+    assert response.status_code == 200
+    assert b"q0" in response.data and b"q1" not in response.data and b"q2" not in response.data
+    assert upload(client, response.data, "again." + format).status_code == 302 # What was exported can be imported again
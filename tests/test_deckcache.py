@@ -0,0 +1,43 @@
+import importlib
+
+import pytest
+
+@pytest.fixture(scope="module")
+def decks(quizlive, app, user):
+    # Returns the IDs of a deck with questions, some without a usable correct answer, and a deck with none
+    models = importlib.import_module(quizlive.__name__ + ".models")
+    with app.app_context():
+        deck, empty = models.Deck(name="deck", creator="a", uid=user), models.Deck(name="empty", creator="a", uid=user)
+        quizlive.db.session.add_all([deck, empty])
+        quizlive.db.session.flush()
+        quizlive.db.session.add_all(models.Question(question="q%d" % i, answer1="A", answer2="B", answer3="C", answer4="D", correct=correct, deck_id=deck.id) for i, correct in enumerate(["1", None, "x", "4", "9"]))
+        quizlive.db.session.commit()
+        return deck.id, empty.id
+
+def test_questions_without_a_valid_answer_are_left_out(quizlive, app, decks):
+    with app.app_context():
+        deck = quizlive.deck_cache.get(decks[0])
+    assert [payload["question"] for payload in deck.payloads] == ["q0", "q3"]
+    assert list(deck.answers) == [1, 4]
+
+def test_empty_decks_cant_be_queued_for(quizlive, app, client, decks):
+    sock = quizlive.socketio.test_client(app, flask_test_client=client)
+    sock.emit("find_game", {"random": True, "deckID": str(decks[1])})
+    assert [message["name"] for message in sock.get_received()] == ["empty_deck"]
+    assert quizlive.state.stats()["queued"] == 0
+
+def test_a_deck_changed_while_loading_isnt_cached(quizlive, app, decks, monkeypatch):
+    cache = quizlive.deck_cache
+    load = cache._load
+    def load_then_change(deckID): # Another request edits the deck between the query and the snapshot being stored
+        snapshot = load(deckID)
+        cache.invalidate(deckID)
+        return snapshot
+    with app.app_context():
+        cache.invalidate(decks[0])
+        monkeypatch.setattr(cache, "_load", load_then_change)
+        cache.get(decks[0])
+        monkeypatch.undo()
+        misses = cache.stats()["misses"]
+        cache.get(decks[0])
+    assert cache.stats()["misses"] == misses + 1
@@ -0,0 +1,67 @@
+import importlib
+import random
+
+import pytest
+
+def test_rank_tree_matches_a_sorted_list(quizlive):
+    # Random changes to a small tree, which has to grow, are checked against ranks worked out by sorting every score
+    leaderboard = importlib.import_module(quizlive.__name__ + ".leaderboard")
+    tree = leaderboard.RankTree(size=4)
+    scores = {}
+    generator = random.Random(0)
+    for step in range(2000):
+        key = generator.randrange(60)
+        if generator.random() < 0.2:
+            tree.remove(key)
+            scores.pop(key, None)
+        else:
+            score = generator.choice([-5, 0, 3, generator.randrange(3000), generator.uniform(0, 100)])
+            tree.set(key, score)
+            scores[key] = max(int(score), 0)
+        if step % 50 == 0:
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+            expected = [(1 + sum(other > score for other in scores.values()), key, score) for key, score in ranked]
+            assert tree.top(len(scores) + 5) == expected and tree.top(7) == expected[:7]
+            assert all(tree.rank(key) == rank and tree.score(key) == score for rank, key, score in expected)
+            assert len(tree) == len(scores) and tree.rank(1000) is None
+
+
+@pytest.fixture(scope="module")
+def players(quizlive, app):
+    # Two players who have each played a match, as another worker would record it: straight into the database
+    models = importlib.import_module(quizlive.__name__ + ".models")
+    with app.app_context():
+        users = [models.User(email="%s@leaderboard" % name, name=name, password="", friendid="LB" + name, elo=elo, wincount=0, matchcount=1) for name, elo in (("b", 900), ("c", 1100))]
+        quizlive.db.session.add_all(users)
+        quizlive.db.session.commit()
+        return [user.id for user in users]
+
+def test_boards_catch_up_with_new_results_without_reloading(quizlive, app, players, monkeypatch):
+    models = importlib.import_module(quizlive.__name__ + ".models")
+    boards = quizlive.leaderboards
+    with app.app_context():
+        boards.clear()
+        assert boards.rank(players[0])[:2] == (2, 900)
+        monkeypatch.setattr(boards, "ttl", 0)
+        monkeypatch.setattr(boards, "_load", lambda deck_id: pytest.fail("the board was loaded again"))
+        user = quizlive.db.session.get(models.User, players[0])
+        user.elo, user.matchcount = 1500, 2
+        quizlive.db.session.add(models.Result(roomid=1, user1=players[0], user2=players[1], score1=900, score2=0))
+        quizlive.db.session.commit()
+        assert boards.rank(players[0])[:2] == (1, 1500)
+
+def test_boards_only_change_once_a_match_is_committed(quizlive, app, players):
+    models = importlib.import_module(quizlive.__name__ + ".models")
+    persistence = importlib.import_module(quizlive.__name__ + ".persistence")
+    boards = quizlive.leaderboards
+    with app.app_context():
+        boards.clear()
+        before = boards.rank(players[0])[1]
+        users = [quizlive.db.session.get(models.User, uid) for uid in players]
+        users[0].elo = 2000
+        summary = persistence.MatchSummary(1, "1", 1, tuple(persistence.PlayerResult(uid, "", 0, 0, 0, False, True) for uid in players), 0)
+        committed = boards.record(quizlive.db.session, summary, users)
+        assert boards.rank(players[0])[1] == before
+        quizlive.db.session.commit()
+        committed()
+        assert boards.rank(players[0])[1] == 2000
@@ -0,0 +1,78 @@
+import importlib
+import time
+
+import pytest
+
+@pytest.fixture(scope="module")
+def mm(quizlive):
+    return importlib.import_module(quizlive.__name__ + ".matchmaking")
+
+def queue(mm):
+    return mm.MatchmakingQueue(mm.MatchPolicy(base_band=100, band_growth=25, max_band=1000, timeout=120))
+
+def test_players_are_matched_with_the_closest_elo_in_their_band(mm):
+    matchmaking = queue(mm)
+    assert matchmaking.enqueue(mm.Ticket("a", 1, "a", 1000, 1)) is None
+    assert matchmaking.enqueue(mm.Ticket("b", 2, "b", 1080, 1)).sid == "a"
+    assert matchmaking.enqueue(mm.Ticket("c", 3, "c", 1000, 1)) is None
+    assert matchmaking.enqueue(mm.Ticket("d", 4, "d", 1150, 1)) is None # 150 apart is outside both bands
+    assert matchmaking.enqueue(mm.Ticket("e", 5, "e", 1040, 2)) is None # Another deck's queue
+    assert matchmaking.enqueue(mm.Ticket("f", 6, "f", 1090, 1)).sid == "d" # Both c and d are in range, and d is closer
+    assert matchmaking.stats()["queued"] == 2
+
+def test_bands_widen_while_waiting(mm):
+    matchmaking = queue(mm)
+    matchmaking.enqueue(mm.Ticket("a", 1, "a", 1000, 1, queued=time.time() - 5)) # Waited 5 seconds, so its band is 225
+    assert matchmaking.enqueue(mm.Ticket("b", 2, "b", 1200, 1)).sid == "a"
+    matchmaking.enqueue(mm.Ticket("c", 3, "c", 1000, 1))
+    matchmaking.enqueue(mm.Ticket("d", 4, "d", 1300, 1))
+    assert matchmaking.sweep() == ([], [])
+    matchmaking._tickets["c"][2].queued -= 10 # c's band has now grown to 350
+    matches, expired = matchmaking.sweep()
+    assert [(a.sid, b.sid) for a, b in matches] == [("c", "d")] and expired == []
+
+def test_players_cant_play_themselves_and_time_out(mm):
+    matchmaking = queue(mm)
+    matchmaking.enqueue(mm.Ticket("a", 1, "a", 1000, 1, queued=time.time() - 200))
+    assert matchmaking.enqueue(mm.Ticket("b", 1, "a", 1000, 1)) is None # The same user from another tab
+    matches, expired = matchmaking.sweep()
+    assert matches == [] and [ticket.sid for ticket in expired] == ["a"]
+    assert matchmaking.stats()["queued"] == 1 and matchmaking.cancel("b") and len(matchmaking) == 0
+
+
+@pytest.fixture(scope="module")
+def deck(quizlive, app, user):
+    # A playable deck, and a second player to be matched with the session's user. Returns (deck ID, the second player's ID).
+    models = importlib.import_module(quizlive.__name__ + ".models")
+    with app.app_context():
+        deck = models.Deck(name="matchmaking", creator="a", uid=user)
+        opponent = models.User(email="m@matchmaking", name="m", password="", friendid="MM", elo=1000, wincount=0, matchcount=0)
+        quizlive.db.session.add_all([deck, opponent])
+        quizlive.db.session.flush()
+        quizlive.db.session.add(models.Question(question="q", answer1="A", answer2="B", answer3="C", answer4="D", correct="1", deck_id=deck.id))
+        quizlive.db.session.commit()
+        return deck.id, opponent.id
+
+def connect(quizlive, app, uid):
+    web = app.test_client()
+    with web.session_transaction() as session:
+        session["_user_id"] = str(uid)
+    return quizlive.socketio.test_client(app, flask_test_client=web)
+
+@pytest.mark.parametrize("data", [{"random": True, "deckID": "twelve"}, {"random": True}, "12"])
+def test_find_game_refuses_a_bad_deck_id(quizlive, app, user, data):
+    sock = connect(quizlive, app, user)
+    sock.emit("find_game", data)
+    assert [message["name"] for message in sock.get_received()] == ["empty_deck"]
+
+def test_players_are_told_when_their_match_cant_start(quizlive, app, user, deck, monkeypatch):
+    def fail(room):
+        raise RuntimeError("the state backend is down")
+    monkeypatch.setattr(quizlive.state, "add_room", fail)
+    socks = [connect(quizlive, app, uid) for uid in (user, deck[1])]
+    for sock in socks:
+        sock.emit("find_game", {"random": True, "deckID": str(deck[0])})
+    assert [message["name"] for message in socks[0].get_received()] == ["waiting", "match_failed"]
+    assert [message["name"] for message in socks[1].get_received()] == ["match_failed"]
+    for sock in socks:
+        sock.disconnect()
@@ -0,0 +1,61 @@
+import importlib
+import sqlite3
+
+import pytest
+
+@pytest.fixture(scope="module")
+def migrations(quizlive):
+    return importlib.import_module(quizlive.__name__ + ".migrations")
+
+def schema(conn):
+    return sorted(conn.execute("SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL").fetchall())
+
+def test_migrations_can_be_applied_again(quizlive, app, migrations):
+    # Every migration has to work on a database which already has everything in it, and applying them again must change nothing
+    with app.app_context():
+        with quizlive.db.engine.connect() as conn:
+            before = schema(conn.connection.driver_connection)
+            assert conn.exec_driver_sql("PRAGMA user_version").scalar() == migrations.latest()
+            conn.exec_driver_sql("PRAGMA user_version = 0")
+        assert migrations.upgrade(quizlive.db) == [number for number, description, f in migrations.MIGRATIONS]
+        assert migrations.upgrade(quizlive.db) == []
+        with quizlive.db.engine.connect() as conn:
+            assert schema(conn.connection.driver_connection) == before
+            assert conn.exec_driver_sql("PRAGMA user_version").scalar() == migrations.latest()
+
+def old_database():
+    # users and friends as they were before migration 2, without its unique indexes
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY, friendid TEXT);
+        CREATE TABLE friends (id INTEGER PRIMARY KEY, uid INTEGER, friendid TEXT);
+        INSERT INTO users (id, friendid) VALUES (1, 'X'), (2, 'Y');
+        INSERT INTO friends (uid, friendid) VALUES (1, 'Y'), (1, 'Y'), (2, 'X');
+    """)
+    return conn
+
+def test_repeated_friendships_are_removed(migrations):
+    conn = old_database()
+    migrations.unique_friends(conn)
+    migrations.unique_friends(conn)
+    assert conn.execute("SELECT id, uid, friendid FROM friends ORDER BY id").fetchall() == [(1, 1, "Y"), (3, 2, "X")]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO friends (uid, friendid) VALUES (1, 'Y')")
+
+def test_shared_friend_ids_stop_the_migration(migrations):
+    conn = old_database()
+    conn.execute("INSERT INTO users (id, friendid) VALUES (3, 'X')")
+    with pytest.raises(RuntimeError, match="X"):
+        migrations.unique_friends(conn)
+    assert conn.execute("SELECT COUNT(*) FROM friends").fetchone()[0] == 3 # Nothing was changed
+
+def test_the_same_friend_cant_be_added_twice(quizlive, app, client):
+    models = importlib.import_module(quizlive.__name__ + ".models")
+    with app.app_context():
+        quizlive.db.session.add(models.User(email="f@migrations", name="f", password="", friendid="FRIEND", elo=1000, wincount=0, matchcount=0))
+        quizlive.db.session.commit()
+    assert client.post("/profile", data={"friendid": "FRIEND"}).status_code == 302
+    response = client.post("/profile", data={"friendid": "FRIEND"}, follow_redirects=True)
+    assert b"already your friend" in response.data
+    with app.app_context():
+        assert models.Friend.query.filter_by(friendid="FRIEND").count() == 1
@@ -0,0 +1,65 @@
+import importlib
+
+import pytest
+from flask import Flask, flash, get_flashed_messages
+
+@pytest.fixture
+def site(quizlive):
+    # A small app with one cached page made from the "things" key, which counts how many times its view has run
+    pagecache = importlib.import_module(quizlive.__name__ + ".pagecache")
+    app = Flask(__name__)
+    app.secret_key = "test"
+    cache = pagecache.PageCache(maxsize=10, ttl=60)
+    renders = []
+
+    @app.route("/things/<int:id>")
+    @cache.cached(lambda id: ["things", "thing:%d" % id])
+    def things(id):
+        renders.append(id)
+        return "things %d, render %d%s" % (id, len(renders), "".join(get_flashed_messages())) # Shows messages, as every QuizLive page does
+
+    @app.route("/flash")
+    def flash_message():
+        flash("hello")
+        return "flashed"
+
+    return app.test_client(), cache, renders
+
+def test_repeat_views_are_cached_and_answered_with_304(site):
+    web, cache, renders = site
+    first = web.get("/things/1")
+    assert first.status_code == 200 and first.headers["Cache-Control"] == "private, no-cache"
+    etag = first.headers["ETag"]
+    again = web.get("/things/1")
+    assert again.data == first.data and again.headers["ETag"] == etag
+    conditional = web.get("/things/1", headers={"If-None-Match": etag})
+    assert conditional.status_code == 304 and conditional.data == b""
+    dated = web.get("/things/1", headers={"If-Modified-Since": first.headers["Last-Modified"]})
+    assert dated.status_code == 304
+    assert renders == [1]
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "not_modified": 2}
+
+def test_bumping_a_key_changes_the_etag(site):
+    web, cache, renders = site
+    etags = {id: web.get("/things/%d" % id).headers["ETag"] for id in (1, 2)}
+    cache.bump("thing:2") # Only page 2 is made from thing:2
+    assert web.get("/things/1", headers={"If-None-Match": etags[1]}).status_code == 304
+    changed = web.get("/things/2", headers={"If-None-Match": etags[2]})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etags[2] and changed.data == b"things 2, render 3"
+    cache.bump("things") # Both pages are made from things
+    assert all(web.get("/things/%d" % id, headers={"If-None-Match": etags[id]}).status_code == 200 for id in (1, 2))
+    assert renders == [1, 2, 2, 1, 2]
+
+def test_versions_expire_after_the_ttl(site):
+    web, cache, renders = site
+    cache.ttl = 0 # Every version is already too old, as if every key had been bumped on another worker
+    etag = web.get("/things/1").headers["ETag"]
+    assert web.get("/things/1", headers={"If-None-Match": etag}).status_code == 200
+    assert renders == [1, 1]
+
+def test_pages_are_not_cached_while_a_message_is_waiting(site):
+    web, cache, renders = site
+    web.get("/things/1")
+    web.get("/flash")
+    assert web.get("/things/1").data == b"things 1, render 2hello" # The view ran, so the message was shown
+    assert web.get("/things/1").data == b"things 1, render 1" # and the page with the message in wasn't cached
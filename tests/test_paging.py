@@ -0,0 +1,17 @@
+import importlib
+
+def test_unnamed_decks_are_paged_by_name(quizlive, app, user):
+    models = importlib.import_module(quizlive.__name__ + ".models")
+    paging = importlib.import_module(quizlive.__name__ + ".paging")
+    with app.app_context():
+        decks = [models.Deck(name=name, creator="a", uid=user) for name in (None, "aa", None, "ab")]
+        quizlive.db.session.add_all(decks)
+        quizlive.db.session.commit()
+        ids = {deck.id for deck in decks}
+        seen, cursor = [], None
+        while True: # One deck a page, so every deck is reached through a cursor
+            page, cursor = paging.page_decks("name", cursor, 1)
+            seen += [deck.id for deck in page if deck.id in ids]
+            if cursor is None:
+                break
+    assert seen == [decks[0].id, decks[2].id, decks[1].id, decks[3].id]
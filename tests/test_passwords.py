@@ -0,0 +1,42 @@
+import hashlib
+import hmac
+import importlib
+
+import pytest
+
+def legacy_hash(password, salt="pepper"):
+    # A 'sha256$salt$hash' hash as Werkzeug made them before 2.3
+    return "sha256$%s$%s" % (salt, hmac.new(salt.encode(), password.encode(), "sha256").hexdigest())
+
+def test_legacy_hashes_are_checked(quizlive):
+    passwords = importlib.import_module(quizlive.__name__ + ".passwords")
+    assert passwords.check(legacy_hash("hunter2"), "hunter2")
+    assert not passwords.check(legacy_hash("hunter2"), "hunter3")
+    assert passwords.check("md5$$" + hashlib.md5(b"hunter2").hexdigest(), "hunter2") # Unsalted
+    assert not passwords.check("nonsense$salt$hash", "hunter2") and not passwords.check("", "hunter2")
+
+@pytest.fixture(scope="module")
+def legacy_user(quizlive, app):
+    models = importlib.import_module(quizlive.__name__ + ".models")
+    with app.app_context():
+        user = models.User(email="l@passwords", name="l", password=legacy_hash("hunter2"), friendid="LEGACY", elo=1000, wincount=0, matchcount=0)
+        quizlive.db.session.add(user)
+        quizlive.db.session.commit()
+        return user.id
+
+def stored_hash(quizlive, app, uid):
+    models = importlib.import_module(quizlive.__name__ + ".models")
+    with app.app_context():
+        return quizlive.db.session.get(models.User, uid).password
+
+def test_legacy_hashes_are_upgraded_on_login(quizlive, app, legacy_user):
+    wrong = app.test_client().post("/login", data={"email": "l@passwords", "password": "hunter3"})
+    assert wrong.headers["Location"].endswith("/login") and stored_hash(quizlive, app, legacy_user) == legacy_hash("hunter2")
+
+    right = app.test_client().post("/login", data={"email": "l@passwords", "password": "hunter2"})
+    assert right.headers["Location"].endswith("/profile")
+    upgraded = stored_hash(quizlive, app, legacy_user)
+    assert not quizlive.password_hasher.needs_rehash(upgraded) and upgraded.startswith(app.config["PASSWORD_HASH_METHOD"])
+
+    again = app.test_client().post("/login", data={"email": "l@passwords", "password": "hunter2"}) # The new hash works, and isn't replaced again
+    assert again.headers["Location"].endswith("/profile") and stored_hash(quizlive, app, legacy_user) == upgraded
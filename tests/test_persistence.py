@@ -0,0 +1,30 @@
+import importlib
+from types import SimpleNamespace
+
+def test_a_deleted_player_is_rated_as_a_new_player(quizlive):
+    persistence = importlib.import_module(quizlive.__name__ + ".persistence")
+    players = {uid: SimpleNamespace(uid=uid, name="p%d" % uid, score=score, correct=score // 900) for uid, score in ((1, 900), (2, 0))}
+    room = SimpleNamespace(roomID=7, deckID="1", questions=[0], players=players)
+    identities = {1: SimpleNamespace(elo=1200, matchcount=4, wincount=2)} # Player 2's account has gone
+    summary = persistence.finalise_room(room, identities)
+    assert [player.elo for player in summary.players] == [(1200 * 4 + 1000 + 400) / 5, 1200 - 400]
+    assert summary.players[0].won and not summary.players[1].won
+
+def test_matches_are_counted_once_they_are_committed(quizlive, app, user):
+    models = importlib.import_module(quizlive.__name__ + ".models")
+    persistence = importlib.import_module(quizlive.__name__ + ".persistence")
+    with app.app_context():
+        opponent = models.User(email="o@persistence", name="o", password="", friendid="PO", elo=1000, wincount=0, matchcount=0)
+        quizlive.db.session.add(opponent)
+        quizlive.db.session.commit()
+        players = tuple(persistence.PlayerResult(uid, "", 0, 0, 1000, False, True) for uid in (user, opponent.id))
+        good, bad = persistence.MatchSummary(1, "1", 1, players, 0), persistence.MatchSummary(2, "1", 1, players, 0)
+
+        def listener(session, summary, users):
+            if summary is bad:
+                raise RuntimeError("this match can't be written")
+        writer = persistence.ResultWriter()
+        writer.app = app
+        writer.listeners.append(listener)
+        writer._write([good, bad]) # The batch fails, then each match is tried on its own
+    assert writer.stats() == {"pending": 0, "written": 1, "batches": 0, "failed": 1}
@@ -0,0 +1,50 @@
+import importlib
+
+import pytest
+
+@pytest.fixture(scope="module")
+def protocol(quizlive):
+    return importlib.import_module(quizlive.__name__ + ".protocol")
+
+URL = {"href": "http://localhost:5000/play/12", "pathname": "/play/12", "host": "localhost:5000"} # A version 1 page's document.location
+
+@pytest.mark.parametrize("auth, version", [(None, 1), ({}, 1), ({"protocol": 2}, 2), ({"protocol": "2"}, 2), ({"protocol": 99}, 1), ({"protocol": "x"}, 1), ("junk", 1)])
+def test_negotiate(protocol, auth, version):
+    assert protocol.negotiate(auth) == version
+
+@pytest.mark.parametrize("data, roomID", [({"url": URL}, 12), (12, 12), ("12", 12), ({"url": {"pathname": "/play"}}, None), ({}, None), (None, None), ([12], None)])
+def test_room_id(protocol, data, roomID):
+    assert protocol.room_id(data) == roomID
+
+@pytest.mark.parametrize("data, answer", [
+    ({"questionID": 0, "answerID": 3, "url": URL}, (12, 0, 3)), # Version 1
+    ([0, 3], (None, 0, 3)), # Version 2
+    (["1", "4"], (None, 1, 4)),
+    (5, None),
+    ([1], None),
+    ([1, 2, 3], None),
+    (["a", 1], None),
+    ({"questionID": 0}, None),
+    (None, None),
+])
+def test_answer(protocol, data, answer):
+    assert protocol.answer(data) == answer
+
+def test_replies_round_trip(protocol):
+    payload = {"question": "q", "a0": "A", "a1": "B", "a2": "C", "a3": "D"}
+    assert protocol.question(1, payload, 2, 900) == dict(payload, question_ID=2, score=900)
+    version2 = protocol.question(2, payload, 2, 900)
+    assert version2 == [2, 900, "q", "A", "B", "C", "D"] and protocol.questions([payload]) == [version2[2:]] # The page shows both the same way
+    assert protocol.scored(3, 1800) == [3, 1800]
+    assert protocol.finished(1, 12) == {"roomID": 12} and protocol.finished(2, 12) == 12
+    assert protocol.room_id(protocol.finished(2, 12)) == 12
+
+@pytest.mark.parametrize("data", [5, [1], "x", None, {"questionID": "x", "answerID": 1}])
+def test_malformed_answers_are_ignored(quizlive, app, user, data):
+    web = app.test_client()
+    with web.session_transaction() as session:
+        session["_user_id"] = str(user)
+    sock = quizlive.socketio.test_client(app, flask_test_client=web, auth={"protocol": 2})
+    sock.emit("submit_answer", data)
+    assert sock.get_received() == []
+    sock.disconnect()
@@ -0,0 +1,47 @@
+import importlib
+
+import pytest
+
+@pytest.fixture(scope="module")
+def models(quizlive):
+    return importlib.import_module(quizlive.__name__ + ".models")
+
+@pytest.fixture(scope="module")
+def search(quizlive):
+    return importlib.import_module(quizlive.__name__ + ".search")
+
+def add_deck(quizlive, models, user, name, questions=()):
+    deck = models.Deck(name=name, creator="a", uid=user)
+    quizlive.db.session.add(deck)
+    quizlive.db.session.flush()
+    quizlive.db.session.add_all(models.Question(question=question, answer1="A", answer2="B", answer3="C", answer4="D", correct="1", deck_id=deck.id) for question in questions)
+    quizlive.db.session.commit()
+    return deck
+
+def names(search, text, limit=30):
+    return [deck.name for deck in search.search_decks(text, limit)]
+
+def test_the_index_follows_inserts_edits_and_deletes(quizlive, app, models, search, user):
+    with app.app_context():
+        deck = add_deck(quizlive, models, user, "Volcanoes", ["Which volcano buried Pompeii?"])
+        assert names(search, "volcanoes") == ["Volcanoes"]
+        assert names(search, "pompeii") == ["Volcanoes"] # Found through its question
+        deck.name = "Mountains"
+        question = deck.questions.first()
+        question.question = "Which mountain is the tallest?"
+        quizlive.db.session.commit()
+        assert names(search, "volcanoes") == [] and names(search, "pompeii") == []
+        assert names(search, "mountains") == ["Mountains"] and names(search, "tallest") == ["Mountains"]
+        quizlive.db.session.delete(question)
+        quizlive.db.session.commit()
+        assert names(search, "tallest") == []
+        quizlive.db.session.execute(quizlive.db.text("INSERT INTO decks_fts (decks_fts, rank) VALUES ('integrity-check', 1)")) # Raises if the index and the table differ
+        quizlive.db.session.execute(quizlive.db.text("INSERT INTO questions_fts (questions_fts, rank) VALUES ('integrity-check', 1)"))
+
+def test_deleted_decks_dont_take_up_a_page(quizlive, app, models, search, user):
+    with app.app_context():
+        gone = [add_deck(quizlive, models, user, "Gone%d" % i, ["Rivers of Europe"] * 3) for i in range(3)]
+        kept = add_deck(quizlive, models, user, "Kept", ["Rivers of Asia"])
+        quizlive.db.session.execute(models.Deck.__table__.delete().where(models.Deck.id.in_([deck.id for deck in gone]))) # Deleted outside the ORM, which would have unlinked their questions
+        quizlive.db.session.commit()
+        assert names(search, "rivers", limit=1) == ["Kept"]
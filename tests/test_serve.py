@@ -0,0 +1,15 @@
+import importlib
+import sys
+
+import pytest
+
+@pytest.mark.parametrize("mode, unsafe", [("threading", True), ("eventlet", None), ("gevent", None)])
+def test_werkzeug_is_only_allowed_in_threading_mode(quizlive, app, monkeypatch, mode, unsafe):
+    serve = importlib.import_module(quizlive.__name__ + ".serve")
+    runs = []
+    monkeypatch.setattr(serve, "patch", lambda mode: None) # Nothing is really patched or served
+    monkeypatch.setattr(quizlive, "create_app", lambda config: app)
+    monkeypatch.setattr(quizlive.socketio, "run", lambda app, **options: runs.append(options))
+    monkeypatch.setattr(sys, "argv", ["serve", "--async-mode", mode])
+    serve.main()
+    assert runs[0].get("allow_unsafe_werkzeug") is unsafe
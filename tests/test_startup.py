@@ -0,0 +1,18 @@
+import importlib
+import pathlib
+
+from flask import Flask
+from jinja2 import FileSystemBytecodeCache
+
+def test_templates_use_the_bytecode_cache(app):
+    # Extensions set up by create_app mustn't make the Jinja environment before init_templates has given it the cache
+    assert isinstance(app.jinja_env.bytecode_cache, FileSystemBytecodeCache)
+    assert any(pathlib.Path(app.config["TEMPLATE_CACHE_DIR"]).iterdir()) # TEMPLATE_PRECOMPILE filled it
+
+def test_template_cache_can_be_turned_off(quizlive):
+    # A second create_app would take over the socket server from the session's app (see conftest.py), so this uses a bare app
+    startup = importlib.import_module(quizlive.__name__ + ".startup")
+    app = Flask(__name__)
+    app.config["TEMPLATE_CACHE_DIR"] = False
+    startup.init_templates(app)
+    assert app.jinja_env.bytecode_cache is None
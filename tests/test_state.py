@@ -0,0 +1,90 @@
+import importlib
+import time
+from types import SimpleNamespace
+
+import pytest
+
+@pytest.fixture(scope="module")
+def states(quizlive):
+    return importlib.import_module(quizlive.__name__ + ".state")
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, states, tmp_path):
+    # Each test gets a fresh backend of each kind, which holds at most 2 rooms
+    policy = states.MatchPolicy(base_band=100, band_growth=25, max_band=1000, timeout=120)
+    if request.param == "memory":
+        return states.MemoryBackend(max_rooms=2, policy=policy)
+    return states.SQLiteBackend(str(tmp_path / "state.sqlite"), max_rooms=2, policy=policy)
+
+def add(backend, **fields):
+    room_obj = SimpleNamespace(roomID=backend.next_room_id(), **fields)
+    backend.add_room(room_obj)
+    return room_obj.roomID
+
+def test_rooms_are_saved_by_the_room_block(backend):
+    roomID = add(backend, answers=[])
+    with backend.room(roomID) as room_obj:
+        room_obj.answers.append(1)
+    assert backend.get_room(roomID).answers == [1]
+    with backend.room(roomID + 100) as room_obj:
+        assert room_obj is None
+    assert backend.get_room(roomID + 100) is None
+    assert backend.stats()["created"] == 1 and backend.stats()["misses"] == 2
+
+def test_reading_a_room_keeps_it_from_being_evicted(backend):
+    first = add(backend)
+    second = add(backend)
+    time.sleep(0.01)
+    backend.get_room(first) # first is now the most recently used, so second is the one evicted for the third room
+    third = add(backend)
+    assert backend.get_room(second) is None
+    assert backend.get_room(first) is not None and backend.get_room(third) is not None
+    stats = backend.stats()
+    assert stats["live"] == 2 and stats["created"] == 3 and stats["evicted_capacity"] == 1
+
+def sweep(backend):
+    if hasattr(backend, "rooms"):
+        backend.rooms.sweep(force=True)
+    else:
+        backend.sweep(force=True)
+
+def age(backend, seconds):
+    # Makes every queued ticket look as if it had waited seconds longer
+    if hasattr(backend, "matchmaking"):
+        for entry in backend.matchmaking._tickets.values():
+            entry[2].queued -= seconds
+    else:
+        backend._conn().execute("UPDATE tickets SET queued = queued - ?", (seconds,))
+
+def test_finished_and_idle_rooms_are_swept(states, tmp_path):
+    for backend in (states.MemoryBackend(finished_ttl=0.05, idle_ttl=0.2), states.SQLiteBackend(str(tmp_path / "sweep.sqlite"), finished_ttl=0.05, idle_ttl=0.2)):
+        finished = add(backend)
+        idle = add(backend)
+        backend.mark_finished(finished)
+        time.sleep(0.1)
+        backend.get_room(idle) # Still in use, so only the finished room goes
+        sweep(backend)
+        assert backend.get_room(finished) is None and backend.get_room(idle) is not None
+        time.sleep(0.25)
+        sweep(backend)
+        stats = backend.stats()
+        assert stats["evicted_finished"] == 1 and stats["evicted_idle"] == 1 and stats["live"] == 0
+
+def test_queue_matches_within_widening_bands(states, backend):
+    Ticket = states.Ticket
+    assert backend.enqueue(Ticket("a", 1, "a", 1000, "1")) is None
+    assert backend.enqueue(Ticket("b", 2, "b", 1150, "1")) is None # 150 apart is outside both bands
+    assert backend.enqueue(Ticket("c", 3, "c", 1040, "2")) is None # Another deck's queue
+    assert backend.enqueue(Ticket("d", 4, "d", 1120, "1")).sid == "b" # a is 120 away, outside both bands
+    assert backend.enqueue(Ticket("e", 1, "a", 1000, "1")) is None # The same user as a, from another tab
+    assert backend.cancel_wait("e") and not backend.cancel_wait("e")
+    assert backend.enqueue(Ticket("f", 6, "f", 1300, "1")) is None
+    assert backend.sweep_queue() == ([], [])
+
+    age(backend, 10) # The bands have grown to 350, so a and f are now in range
+    matches, expired = backend.sweep_queue()
+    assert [(x.sid, y.sid) for x, y in matches] == [("a", "f")] and expired == []
+    age(backend, 200)
+    matches, expired = backend.sweep_queue()
+    assert matches == [] and [ticket.sid for ticket in expired] == ["c"]
+    assert backend.stats()["queued"] == 0